@@ -0,0 +1,341 @@
+"""
+Asyncio client library for the 2PC system. One AsyncClient2PC runs any number of requests concurrently from a
+single event loop over keep-alive connections, and caches the leaders of the coordinator group and of every
+participant cluster:
+
+    async with AsyncClient2PC() as client:
+        response = await client.transact({'AccountA': -100, 'AccountB': 100})
+        async for position, response in client.transact_many(transfers, concurrency=64):
+            ...
+"""
+import asyncio
+import json
+import time
+import uuid
+from config import NODES, COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES, LOG_PAGE_SIZE
+from config import CONNECTION_IDLE_TIMEOUT, CLIENT_MAX_CONNECTIONS_PER_NODE
+from leader_directory import LeaderDirectory, is_not_leader
+from retry_policy import RetryPolicy
+
+# Largest response line read from a node (GetLogs pages can be large)
+MAX_RESPONSE_SIZE = 64 * 1024 * 1024
+
+
+class NodeConnections:
+    """
+    Keep-alive connections to one node. Each connection carries one RPC at a time; at most `max_connections` are
+    open at once (callers hold `slots` around exchange()). Connections idle for more than `max_idle` seconds are
+    closed instead of reused, so the node never closes one under a request.
+    """
+    def __init__(self, ip, port, max_connections, max_idle):
+        self.ip = ip
+        self.port = port
+        self.max_idle = max_idle
+        self.idle = []  # [(reader, writer, last_used)], most recently used last
+        self.slots = asyncio.Semaphore(max_connections)
+
+    def _take_idle(self):
+        """Returns a reusable idle connection, closing the ones idle for too long, or None."""
+        now = time.monotonic()
+        while self.idle:
+            reader, writer, last_used = self.idle.pop()
+            if now - last_used < self.max_idle and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def exchange(self, rpc_type, data):
+        """Sends one RPC and returns its response. Raises on connection errors; the connection is then dropped."""
+        connection = self._take_idle()
+        if connection is None:
+            connection = await asyncio.open_connection(self.ip, self.port, limit=MAX_RESPONSE_SIZE)
+        reader, writer = connection
+        try:
+            writer.write(json.dumps({'rpc_type': rpc_type, 'data': data, 'keep_alive': True}).encode())
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError('Connection closed by the node')
+            response = json.loads(line)
+        except BaseException:
+            writer.close()  # Also on timeouts: a late response must not be read by the next RPC
+            raise
+        self.idle.append((reader, writer, time.monotonic()))
+        return response
+
+    def close(self):
+        while self.idle:
+            _, writer, _ = self.idle.pop()
+            writer.close()
+
+
+class AsyncClient2PC:
+    """
+    Client of the coordinator group and the participant clusters. Leaders are cached in a LeaderDirectory and
+    found with parallel ClusterStatus reads; RPCs go through a RetryPolicy (adaptive timeouts, backoff, circuit
+    breakers) like those of the nodes. Requests return the node's response, or None if no node answered.
+    """
+    def __init__(self, timeout=3, max_connections_per_node=CLIENT_MAX_CONNECTIONS_PER_NODE):
+        # Cached leader and term of every participant cluster and of the coordinator group ('C')
+        self.leader_directory = LeaderDirectory({'A': CLUSTER_A_NODES, 'B': CLUSTER_B_NODES, 'C': COORDINATOR_NODE})
+        self.timeout = timeout
+        self.retry_policy = RetryPolicy()
+        self.max_connections_per_node = max_connections_per_node
+        self.connections = {} # {node_name: NodeConnections}, created on first use inside the event loop
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes the idle connections to all nodes."""
+        for connections in self.connections.values():
+            connections.close()
+
+    # ------------------- RPCs -------------------
+
+    async def send_to_node(self, node_name, rpc_type, data, timeout=None):
+        """
+        Sends one RPC to a node with the given timeout, or else one adapted to the node's round-trip times. The
+        timeout starts once a connection slot is free. Returns None on errors and at once while the node's circuit
+        breaker is open.
+        """
+        if node_name not in self.connections:
+            node_info = NODES[node_name]
+            self.connections[node_name] = NodeConnections(node_info['ip'], node_info['port'], self.max_connections_per_node,
+                                                          CONNECTION_IDLE_TIMEOUT / 2)
+        connections = self.connections[node_name]
+        if not self.retry_policy.admit(node_name):
+            return None
+
+        async with connections.slots:
+            attempt_timeout = timeout or self.retry_policy.timeout(node_name, rpc_type)
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(connections.exchange(rpc_type, data), attempt_timeout)
+            except (OSError, asyncio.TimeoutError, ValueError):
+                response = None
+            self.retry_policy.outcome(node_name, rpc_type, response, time.monotonic() - started, attempt_timeout, 0)
+        return response
+
+    async def send_to_coordinator(self, rpc_type, data, retry_timeout=6.0):
+        """
+        Sends an RPC to the coordinator leader. Follows 'not the leader' hints and keeps looking for a leader for
+        up to retry_timeout seconds while the coordinator group elects one. A request carrying a txid or request_id
+        is also resent when it got no response, since the coordinator runs it only once; other requests are not,
+        and None is returned instead.
+        """
+        deadline = time.monotonic() + retry_timeout
+        idempotent = 'txid' in data or 'request_id' in data
+        leader = await self.find_leader('C')
+        attempt = 0
+        while True:
+            if leader:
+                response = await self.send_to_node(leader, rpc_type, data, timeout=self.timeout)
+                if response is not None and not is_not_leader(response):
+                    return response
+                if response is None:
+                    self.leader_directory.invalidate('C', leader)
+                    if not idempotent:
+                        return None
+                    leader = None
+                else:
+                    leader = self.leader_directory.handle_not_leader(leader, response)
+                    if leader:
+                        continue
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.retry_policy.backoff(attempt))
+            attempt += 1
+            leader = await self.find_leader('C')
+
+    async def send_to_cluster_leader(self, cluster_letter, rpc_type, data):
+        """Sends a read-only RPC to a cluster's leader. Returns the response if it succeeded, else None."""
+        leader = await self.find_leader(cluster_letter)
+
+        # One redirect is followed if the cached leader stepped down, then the leader is looked up again
+        for _ in range(2):
+            if not leader:
+                break
+            response = await self.send_to_node(leader, rpc_type, data)
+            if response and response.get('status') == 'success':
+                return response
+            if is_not_leader(response):
+                leader = self.leader_directory.handle_not_leader(leader, response)
+            else:
+                self.leader_directory.invalidate(cluster_letter, leader)
+                leader = None
+            if not leader:
+                leader = await self.find_leader(cluster_letter)
+        return None
+
+    # ------------------- Leaders and Cluster Status -------------------
+
+    async def find_leader(self, cluster_letter):
+        """Returns the leader of a cluster ('A', 'B' or the coordinator group 'C'), or None if none answered."""
+        leader = self.leader_directory.get_leader(cluster_letter)
+        if leader:
+            return leader
+        status = (await self.get_cluster_statuses([cluster_letter]))[cluster_letter]
+        return status['node_name'] if status else None
+
+    async def get_cluster_statuses(self, cluster_letters):
+        """
+        Returns {cluster_letter: ClusterStatus of its leader, or None if no leader answered}. All clusters are read
+        at the same time: a cluster with a cached leader is asked through that node only, the others through all
+        their nodes at once, keeping the first leader to answer. A cluster whose cached leader stepped down is asked
+        once more through all its nodes.
+        """
+        statuses = {}
+        pending = list(cluster_letters)
+        for _ in range(2):
+            cached = {cluster_letter: self.leader_directory.get_leader(cluster_letter) for cluster_letter in pending}
+            tasks = []
+            for cluster_letter, leader in cached.items():
+                for node_name in [leader] if leader else list(self.leader_directory.clusters[cluster_letter]):
+                    tasks.append(asyncio.ensure_future(self._node_status(cluster_letter, node_name)))
+
+            # Stops at the first leader of every cluster; slower nodes finish in the background
+            for next_done in asyncio.as_completed(tasks):
+                cluster_letter, node_name, response = await next_done
+                if response and response.get('is_leader'):
+                    if cluster_letter not in statuses:
+                        statuses[cluster_letter] = response
+                        self.leader_directory.update(cluster_letter, node_name, response.get('term'))
+                    if all(letter in statuses for letter in pending):
+                        break
+                else:
+                    self.leader_directory.invalidate(cluster_letter, node_name)
+
+            # Only clusters asked through a cached leader that stepped down get a second round
+            pending = [letter for letter in pending if letter not in statuses and cached[letter]]
+            if not pending:
+                break
+        return {cluster_letter: statuses.get(cluster_letter) for cluster_letter in cluster_letters}
+
+    async def _node_status(self, cluster_letter, node_name):
+        return cluster_letter, node_name, await self.send_to_node(node_name, 'ClusterStatus', {})
+
+    async def get_cluster_balances(self, cluster_letters):
+        """Returns {cluster_letter: balance read from its leader, or None}, reading all clusters at the same time."""
+        statuses = await self.get_cluster_statuses(cluster_letters)
+        return {cluster_letter: status.get('balance') if status else None for cluster_letter, status in statuses.items()}
+
+    # ------------------- Transactions -------------------
+
+    async def transact(self, transactions, txid=None, simulation_num=0):
+        """
+        Runs a transaction ({'AccountA': delta, 'AccountB': delta}) through the coordinator and returns its outcome
+        ({'status': 'committed' or 'aborted', 'txid': ...}). The txid is generated unless given, so a resent request
+        is recognised as the same transaction.
+        """
+        return await self.send_to_coordinator('2pc_request', {'transactions': transactions, 'simulation_num': simulation_num,
+                                                              'txid': txid or uuid.uuid4().hex})
+
+    async def transact_many(self, transactions_list, concurrency=64):
+        """
+        Runs the transactions of an iterable, at most `concurrency` at a time, and yields (position, outcome) for
+        each as soon as it finishes, in completion order. The iterable is consumed lazily, so it may be unbounded.
+        """
+        async for result in self._stream(self.transact, transactions_list, concurrency):
+            yield result
+
+    async def submit_value(self, value, cluster_letter='A'):
+        """Appends a plain value to the Raft log of a cluster (SubmitValue), following the leader's redirects."""
+        return await self._submit(cluster_letter, 'SubmitValue', {'value': value})
+
+    async def submit_values(self, values, cluster_letter='A'):
+        """Appends a list of plain values to the Raft log of a cluster in one replication round (SubmitValues)."""
+        return await self._submit(cluster_letter, 'SubmitValues', {'values': list(values)})
+
+    async def _submit(self, cluster_letter, rpc_type, data):
+        leader = await self.find_leader(cluster_letter)
+        for _ in range(2):
+            if not leader:
+                return None
+            response = await self.send_to_node(leader, rpc_type, data)
+            if not response or not response.get('redirect'):
+                return response
+            self.leader_directory.invalidate(cluster_letter, leader)
+            leader = response.get('leader_name')
+            if leader:
+                self.leader_directory.update(cluster_letter, leader)
+        return None
+
+    async def submit_many(self, values, cluster_letter='A', concurrency=64):
+        """Submits the values of an iterable like transact_many and yields (position, response) as each finishes."""
+        async for result in self._stream(lambda value: self.submit_value(value, cluster_letter), values, concurrency):
+            yield result
+
+    async def _stream(self, request, items, concurrency):
+        """Runs request(item) for every item with `concurrency` workers, yielding (position, result) as they finish."""
+        results = asyncio.Queue()
+        positions = enumerate(items)
+        finished = object()
+
+        async def worker():
+            try:
+                for position, item in positions:  # Shared by the workers; next() never awaits
+                    await results.put((position, await request(item)))
+            finally:
+                results.put_nowait(finished)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                result = await results.get()
+                if result is finished:
+                    running -= 1
+                else:
+                    yield result
+            for task in workers:
+                task.result()  # Raises the error of a failed worker
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def set_account_balance(self, account, balance, simulation_num=0):
+        """Sets an account's balance through the coordinator."""
+        return await self.send_to_coordinator('SetBalance', {'account': account, 'balance': balance, 'simulation_num': simulation_num,
+                                                             'request_id': uuid.uuid4().hex})
+
+    # ------------------- Reads -------------------
+
+    async def get_snapshot_balances(self, accounts=None, attempts=3):
+        """
+        Reads the balances of all accounts (or of `accounts`) as of one consistent cut across the clusters
+        (SnapshotRead). Errors such as a coordinator that is still recovering are retried. Returns the response
+        ({'status', 'snapshot_ts', 'balances': {account: balance}}), or None if the coordinator is unreachable.
+        """
+        response = None
+        for attempt in range(attempts):
+            response = await self.send_to_coordinator('SnapshotRead', {'accounts': accounts})
+            if not response or response.get('status') == 'success':
+                return response
+            await asyncio.sleep(self.retry_policy.backoff(attempt + 2))
+        return response
+
+    async def get_transaction_status(self, txid):
+        """Returns {cluster_letter: GetTransactionStatus response or None} of both participant clusters."""
+        clusters = ('A', 'B')
+        responses = await asyncio.gather(*(self.send_to_cluster_leader(cluster_letter, 'GetTransactionStatus', {'txid': txid})
+                                           for cluster_letter in clusters))
+        return dict(zip(clusters, responses))
+
+    async def get_trace(self, trace_ids):
+        """Returns {node_name: spans} recorded by every node for the given traces (GetTrace); unreachable nodes are left out."""
+        names = list(NODES)
+        responses = await asyncio.gather(*(self.send_to_node(node_name, 'GetTrace', {'trace_ids': list(trace_ids)}, timeout=self.timeout)
+                                           for node_name in names))
+        return {node_name: response['spans'] for node_name, response in zip(names, responses) if response and 'spans' in response}
+
+    async def get_logs(self, node_name, log_kind, start=0, limit=LOG_PAGE_SIZE):
+        """Returns one page of a participant's 'prepare', 'commit' or 'raft' log (GetLogs)."""
+        return await self.send_to_node(node_name, 'GetLogs', {'log': log_kind, 'start': start, 'limit': limit}, timeout=self.timeout)
+
+    async def print_all_logs(self, from_start=False):
+        """Makes the coordinator print the log entries of all nodes added since the last call (or all of them)."""
+        return await self.send_to_coordinator('PrintAllLogs', {'from_start': from_start})
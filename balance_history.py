@@ -0,0 +1,72 @@
+import threading
+from collections import deque
+
+
+class BalanceHistory:
+    """
+    Recent versions of a participant's account balance for snapshot reads. Every committed change is stamped with
+    the commit timestamp the coordinator gave its transaction: a delta, or (SetBalance) an absolute balance. The
+    balance as of snapshot timestamp S replays, in the order they were applied, the changes stamped at or before S
+    on top of the balance before the oldest kept change. Deltas commute, so their order does not matter; a set
+    replaces everything applied before it, like it did on the account. Only the last `capacity` changes are kept,
+    so a snapshot older than the newest dropped change (the horizon) can no longer be read.
+
+    Reads take only this object's lock: they neither wait for account locks nor write anything.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.changes = deque()  # (commit_ts, kind, value) in the order they were applied; kind is 'delta' or 'set'
+        self.base = 0           # Balance before the oldest kept change
+        self.horizon = 0        # Snapshots older than this cannot be read
+        self.max_read_ts = 0    # Newest snapshot read so far
+        self.lock = threading.Lock()
+
+    def reset(self, balance, horizon):
+        """Starts over from `balance`, made of changes committed at or before `horizon` (e.g. after a restart)."""
+        with self.lock:
+            self.changes.clear()
+            self.base = balance
+            self.horizon = horizon
+
+    def record_delta(self, commit_ts, delta):
+        """Records a delta committed at commit_ts."""
+        self._record(commit_ts, 'delta', delta)
+
+    def record_set(self, commit_ts, balance):
+        """Records that the balance was set to `balance` at commit_ts."""
+        self._record(commit_ts, 'set', balance)
+
+    def _record(self, commit_ts, kind, value):
+        """
+        Appends a change. A change without a commit timestamp (written by an earlier version) counts as committed
+        before every snapshot. A change stamped at or before a snapshot that was already read counts as committed
+        just after the newest one read.
+        """
+        with self.lock:
+            commit_ts = 0 if commit_ts is None else max(commit_ts, self.max_read_ts + 1)
+            self.changes.append((commit_ts, kind, value))
+            if len(self.changes) > self.capacity:
+                dropped_ts, dropped_kind, dropped_value = self.changes.popleft()
+                self.base = self._apply(self.base, dropped_kind, dropped_value)
+                self.horizon = max(self.horizon, dropped_ts)
+
+    @staticmethod
+    def _apply(balance, kind, value):
+        return value if kind == 'set' else balance + value
+
+    def balance_at(self, snapshot_ts):
+        """Returns the balance as of snapshot_ts, or None if that snapshot is older than the history."""
+        with self.lock:
+            if snapshot_ts < self.horizon:
+                return None
+            self.max_read_ts = max(self.max_read_ts, snapshot_ts)
+            balance = self.base
+            for commit_ts, kind, value in self.changes:
+                if commit_ts <= snapshot_ts:
+                    balance = self._apply(balance, kind, value)
+            return balance
+
+    def read_since(self, commit_ts):
+        """True if a snapshot at or after commit_ts was already read, so a change committed at commit_ts would alter it."""
+        with self.lock:
+            return commit_ts is not None and commit_ts <= self.max_read_ts
@@ -0,0 +1,306 @@
+"""
+Benchmarks for the 2PC system. Runs against the coordinator and participant nodes started as described in the
+README, and prints the results as JSON.
+
+    python benchmark_2pc.py concurrency [--levels 1,8,64] [--duration 10] [--no-batching]
+    python benchmark_2pc.py single-account [--concurrency 1] [--duration 10]
+    python benchmark_2pc.py protocols [--count 64]
+    python benchmark_2pc.py hot-account [--concurrency 64] [--duration 10] [--batching]
+    python benchmark_2pc.py load [--local] [--mix transfer=90,read=9,set_balance=1] [--concurrency 64] [--duration 10]
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from async_client import AsyncClient2PC
+from client import BaseClient
+from client_2pc import Client2PC
+from config import COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES, HEARTBEAT_INTERVAL
+
+# Starting balance of both accounts, large enough that transfers never run out of funds
+INITIAL_BALANCE = 10 ** 9
+
+
+def percentile(samples, p):
+    """Returns the p-th percentile (0-100) of a list of samples, or None if it is empty."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# Client shared by all benchmark threads, with a timeout long enough for a loaded system
+coordinator_client = Client2PC(timeout=30)
+
+
+def send_to_coordinator(rpc_type, data):
+    """Sends an RPC to the coordinator leader."""
+    return coordinator_client.send_to_coordinator(rpc_type, data)
+
+
+def set_balances(balance):
+    """Sets both accounts to the same balance through the coordinator."""
+    for account in ('AccountA', 'AccountB'):
+        response = send_to_coordinator('SetBalance', {'account': account, 'balance': balance, 'request_id': uuid.uuid4().hex})
+        if not response or response.get('status') != 'success':
+            raise RuntimeError(f"Could not set the balance of {account}: {response}")
+
+
+def run_clients(concurrency, duration, make_request):
+    """
+    Runs `concurrency` client threads that each send 2pc_request back to back for `duration` seconds.
+    make_request() returns the request data. Returns the outcome counts and commit latencies.
+    """
+    results = {'committed': 0, 'aborted': 0, 'failed': 0, 'latencies': []}
+    results_lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client_loop():
+        while time.time() < deadline:
+            start_time = time.time()
+            response = send_to_coordinator('2pc_request', {**make_request(), 'txid': uuid.uuid4().hex})
+            elapsed = time.time() - start_time
+            with results_lock:
+                if response and response.get('status') == 'committed':
+                    results['committed'] += 1
+                    results['latencies'].append(elapsed)
+                elif response and response.get('status') == 'aborted':
+                    results['aborted'] += 1
+                else:
+                    results['failed'] += 1
+
+    threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, duration):
+    """Turns raw client results into throughput and latency figures (latencies in milliseconds)."""
+    latencies = results['latencies']
+    return {
+        'committed': results['committed'],
+        'aborted': results['aborted'],
+        'failed': results['failed'],
+        'throughput_tps': results['committed'] / duration,
+        'latency_ms': latency_summary(latencies)
+    }
+
+
+def latency_summary(latencies):
+    """p50, p99, p999 and max of latencies given in seconds, in milliseconds (None without samples)."""
+    summary = {f'p{p}'.replace('.', ''): percentile(latencies, p) * 1000 if latencies else None for p in (50, 99, 99.9)}
+    summary['max'] = max(latencies) * 1000 if latencies else None
+    return summary
+
+
+def benchmark_concurrency(args):
+    """Committed-transaction throughput of A->B transfers at several numbers of concurrent clients."""
+    set_balances(INITIAL_BALANCE)
+    report = []
+    for concurrency in args.levels:
+        results = run_clients(concurrency, args.duration,
+                              lambda: {'transactions': {'AccountA': -1, 'AccountB': 1}, 'simulation_num': 0,
+                                       'batching': args.batching})
+        report.append({'concurrency': concurrency, **summarize(results, args.duration)})
+    return {'benchmark': 'concurrency', 'batching': args.batching, 'duration_s': args.duration, 'results': report}
+
+
+def benchmark_single_account(args):
+    """Latency of transactions that only debit AccountA, with the one-phase fast path and through full 2PC."""
+    set_balances(INITIAL_BALANCE)
+    report = []
+    for one_phase in (True, False):
+        results = run_clients(args.concurrency, args.duration,
+                              lambda: {'transactions': {'AccountA': -1, 'AccountB': 0}, 'simulation_num': 0,
+                                       'one_phase': one_phase})
+        report.append({'one_phase': one_phase, **summarize(results, args.duration)})
+    return {'benchmark': 'single-account', 'concurrency': args.concurrency, 'duration_s': args.duration, 'results': report}
+
+
+def benchmark_hot_account(args):
+    """
+    Throughput of concurrent A->B transfers, which all lock the same two accounts, with exclusive account locks and
+    with escrow reservations. Batching is off by default, so every transaction holds its own locks.
+    """
+    set_balances(INITIAL_BALANCE)
+    report = []
+    for escrow in (False, True):
+        results = run_clients(args.concurrency, args.duration,
+                              lambda: {'transactions': {'AccountA': -1, 'AccountB': 1}, 'simulation_num': 0,
+                                       'batching': args.batching, 'one_phase': False, 'escrow': escrow})
+        report.append({'escrow': escrow, **summarize(results, args.duration)})
+    return {'benchmark': 'hot-account', 'concurrency': args.concurrency, 'batching': args.batching,
+            'duration_s': args.duration, 'results': report}
+
+
+# Operations of the load generator: each sends one request and returns 'ok', 'aborted' or 'failed'
+async def load_transfer(client):
+    accounts = random.sample(['AccountA', 'AccountB'], 2)
+    response = await client.transact({accounts[0]: -1, accounts[1]: 1})
+    status = response.get('status') if response else None
+    return {'committed': 'ok', 'aborted': 'aborted'}.get(status, 'failed')
+
+
+async def load_read(client):
+    response = await client.get_snapshot_balances()
+    return 'ok' if response and response.get('status') == 'success' else 'failed'
+
+
+async def load_set_balance(client):
+    response = await client.set_account_balance(random.choice(['AccountA', 'AccountB']), INITIAL_BALANCE)
+    return 'ok' if response and response.get('status') == 'success' else 'failed'
+
+
+LOAD_OPERATIONS = {'transfer': load_transfer, 'read': load_read, 'set_balance': load_set_balance}
+
+
+def parse_mix(text):
+    """Parses 'transfer=90,read=9,set_balance=1' into {operation: weight}."""
+    mix = {}
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        if operation not in LOAD_OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation!r}, expected one of {', '.join(LOAD_OPERATIONS)}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+async def generate_load(client, mix, concurrency, duration):
+    """
+    Runs `concurrency` workers that each send operations drawn at random from `mix` back to back for `duration`
+    seconds. Returns {operation: {'ok', 'aborted', 'failed', 'latencies'}}, latencies of successful operations only.
+    """
+    results = {operation: {'ok': 0, 'aborted': 0, 'failed': 0, 'latencies': []} for operation in mix}
+    operations, weights = list(mix), list(mix.values())
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            operation = random.choices(operations, weights)[0]
+            start_time = time.monotonic()
+            outcome = await LOAD_OPERATIONS[operation](client)
+            results[operation][outcome] += 1
+            if outcome == 'ok':
+                results[operation]['latencies'].append(time.monotonic() - start_time)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def run_load(args):
+    async with AsyncClient2PC(timeout=30) as client:
+        for account in ('AccountA', 'AccountB'):
+            response = await client.set_account_balance(account, INITIAL_BALANCE)
+            if not response or response.get('status') != 'success':
+                raise RuntimeError(f"Could not set the balance of {account}: {response}")
+        if args.warmup:
+            await generate_load(client, args.mix, args.concurrency, args.warmup)
+        return await generate_load(client, args.mix, args.concurrency, args.duration)
+
+
+def benchmark_load(args):
+    """
+    Throughput and latency (p50/p99/p999) of a mix of transfers, snapshot reads and SetBalance requests, sent from
+    one asyncio client. With --local the whole system is started in this process first (harness.LocalCluster).
+    """
+    if args.local:
+        from harness import LocalCluster
+        with LocalCluster():
+            results = asyncio.run(run_load(args))
+    else:
+        results = asyncio.run(run_load(args))
+
+    operations = {}
+    for operation, counts in results.items():
+        operations[operation] = {'ok': counts['ok'], 'aborted': counts['aborted'], 'failed': counts['failed'],
+                                 'throughput_ops': counts['ok'] / args.duration, 'latency_ms': latency_summary(counts['latencies'])}
+    latencies = [latency for counts in results.values() for latency in counts['latencies']]
+    return {'benchmark': 'load', 'local': args.local, 'mix': args.mix, 'concurrency': args.concurrency, 'duration_s': args.duration,
+            'throughput_ops': len(latencies) / args.duration, 'latency_ms': latency_summary(latencies), 'operations': operations}
+
+
+def protocol_stats():
+    """Returns the RPC and forced-write counters of the coordinator replicas and of all participants, each summed."""
+    totals = {'coordinator_rpcs': 0, 'coordinator_replication_rpcs': 0, 'coordinator_forced_writes': 0,
+              'replication_rpcs': 0, 'forced_writes': 0}
+    for node_info in COORDINATOR_NODE.values():
+        stats = BaseClient.send_rpc(node_info['ip'], node_info['port'], 'GetProtocolStats', {}) or {}
+        totals['coordinator_rpcs'] += stats.get('rpcs', 0)
+        totals['coordinator_replication_rpcs'] += stats.get('replication_rpcs', 0)
+        totals['coordinator_forced_writes'] += stats.get('forced_writes', 0)
+    for node_info in {**CLUSTER_A_NODES, **CLUSTER_B_NODES}.values():
+        stats = BaseClient.send_rpc(node_info['ip'], node_info['port'], 'GetProtocolStats', {}) or {}
+        totals['replication_rpcs'] += stats.get('replication_rpcs', 0)
+        totals['forced_writes'] += stats.get('forced_writes', 0)
+    return totals
+
+
+def benchmark_protocols(args):
+    """
+    RPCs and forced writes per transaction under presumed-nothing and presumed-abort 2PC, for committed transfers,
+    aborted transfers (overdraft) and transactions with a read-only participant. Transactions run one at a time
+    through the unbatched two-phase path; counters are summed over the coordinator and all participant replicas.
+    """
+    set_balances(INITIAL_BALANCE)
+    workloads = {
+        'commit': {'AccountA': -1, 'AccountB': 1},
+        'abort': {'AccountA': -INITIAL_BALANCE * 10, 'AccountB': 1},
+        'read_only': {'AccountA': -1, 'AccountB': 0},
+    }
+    report = []
+    for protocol in ('presumed_nothing', 'presumed_abort'):
+        for workload, transactions in workloads.items():
+            before = protocol_stats()
+            for _ in range(args.count):
+                send_to_coordinator('2pc_request', {'transactions': transactions, 'simulation_num': 0, 'protocol': protocol, 'txid': uuid.uuid4().hex,
+                                                    'batching': False, 'one_phase': False})
+            time.sleep(HEARTBEAT_INTERVAL * 3)  # Let followers apply the last entries
+            after = protocol_stats()
+            report.append({'protocol': protocol, 'workload': workload,
+                           **{stat: (after[stat] - before[stat]) / args.count for stat in after}})
+    return {'benchmark': 'protocols', 'count': args.count, 'results': report}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='2PC benchmarks against a running system')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    concurrency_parser = subparsers.add_parser('concurrency', help='throughput at 1, 8 and 64 concurrent clients')
+    concurrency_parser.add_argument('--levels', type=lambda s: [int(level) for level in s.split(',')], default=[1, 8, 64])
+    concurrency_parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    concurrency_parser.add_argument('--no-batching', dest='batching', action='store_false',
+                                    help='run every transaction through its own prepare and commit rounds')
+    concurrency_parser.set_defaults(run=benchmark_concurrency)
+
+    single_parser = subparsers.add_parser('single-account', help='one-phase commit against full 2PC for single-account transactions')
+    single_parser.add_argument('--concurrency', type=int, default=1)
+    single_parser.add_argument('--duration', type=float, default=10.0, help='seconds per variant')
+    single_parser.set_defaults(run=benchmark_single_account)
+
+    protocols_parser = subparsers.add_parser('protocols', help='RPCs and forced writes per transaction for each 2PC variant')
+    protocols_parser.add_argument('--count', type=int, default=64, help='transactions per protocol and workload')
+    protocols_parser.set_defaults(run=benchmark_protocols)
+
+    hot_parser = subparsers.add_parser('hot-account', help='transfers on one hot pair of accounts, exclusive locks against escrow')
+    hot_parser.add_argument('--concurrency', type=int, default=64)
+    hot_parser.add_argument('--duration', type=float, default=10.0, help='seconds per variant')
+    hot_parser.add_argument('--batching', action='store_true', help='let the coordinator batch the transfers')
+    hot_parser.set_defaults(run=benchmark_hot_account)
+
+    load_parser = subparsers.add_parser('load', help='throughput and latency percentiles of a mix of operations')
+    load_parser.add_argument('--local', action='store_true', help='start the whole system in this process on free ports')
+    load_parser.add_argument('--mix', type=parse_mix, default=parse_mix('transfer=90,read=9,set_balance=1'),
+                             help='operations and their weights, e.g. transfer=90,read=9,set_balance=1')
+    load_parser.add_argument('--concurrency', type=int, default=64)
+    load_parser.add_argument('--duration', type=float, default=10.0, help='seconds measured')
+    load_parser.add_argument('--warmup', type=float, default=2.0, help='seconds of load before measuring')
+    load_parser.set_defaults(run=benchmark_load)
+
+    args = parser.parse_args()
+    print(json.dumps(args.run(args), indent=2))
@@ -0,0 +1,209 @@
+"""
+Microbenchmarks of the Raft layer (node.py) on its own. Each run starts a fresh cluster of plain Raft Nodes
+(the nodes of cluster A in config.py) in this process on free localhost ports (harness.LocalCluster), drives it
+through its RPCs, and prints the results as JSON. Timings that depend on randomized election timeouts are repeated
+and reported as median, min and max, so runs can be compared with each other.
+
+    python benchmark_raft.py election [--runs 5]
+    python benchmark_raft.py failover [--runs 5]
+    python benchmark_raft.py submit [--batch-sizes 1,10,100] [--value-sizes 16,1024] [--concurrency 8] [--duration 5]
+    python benchmark_raft.py catch-up [--entries 100,1000,10000] [--runs 3]
+    python benchmark_raft.py restart [--entries 1000,10000,100000] [--runs 3]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from async_client import AsyncClient2PC
+from benchmark_2pc import latency_summary
+from client import BaseClient
+from config import CLUSTER_A_NODES, ELECTION_TIMEOUT
+from harness import LocalCluster
+from node import Node
+
+# How often cluster state is polled while timing it, in seconds
+POLL_INTERVAL = 0.01
+# Values submitted per SubmitValues request while filling a log
+FILL_BATCH_SIZE = 500
+
+
+def raft_cluster():
+    """A harness running the nodes of cluster A as plain Raft nodes."""
+    return LocalCluster(node_types={name: Node for name in CLUSTER_A_NODES})
+
+
+def node_status(name):
+    node_info = CLUSTER_A_NODES[name]
+    return BaseClient.send_rpc(node_info['ip'], node_info['port'], 'ClusterStatus', {}, timeout=1)
+
+
+def wait_until(condition, timeout=30.0):
+    """Polls condition() until it returns a true value, which is returned; None after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+def spread(samples):
+    """Median, min and max of a list of durations given in seconds, in milliseconds."""
+    if not samples:
+        return {'runs': 0}
+    return {'runs': len(samples), 'median_ms': statistics.median(samples) * 1000,
+            'min_ms': min(samples) * 1000, 'max_ms': max(samples) * 1000}
+
+
+def fill_log(count, value_size=16):
+    """Commits `count` values of value_size bytes through the leader of the cluster, FILL_BATCH_SIZE per round."""
+    async def fill():
+        async with AsyncClient2PC(timeout=30) as client:
+            for start in range(0, count, FILL_BATCH_SIZE):
+                values = ['x' * value_size] * min(FILL_BATCH_SIZE, count - start)
+                response = await client.submit_values(values)
+                if not response or not response.get('success'):
+                    raise RuntimeError(f"SubmitValues failed: {response}")
+    asyncio.run(fill())
+
+
+def benchmark_election(args):
+    """Time from starting a cold cluster (no logs) until one of its nodes is leader."""
+    samples = []
+    for _ in range(args.runs):
+        cluster = raft_cluster()
+        start_time = time.monotonic()
+        cluster.start(poll_interval=POLL_INTERVAL)
+        samples.append(time.monotonic() - start_time)
+        cluster.stop()
+    return {'benchmark': 'election', 'election_timeout_s': list(ELECTION_TIMEOUT), 'cold_start': spread(samples)}
+
+
+def benchmark_failover(args):
+    """Time from killing the leader until another node is leader, repeated on one cluster (the killed node rejoins)."""
+    samples = []
+    with raft_cluster() as cluster:
+        for _ in range(args.runs):
+            leader = cluster.leader_of(CLUSTER_A_NODES)
+            start_time = time.monotonic()
+            cluster.kill(leader)
+            new_leader = wait_until(lambda: cluster.leader_of(CLUSTER_A_NODES))
+            if new_leader:
+                samples.append(time.monotonic() - start_time)
+            cluster.start_node(leader)
+            time.sleep(max(ELECTION_TIMEOUT))  # Let the old leader rejoin as a follower
+    return {'benchmark': 'failover', 'election_timeout_s': list(ELECTION_TIMEOUT), 'failover': spread(samples)}
+
+
+async def submit_load(batch_size, value_size, concurrency, duration):
+    """Runs `concurrency` clients sending SubmitValues of batch_size values back to back for `duration` seconds."""
+    results = {'committed': 0, 'failed': 0, 'latencies': []}
+    values = ['x' * value_size] * batch_size
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            start_time = time.monotonic()
+            response = await client.submit_values(values)
+            if response and response.get('success'):
+                results['committed'] += 1
+                results['latencies'].append(time.monotonic() - start_time)
+            else:
+                results['failed'] += 1
+
+    async with AsyncClient2PC(timeout=30) as client:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def benchmark_submit(args):
+    """Commit latency and throughput of SubmitValues for every combination of batch size and value size."""
+    report = []
+    with raft_cluster() as cluster:
+        for batch_size in args.batch_sizes:
+            for value_size in args.value_sizes:
+                results = asyncio.run(submit_load(batch_size, value_size, args.concurrency, args.duration))
+                report.append({'batch_size': batch_size, 'value_size': value_size, 'committed': results['committed'],
+                               'failed': results['failed'], 'requests_per_s': results['committed'] / args.duration,
+                               'entries_per_s': results['committed'] * batch_size / args.duration,
+                               'latency_ms': latency_summary(results['latencies'])})
+    return {'benchmark': 'submit', 'concurrency': args.concurrency, 'duration_s': args.duration, 'results': report}
+
+
+def benchmark_catch_up(args):
+    """
+    Time a follower takes to catch up on N entries committed while it was down: from its restart until its commit
+    index reaches the leader's. Every run uses a fresh cluster, so the follower only misses those N entries.
+    """
+    report = []
+    for count in args.entries:
+        samples = []
+        for _ in range(args.runs):
+            with raft_cluster() as cluster:
+                leader = cluster.leader_of(CLUSTER_A_NODES)
+                follower = next(name for name in CLUSTER_A_NODES if name != leader)
+                cluster.kill(follower)
+                fill_log(count)
+                target = node_status(leader)['commit_index']
+                start_time = time.monotonic()
+                cluster.start_node(follower)
+                if wait_until(lambda: (node_status(follower) or {}).get('commit_index', -1) >= target, timeout=120):
+                    samples.append(time.monotonic() - start_time)
+        report.append({'entries': count, 'catch_up': spread(samples)})
+    return {'benchmark': 'catch-up', 'results': report}
+
+
+def benchmark_restart(args):
+    """Time from restarting a node with a log of N entries on disk until it answers RPCs with the log loaded."""
+    report = []
+    for count in args.entries:
+        samples = []
+        for _ in range(args.runs):
+            with raft_cluster() as cluster:
+                follower = next(name for name in CLUSTER_A_NODES if name != cluster.leader_of(CLUSTER_A_NODES))
+                cluster.kill(follower)
+                with open(f"{follower}_lab2Raft.txt", 'w') as f:
+                    f.write(('x' * args.value_size + '\n') * count)
+                start_time = time.monotonic()
+                cluster.start_node(follower)
+                if wait_until(lambda: (node_status(follower) or {}).get('last_applied', -1) >= count - 1, timeout=120):
+                    samples.append(time.monotonic() - start_time)
+        report.append({'entries': count, 'log_bytes': count * (args.value_size + 1), 'restart': spread(samples)})
+    return {'benchmark': 'restart', 'value_size': args.value_size, 'results': report}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Raft microbenchmarks on an in-process cluster')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    sizes = lambda s: [int(size) for size in s.split(',')]
+
+    election_parser = subparsers.add_parser('election', help='time to elect a leader from a cold start')
+    election_parser.add_argument('--runs', type=int, default=5)
+    election_parser.set_defaults(run=benchmark_election)
+
+    failover_parser = subparsers.add_parser('failover', help='time to elect a new leader after killing the leader')
+    failover_parser.add_argument('--runs', type=int, default=5)
+    failover_parser.set_defaults(run=benchmark_failover)
+
+    submit_parser = subparsers.add_parser('submit', help='SubmitValues latency and throughput by batch and value size')
+    submit_parser.add_argument('--batch-sizes', type=sizes, default=[1, 10, 100])
+    submit_parser.add_argument('--value-sizes', type=sizes, default=[16, 1024], help='bytes per value')
+    submit_parser.add_argument('--concurrency', type=int, default=8)
+    submit_parser.add_argument('--duration', type=float, default=5.0, help='seconds per combination')
+    submit_parser.set_defaults(run=benchmark_submit)
+
+    catch_up_parser = subparsers.add_parser('catch-up', help='time for a restarted follower to catch up on N entries')
+    catch_up_parser.add_argument('--entries', type=sizes, default=[100, 1000, 10000])
+    catch_up_parser.add_argument('--runs', type=int, default=3)
+    catch_up_parser.set_defaults(run=benchmark_catch_up)
+
+    restart_parser = subparsers.add_parser('restart', help='time to restart a node with a log of N entries')
+    restart_parser.add_argument('--entries', type=sizes, default=[1000, 10000, 100000])
+    restart_parser.add_argument('--value-size', type=int, default=16, help='bytes per value')
+    restart_parser.add_argument('--runs', type=int, default=3)
+    restart_parser.set_defaults(run=benchmark_restart)
+
+    args = parser.parse_args()
+    print(json.dumps(args.run(args), indent=2))
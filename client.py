@@ -3,6 +3,7 @@ import socket
 import json
 import sys
 from config import NODES, CLUSTER_A_NODES, CLUSTER_B_NODES
+from rpc import receive_response
 
 class BaseClient:
     """
@@ -10,15 +11,14 @@ class BaseClient:
     """
 
     @staticmethod
-    def send_rpc(ip, port, rpc_type, data):
+    def send_rpc(ip, port, rpc_type, data, timeout=3):
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(3)
+                s.settimeout(timeout)
                 s.connect((ip, port))
                 message = json.dumps({'rpc_type': rpc_type, 'data': data})
                 s.sendall(message.encode())
-                response = s.recv(4096).decode()
-                return json.loads(response)
+                return receive_response(s)
         except Exception as e:
             print(f"RPC Error: {e}")
             return None
@@ -1,9 +1,38 @@
 from client import BaseClient
-from config import COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES
+from async_client import AsyncClient2PC
+from config import LOG_PAGE_SIZE
+import asyncio
 import json
 import sys
+import threading
 
 class Client2PC(BaseClient):
+    """
+    Blocking client and command line interface of the 2PC system: a thin wrapper that runs the requests of an
+    AsyncClient2PC on an event loop in a background thread. It can be shared by several threads.
+    """
+    def __init__(self, timeout=3):
+        self.timeout = timeout
+        self.client = AsyncClient2PC(timeout)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def run(self, coroutine):
+        """Runs a coroutine of the async client on the client's event loop and returns its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    @property
+    def leader_directory(self):
+        return self.client.leader_directory
+
+    def send_to_node(self, node_name, rpc_type, data, timeout=None):
+        """Sends one RPC to a node over a reused connection. Returns the response, or None."""
+        return self.run(self.client.send_to_node(node_name, rpc_type, data, timeout))
+
+    def send_to_coordinator(self, rpc_type, data, retry_timeout=6.0):
+        """Sends an RPC to the coordinator leader (see AsyncClient2PC.send_to_coordinator)."""
+        return self.run(self.client.send_to_coordinator(rpc_type, data, retry_timeout))
+
     def perform_transaction(self, transactions, bonus=False, simulation_num=0):
         """
         Send a transaction request to the coordinator.
@@ -12,125 +41,111 @@ class Client2PC(BaseClient):
         """
         if bonus:
             print("Performing bonus transaction...")
-            balance_a, balance_b, bonus_value = self.calculate_bonus()
-            
-            if bonus_value is not None:
-                # Add bonus to both accounts
-                transactions = {
-                    'AccountA': bonus_value,
-                    'AccountB': bonus_value
-                }
-                print(f"Applying bonus of {bonus_value} to both accounts")
+            # 20% of Account A's balance for both accounts, computed by the participants within the transaction
+            bonus_delta = {'delta': {'balance_of': 'AccountA', 'times': 0.2}}
+            transactions = {'AccountA': bonus_delta, 'AccountB': bonus_delta}
         
-        coordinator_info = COORDINATOR_NODE['node1']
         print(f"Sending transaction to coordinator: {transactions}")
         
-        response = self.send_rpc(
-            coordinator_info['ip'],
-            coordinator_info['port'],
-            '2pc_request',
-            {'transactions': transactions, 'simulation_num': simulation_num}
-        )
+        response = self.run(self.client.transact(transactions, simulation_num=simulation_num))
 
         if response and response.get('status') == 'committed':
-            print("Transaction successfully committed.")
+            print(f"Transaction {response.get('txid')} successfully committed.")
+            if response.get('deltas'):
+                print(f"Applied deltas: {response['deltas']}")
             return True
         elif response and response.get('status') == 'aborted':
-            print("Transaction aborted.")
+            print(f"Transaction {response.get('txid')} aborted.")
             return False
         else:
             print("Failed to process the transaction.")
             return False
 
     def get_account_balances(self):
-        """Retrieve current account balances from RAFT cluster leaders."""
+        """Retrieve the account balances as of one snapshot, so a transfer is never seen half-applied."""
         print("Fetching account balances...")
-        
-        # Get balance from Cluster A leader
-        balance_a = self._get_cluster_balance('A')
-        print(f"Account A balance: {balance_a}")
-        
-        # Get balance from Cluster B leader
-        balance_b = self._get_cluster_balance('B')
-        print(f"Account B balance: {balance_b}")
+        response = self.get_snapshot_balances()
+        if not response or response.get('status') != 'success':
+            print(f"Snapshot read failed: {(response or {}).get('message', 'coordinator unreachable')}")
+            return
+        print(f"Account A balance: {response['balances']['AccountA']}")
+        print(f"Account B balance: {response['balances']['AccountB']}")
+        print(f"Snapshot timestamp: {response['snapshot_ts']}")
 
-    def _get_cluster_balance(self, cluster_letter):
-        """Helper to get balance from a cluster's leader."""
-        cluster_nodes = CLUSTER_A_NODES if cluster_letter == 'A' else CLUSTER_B_NODES
-        
-        # First identify the leader
-        for node_name, node_info in cluster_nodes.items():
-            leader_response = self.send_rpc(
-                node_info['ip'], 
-                node_info['port'],
-                'GetLeaderStatus',
-                {}
-            )
-            
-            if leader_response and leader_response.get('is_leader'):
-                # Found the leader, get balance
-                balance_response = self.send_rpc(
-                    node_info['ip'],
-                    node_info['port'],
-                    'GetBalance',
-                    {}
-                )
-                if balance_response and balance_response.get('status') == 'success':
-                    return balance_response.get('balance')
-                break
-        
-        return 0  # Return 0 if no leader found or couldn't get balance
+    def get_snapshot_balances(self, accounts=None, attempts=3):
+        """Reads the balances of all accounts (or of `accounts`) as of one consistent cut (SnapshotRead)."""
+        return self.run(self.client.get_snapshot_balances(accounts, attempts))
+
+    def get_cluster_statuses(self, cluster_letters):
+        """Returns {cluster_letter: ClusterStatus of its leader, or None}, reading all clusters at the same time."""
+        return self.run(self.client.get_cluster_statuses(cluster_letters))
+
+    def get_cluster_balances(self, cluster_letters):
+        """Returns {cluster_letter: balance read from its leader, or None}, reading all clusters at the same time."""
+        return self.run(self.client.get_cluster_balances(cluster_letters))
+
+    def print_cluster_status(self):
+        """Prints the leader, term and log progress of every cluster."""
+        for cluster_letter, status in self.get_cluster_statuses(['A', 'B', 'C']).items():
+            if not status:
+                print(f"Cluster {cluster_letter}: no leader reachable")
+                continue
+            line = (f"Cluster {cluster_letter}: leader {status['node_name']}, term {status['term']}, "
+                    f"commit index {status['commit_index']}, last applied {status['last_applied']}")
+            if status.get('balance') is not None:
+                line += f", balance {status['balance']}"
+            print(line)
+
+    def get_transaction_status(self, txid):
+        """Prints the state of a transaction (as returned with its outcome) on each participant cluster."""
+        for cluster_letter, response in self.run(self.client.get_transaction_status(txid)).items():
+            if response:
+                print(f"Cluster {cluster_letter}: {response.get('state')}")
+            else:
+                print(f"Cluster {cluster_letter}: no leader reachable")
 
     def set_account_balance(self, account, balance):
         cluster_letter = account[-1] if account.startswith('Account') else account
 
-        data = {
-            'account': f'Account{cluster_letter}',
-            'balance': balance,
-            'simulation_num': 0
-        }
-        coordinator_info = COORDINATOR_NODE['node1']
-        response = self.send_rpc(
-            coordinator_info['ip'],
-            coordinator_info['port'],
-            'SetBalance',
-            data
-        )
+        response = self.run(self.client.set_account_balance(f'Account{cluster_letter}', balance))
         if response and response.get('status') == 'success':
             print(f"Successfully set balance for Account {cluster_letter} to {balance}")
         else:
             print(f"Failed to set balance for Account {cluster_letter}")
 
-    def calculate_bonus(self):
-        """Calculate 20% bonus based on current account balances"""
-        print("Calculating bonus...")
-        
-        # Get current balances
-        balance_a = self._get_cluster_balance('A')
-        balance_b = self._get_cluster_balance('B')
-        
-        if balance_a is None or balance_b is None:
-            print("Could not retrieve current balances")
-            return None, None, None
-            
-        # Calculate 20% bonus
-        bonus_value = int(balance_a * 0.2)  # -> int to avoiding floating point issues
-        
-        print(f"Current balances - A: {balance_a}, B: {balance_b}")
-        print(f"Bonus amount (20% of A): {bonus_value}")
-        
-        return balance_a, balance_b, bonus_value
-    
-    def print_all_logs(self):
-        """Retrieve logs from all nodes in the system."""
+    def compare_and_set(self, account, expected, balance):
+        """Sets an account's balance only if it still is `expected`, checked by the participant holding its lock."""
+        return self.perform_transaction({account: {'set': balance, 'expect': expected}})
+
+    def iter_logs(self, node_name, log_kind, start=0, page_size=LOG_PAGE_SIZE):
+        """
+        Yields (position, entry) for the entries of a participant's 'prepare', 'commit' or 'raft' log from position
+        `start` on, fetching one GetLogs page at a time. Stops at the end of the log; to get only the entries added
+        later, start again from the last position + 1.
+        """
+        while True:
+            response = self.run(self.client.get_logs(node_name, log_kind, start, page_size))
+            if not response or response.get('status') != 'success':
+                print(f"Failed to get the {log_kind} log of {node_name} from position {start}: {response}")
+                return
+            for offset, entry in enumerate(response['entries']):
+                yield response['start'] + offset, entry
+            start = response['next']
+            if not response['entries'] or start >= response['end']:
+                return
+
+    def print_node_logs(self, node_name, log_kind, start=0):
+        """Prints a participant's log from position `start` and the position to continue from."""
+        next_position = start
+        for position, entry in self.iter_logs(node_name, log_kind, start):
+            print(f"{position}: {entry}")
+            next_position = position + 1
+        print(f"Next position: {next_position}")
+
+    def print_all_logs(self, from_start=False):
+        """Make the coordinator print the log entries of all nodes added since the last call (or all of them)."""
         print("Getting logs from all nodes...")
-        coordinator_info = COORDINATOR_NODE['node1']
-        response = self.send_rpc(
-            coordinator_info['ip'],
-            coordinator_info['port'],
-            'PrintAllLogs',
-            {}
-        )
+        response = self.run(self.client.print_all_logs(from_start))
         if response and response.get('status') == 'success':
             print(f"Successfully printed all logs")
         else:
@@ -148,7 +163,11 @@ if __name__ == '__main__':
         print("  python client_2pc.py check_status")
         print("  python client_2pc.py get_balances")
         print("  python client_2pc.py set_balance [node_name] [balance]")
-        print(" python client_2pc.py print_all_logs")
+        print(" python client_2pc.py print_all_logs [all]")
+        print("  python client_2pc.py get_logs [node_name] [prepare/commit/raft] [start position]")
+        print("  python client_2pc.py transaction_status [txid]")
+        print("  python client_2pc.py cluster_status")
+        print("  python client_2pc.py compare_and_set [account] [expected balance] [new balance]")
         sys.exit(1)
 
     command = sys.argv[1]
@@ -198,6 +217,24 @@ if __name__ == '__main__':
         balance = int(sys.argv[3])
         client.set_account_balance(node_name, balance)
     elif command == 'print_all_logs':
-        client.print_all_logs()
+        client.print_all_logs(from_start=len(sys.argv) > 2 and sys.argv[2] == 'all')
+    elif command == 'get_logs':
+        if len(sys.argv) not in (4, 5):
+            print("Usage: python client_2pc.py get_logs [node_name] [prepare/commit/raft] [start position]")
+            sys.exit(1)
+        client.print_node_logs(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) == 5 else 0)
+    elif command == 'transaction_status':
+        if len(sys.argv) != 3:
+            print("Usage: python client_2pc.py transaction_status [txid]")
+            sys.exit(1)
+        client.get_transaction_status(sys.argv[2])
+    elif command == 'cluster_status':
+        client.print_cluster_status()
+    elif command == 'compare_and_set':
+        if len(sys.argv) != 5:
+            print("Usage: python client_2pc.py compare_and_set [account] [expected balance] [new balance]")
+            sys.exit(1)
+        account = sys.argv[2] if sys.argv[2].startswith('Account') else f'Account{sys.argv[2]}'
+        client.compare_and_set(account, int(sys.argv[3]), int(sys.argv[4]))
     else:
         print("Unknown command.")
@@ -1,7 +1,10 @@
 from enum import Enum
 
+# Coordinator replicas - Raft group, the leader runs 2PC
 COORDINATOR_NODE = {
     'node1': {'ip': 'localhost', 'port': 5001},
+    'node2': {'ip': 'localhost', 'port': 5008},
+    'node3': {'ip': 'localhost', 'port': 5009},
 }
 
 # Cluster A (Account A) - Raft cluster
@@ -30,3 +33,104 @@ class SimulationScenario(Enum):
 # Timeout settings (in seconds)
 ELECTION_TIMEOUT = (1.0, 2.0)  # Adjusted for faster testing
 HEARTBEAT_INTERVAL = 0.5  # Interval for leader to send heartbeats
+# Timeout of RequestVote and of the reachability check of a new leader; both run while the node holds its lock,
+# so a hung peer must not hold up an election for long
+ELECTION_RPC_TIMEOUT = 0.25
+
+# Cluster leaders push a LeaderAnnouncement to the coordinator right after winning an election,
+# so the coordinator's leader directory is updated without waiting for a failed request
+ANNOUNCE_NEW_LEADERS = True
+
+# Participant lock table (in seconds): how long a prepared transaction may hold its account, how long an
+# older transaction waits for a lock, and how long a younger one waits before giving up (wait-die)
+LOCK_LEASE_TIMEOUT = 30.0
+LOCK_WAIT_TIMEOUT = 2.0
+LOCK_DIE_TIMEOUT = 0.05
+# Escrow mode: transactions with plain deltas share an account lock instead of holding it exclusively, each
+# reserving its delta, so transfers touching a hot account prepare concurrently. Clients may override it per
+# transaction with 'escrow'; operations reading the balance (txn_expr) always lock the account exclusively.
+ESCROW_ENABLED = True
+# How many times the coordinator retries a transaction that lost a lock conflict
+TXN_CONFLICT_RETRIES = 5
+
+# Coordinator batching: transactions arriving within BATCH_WINDOW seconds of each other are prepared and
+# committed together (at most MAX_BATCH_SIZE per batch), with per-transaction votes
+BATCHING_ENABLED = True
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 64
+
+# Transactions that change a single account skip the prepare round (one-phase commit)
+ONE_PHASE_COMMIT_ENABLED = True
+
+# Commit protocol of the coordinator: 'presumed_nothing' or 'presumed_abort'. Under presumed abort, participants without
+# changes vote read-only and leave phase 2, aborts only go to participants that may hold a prepare, and commit records
+# are written to the commit log file in groups of LAZY_COMMIT_FLUSH_SIZE (the Raft log entry is the forced write)
+COMMIT_PROTOCOL = 'presumed_abort'
+LAZY_COMMIT_FLUSH_SIZE = 32
+# Participants' prepare and commit logs (*_prepare_log.jsonl, *_commit_log.jsonl) are append-only JSON Lines files.
+# 0: appends are written to the OS but never fsynced, 1: every append is fsynced, N: one fsync per N records
+RECORD_LOG_FSYNC_EVERY = 0
+# Participants keep the balance in memory and checkpoint it (atomically, with the Raft log index it includes) once
+# this many log entries were applied since the last checkpoint; on restart the log is replayed from the checkpoint
+ACCOUNT_CHECKPOINT_EVERY = 256
+
+# Coordinator decision log (fsynced on every forced record) and redelivery of decisions participants missed
+DECISION_LOG_FSYNC = True
+DECISION_RETRY_INTERVAL = 1.0
+# A participant leader asks the coordinator for the outcome (GetDecision) of transactions it has held prepared for
+# IN_DOUBT_TIMEOUT seconds, and right away for the ones it found prepared when it took over
+IN_DOUBT_TIMEOUT = 5.0
+IN_DOUBT_CHECK_INTERVAL = 1.0
+
+# Coordinator and participants answer a retried request (same txid, batch_id or request_id) with the response of its
+# first attempt for DEDUP_CACHE_TTL seconds; at most DEDUP_CACHE_SIZE responses are kept per node
+DEDUP_CACHE_SIZE = 4096
+DEDUP_CACHE_TTL = 300.0
+
+# RPC retries (retry_policy.py). Each attempt's timeout is estimated from the RTTs of earlier calls of the same RPC
+# type to the same node (srtt + 4 * rttvar, within RPC_TIMEOUT_BOUNDS, RPC_INITIAL_TIMEOUT before the first sample).
+# Attempts are spaced by a random backoff of up to RPC_BACKOFF_BASE * 2^attempt, at most RPC_BACKOFF_CAP seconds.
+RPC_TIMEOUT_BOUNDS = (0.25, 2.0)
+RPC_INITIAL_TIMEOUT = 0.5
+RPC_BACKOFF_BASE = 0.02
+RPC_BACKOFF_CAP = 0.5
+# After CIRCUIT_BREAKER_THRESHOLD failed RPCs in a row, calls to a node fail at once for CIRCUIT_BREAKER_COOLDOWN
+# seconds, then one probe call is let through
+CIRCUIT_BREAKER_THRESHOLD = 3
+CIRCUIT_BREAKER_COOLDOWN = 1.0
+# Retries to a node are limited to RETRY_BUDGET_RATIO of its calls plus RETRY_BUDGET_MIN_RATE per second
+# (at most RETRY_BUDGET_MAX saved up)
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_RATE = 5.0
+RETRY_BUDGET_MAX = 20
+
+# Participants keep the last SNAPSHOT_HISTORY_SIZE balance changes with their commit timestamps for snapshot reads
+# (SnapshotRead); a snapshot older than the oldest kept change can no longer be read
+SNAPSHOT_HISTORY_SIZE = 4096
+
+# GetLogs returns at most LOG_PAGE_SIZE entries per call by default, and never more than MAX_LOG_PAGE_SIZE
+LOG_PAGE_SIZE = 256
+MAX_LOG_PAGE_SIZE = 1024
+
+# Keep-alive client connections (requests with 'keep_alive' set) are closed by the node after CONNECTION_IDLE_TIMEOUT
+# idle seconds; the async client drops its idle connections well before that and keeps at most
+# CLIENT_MAX_CONNECTIONS_PER_NODE open per node
+CONNECTION_IDLE_TIMEOUT = 60.0
+CLIENT_MAX_CONNECTIONS_PER_NODE = 64
+
+# Nodes answer GetMetrics with their counters, gauges and latency histograms. With METRICS_HTTP_PORT_OFFSET set, each
+# node also serves them in the Prometheus text format at http://<ip>:<port + offset>/metrics (e.g. 1000: node1 on
+# port 5001 serves them on 6001); None turns the HTTP endpoint off
+METRICS_HTTP_PORT_OFFSET = None
+
+# Transactions are traced across the coordinator and the participants (spans, see tracing.py). Each node keeps the
+# last TRACE_BUFFER_SIZE spans it recorded in memory for GetTrace; trace_2pc.py stitches a transaction's timeline
+TRACING_ENABLED = True
+TRACE_BUFFER_SIZE = 20000
+
+# Node logging (logger.py): messages below LOG_LEVEL ('DEBUG', 'INFO', 'WARNING' or 'ERROR') are dropped before they
+# are formatted, the others are written by a background thread. Each message type may log LOG_RATE_LIMIT messages
+# per second after a burst of LOG_RATE_BURST (0 turns rate limiting off); dropped messages are counted in the next one
+LOG_LEVEL = 'INFO'
+LOG_RATE_LIMIT = 20
+LOG_RATE_BURST = 50
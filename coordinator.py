@@ -1,83 +1,148 @@
-from node import Node  # Note: Changed from node_2pc import to avoid RAFT behavior
+from node import Node  # Coordinator replicas form their own Raft group (the 2PC participant behaviour lives in node_2pc)
 from config import COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES
 import socket
-import json
 import sys
 import threading
 import time
-from config import SimulationScenario
+import uuid
+import random
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import queue
+from config import SimulationScenario, TXN_CONFLICT_RETRIES, BATCHING_ENABLED, BATCH_WINDOW, MAX_BATCH_SIZE, ONE_PHASE_COMMIT_ENABLED
+from config import COMMIT_PROTOCOL, DECISION_LOG_FSYNC, DECISION_RETRY_INTERVAL, HEARTBEAT_INTERVAL, LOG_PAGE_SIZE
+from config import DEDUP_CACHE_SIZE, DEDUP_CACHE_TTL, ESCROW_ENABLED
+from leader_directory import LeaderDirectory, NOT_LEADER_MESSAGE, is_not_leader
+from decision_log import DecisionLog
+from dedup_cache import DedupCache
+from logger import flush_logs
+import txn_expr
 
-class CoordinatorNode:
+class CoordinatorNode(Node):
+    """
+    A replica of the 2PC coordinator. The replicas in COORDINATOR_NODE form a Raft group: the leader runs the
+    transactions, and its decisions are replicated as 'decision' entries to every replica's decision log, so a
+    new leader can take over (and finish the open rounds) one election timeout after the old one fails.
+    """
     def __init__(self, name):
-        self.name = name
-        self.ip = COORDINATOR_NODE[name]['ip']
-        self.port = COORDINATOR_NODE[name]['port']
-        self.running = True
-        self.server_socket = None
-        self.timeout_duration = 2.0
-        self.cluster_leaders = {
-            'A': None,
-            'B': None
-        }
+        # Durable 2PC decisions, used to finish open rounds after a failover and to answer GetDecision
+        self.decision_log = DecisionLog(f"{name}_decision_log.jsonl", DECISION_LOG_FSYNC)
+        super().__init__(name)
+        self.timeout_duration = 2.0 # Retry budget of an RPC to a participant, in seconds
+        # Cached leader and term of every participant cluster
+        self.leader_directory = LeaderDirectory({'A': CLUSTER_A_NODES, 'B': CLUSTER_B_NODES}, self.send_to_peer)
+        # Worker pool used to talk to all participant leaders at once, for many concurrent transactions
+        self.executor = ThreadPoolExecutor(max_workers=128)
+        # Recent per-phase durations (seconds) of start_2pc
+        self.phase_latencies = {phase: deque(maxlen=1000) for phase in ('leader_discovery', 'prepare', 'commit', 'one_phase')}
+        # Transactions waiting to go out with the next batch, as (request data, Future) pairs
+        self.batch_queue = queue.Queue()
+        # txids whose outcome is still being decided; GetDecision answers 'pending' for them
+        self.active_transactions = set()
+        self.active_lock = threading.Lock()
+        # 'end' records waiting to be replicated together with the next decision
+        self.pending_ends = []
+        # Commit decisions that did not reach a majority in time, {round id: record}; finish_round delivers them
+        # once they commit after all, which releases their commit timestamp
+        self.undelivered_rounds = {}
+        # Responses to client requests by request ID, for resent requests
+        self.dedup_cache = DedupCache(DEDUP_CACHE_SIZE, DEDUP_CACHE_TTL)
+        # Next position to read of every participant log, {(node_name, log_kind): position}, see get_all_logs
+        self.log_cursors = {}
+        # Latest commit timestamp assigned or logged, and the ones whose commits are not acknowledged by every
+        # participant yet; snapshot reads stay below those (see snapshot_ts)
+        self.commit_clock = self.decision_log.max_commit_ts
+        self.unacknowledged_commits = set()
+        self.clock_lock = threading.Lock()
+        self.snapshot_term = None # Term in which recover() registered the open rounds of earlier leaders
 
     def start(self):
-        """Initialize and start the coordinator's server."""
-        print(f"[{self.name}] Starting coordinator...")
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((self.ip, self.port))
-        self.server_socket.listen(5)
-        print(f"[{self.name}] Server listening at {self.ip}:{self.port}")
+        """Starts the batching thread, then the Raft server and main loop of this coordinator replica."""
+        self.logger.info("Starting coordinator...")
+        batch_thread = threading.Thread(target=self.batch_loop)
+        batch_thread.daemon = True
+        batch_thread.start()
+        super().start()
 
-        while self.running:
-            try:
-                client_socket, _ = self.server_socket.accept()
-                client_thread = threading.Thread(target=self.handle_client_connection, args=(client_socket,))
-                client_thread.daemon = True
-                client_thread.start()
-            except Exception as e:
-                if self.running:
-                    print(f"[{self.name}] Server error: {e}")
-
-    def handle_client_connection(self, client_socket):
-        """Manages incoming client connections and RPC requests."""
-        try:
-            data = client_socket.recv(4096).decode()
-            if data:
-                request = json.loads(data)
-                rpc_type = request['rpc_type']
-                response = {}
-
-                if rpc_type == 'GetLeaderStatus':
-                    response = {'is_leader': self.state == 'Leader'}
-                elif rpc_type == '2pc_request':
-                    response = self.start_2pc(request['data'])
-                elif rpc_type == 'SetBalance':
-                    response = self.handle_set_account_balance(request['data'])
-                elif rpc_type == 'PrintAllLogs':
-                    response = self.print_all_logs()           
-                else:
-                    response = {'error': 'Unknown RPC type'}
-
-                client_socket.sendall(json.dumps(response).encode())
-        except Exception as e:
-            print(f"[{self.name}] Error handling client connection: {e}")
-        finally:
-            client_socket.close()
+    def become_leader(self):
+        """Transitions to leader and finishes the rounds the previous leader left open."""
+        with self.clock_lock:
+            self.unacknowledged_commits.clear()  # recover() registers the open rounds again
+        self.undelivered_rounds.clear()
+        super().become_leader()
+        if self.state == 'Leader':
+            # Finish what the previous leader left open, while already answering participants' GetDecision
+            recovery_thread = threading.Thread(target=self.recover, args=(self.current_term,))
+            recovery_thread.daemon = True
+            recovery_thread.start()
+
+    def not_leader_response(self):
+        """Error returned for leader-only requests, with a hint of who the coordinator leader is."""
+        return {'status': 'error', 'message': NOT_LEADER_MESSAGE, 'leader_id': self.leader_id, 'term': self.current_term}
+
+    def decisions_settled(self):
+        """
+        True on a leader whose log holds no uncommitted entries from earlier terms. From then on a transaction
+        without a decision in the log can no longer get one from an earlier leader.
+        """
+        return self.log_settled()
+
+    def handle_request(self, request):
+        """
+        Runs one RPC and returns its response. Raft RPCs run under self.lock; transactions take it only to
+        replicate their decisions. Transactions and decisions are served by the leader only.
+        """
+        rpc_type = request['rpc_type']
+        response = {}
+
+        if rpc_type == 'RequestVote':
+            with self.lock:
+                response = self.handle_request_vote(request['data'])
+        elif rpc_type == 'AppendEntries':
+            with self.lock:
+                response = self.traced_append_entries(request['data'])
+        elif rpc_type == 'GetLeaderStatus':
+            response = {'is_leader': self.state == 'Leader', 'leader_id': self.leader_id, 'term': self.current_term}
+        elif rpc_type == 'ClusterStatus':
+            response = self.cluster_status()
+        elif rpc_type == 'LeaderAnnouncement':
+            response = self.handle_leader_announcement(request['data'])
+        elif rpc_type == 'GetPhaseLatencies':
+            response = self.get_phase_latencies()
+        elif rpc_type == 'GetMetrics':
+            response = self.get_metrics(request.get('data') or {})
+        elif rpc_type == 'GetTrace':
+            response = self.get_trace(request['data'])
+        elif rpc_type == 'GetProtocolStats':
+            with self.stats_lock:
+                response = dict(self.protocol_stats)
+        elif self.state != 'Leader':
+            response = self.not_leader_response()
+        elif rpc_type == '2pc_request':
+            response = self.run_once(request['data'].get('txid'), request['data'], self.start_2pc)
+        elif rpc_type == 'SetBalance':
+            response = self.run_once(request['data'].get('request_id'), request['data'], self.handle_set_account_balance)
+        elif rpc_type == 'PrintAllLogs':
+            response = self.print_all_logs(request['data'])
+        elif rpc_type == 'GetDecision':
+            response = self.handle_get_decision(request['data'])
+        elif rpc_type == 'SnapshotRead':
+            response = self.handle_snapshot_read(request['data'])
+        else:
+            response = {'error': 'Unknown RPC type'}
+        return response
+
+    def run_once(self, request_id, data, handler):
+        """
+        Runs a client request once per client-generated request_id (the txid for 2pc_request): a resent request
+        gets the response of the first attempt, waiting for it if that is still running. Requests without an ID
+        always run. Errors are not kept, so a failed request runs again when resent.
+        """
+        if request_id is None:
+            return handler(data)
+        return self.dedup_cache.run(request_id, lambda: handler(data),
+                                    cacheable=lambda response: isinstance(response, dict) and response.get('status') != 'error')
 
-    def send_rpc(self, ip, port, rpc_type, data, timeout=2.0):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(timeout)
-                s.connect((ip, port))
-                message = json.dumps({'rpc_type': rpc_type, 'data': data})
-                s.sendall(message.encode())
-                response = s.recv(4096).decode()
-                return json.loads(response)
-        except Exception as e:
-            print(f"RPC Error: {e}")
-            return None
-        
     def handle_set_account_balance(self, data ):
         """Set account balance from coordinator"""
         account = data.get('account')
@@ -88,167 +153,791 @@ class CoordinatorNode:
         # Find current RAFT leader for the cluster
         leader = self.find_cluster_leader(cluster_letter)
         if not leader:
-            print(f"No leader found for cluster {cluster_letter}")
+            self.logger.warning("No leader found for cluster %s", cluster_letter)
             return False
         
-        # Send the transaction to the leader
-        node_info = self.get_node_info(leader)
-        response = self.send_rpc(
-            node_info['ip'],
-            node_info['port'],
-            'SetBalance',
-            data
-        )
+        # Send the transaction to the leader (following a redirect if the cached leader stepped down)
+        data['commit_ts'] = self.next_commit_ts()
+        response = self.send_with_retry(leader, 'SetBalance', data, retry=False)
+        if response and (response.get('status') == 'success' or is_not_leader(response)):
+            self.release_commit_ts(data['commit_ts'])
+        else:
+            # The write may still be in the participant leader's log and commit later, at its timestamp
+            self.executor.submit(self.settle_write, cluster_letter, data['commit_ts'])
         return response
 
+    def handle_leader_announcement(self, data):
+        """Records a leader pushed by a participant right after it won an election."""
+        self.leader_directory.update(data['cluster'], data['leader_id'], data.get('term'))
+        self.logger.info("Cluster %s announced leader %s (term %s)", data['cluster'], data['leader_id'], data.get('term'))
+        return {'status': 'success'}
+
     def start_2pc(self, data):
         """
         Start 2PC protocol with account-level transactions
         Args:
             transactions: Dict with format {'AccountA': delta_a, 'AccountB': delta_b}
+        Both phases fan out to all participant leaders at once. A phase resolves as soon as
+        every vote is in, or as soon as any participant refuses, in which case the abort is
+        sent to every participant immediately.
+        A delta may also be an operation evaluated by the participant at prepare time (txn_expr);
+        such transactions run on their own rather than in a batch.
+        Every transaction is traced, with its txid as trace ID (trace_2pc.py).
         """
+        # The response carries the txid, so clients can ask participants about it (GetTransactionStatus)
+        data = {**data, 'txid': data.get('txid') or uuid.uuid4().hex}
+        with self.tracer.trace('start_2pc', data['txid']) as span:
+            response = self.route_transaction(data)
+            if span is not None and response.get('batch_id'):
+                # A batched transaction's rounds are traced as the batch, see batch_loop
+                span['attributes']['batch_id'] = response['batch_id']
+            return response
+
+    def route_transaction(self, data):
+        """Runs a transaction of start_2pc by one-phase commit, in a batch, or by its own 2PC rounds."""
+        simulation_num = data['simulation_num']
+        if self.decision_log.committed_attempt(data['txid']) is not None:
+            # Resent after a coordinator failover: the previous leader already committed it, possibly as a retry
+            return {'status': 'committed', 'txid': data['txid']}
+        error = txn_expr.validate(data['transactions'])
+        if error:
+            return {'status': 'aborted', 'txid': data['txid'], 'message': error}
+        data['transactions'] = txn_expr.normalize(data['transactions'])
+        # Accounts with a zero delta are not changed, so they do not take part in the transaction
+        participants = {account: delta for account, delta in data['transactions'].items() if delta != 0}
+        if len(participants) == 1 and data.get('one_phase', ONE_PHASE_COMMIT_ENABLED) and simulation_num in (0, '0'):
+            return self.count_outcome('one_phase', {'txid': data['txid'], **self.start_1pc(data, participants)})
+
+        # Regular transactions share prepare and commit rounds with the others arriving at the same time
+        if data.get('batching', BATCHING_ENABLED) and simulation_num in (0, '0') and not txn_expr.has_expressions(data['transactions']):
+            return self.count_outcome('batched', {'txid': data['txid'], **self.submit_to_batch(data)})
+
+        try:
+            return self.count_outcome('two_phase', {'txid': data['txid'], **self.run_2pc(data)})
+        finally:
+            self.end_active(data['txid'])
+
+    def count_outcome(self, path, response):
+        """
+        Counts a transaction in transactions_total by path (one_phase, batched, two_phase) and status, and an abort
+        in transaction_aborts_total by the phase that decided it. Returns the response.
+        """
+        status = response.get('status')
+        self.metrics.inc('transactions_total', path=path, status=status)
+        if status == 'aborted':
+            # A transaction is never aborted in its commit phase, so the abort came from the latest of the others
+            # that it reached ('none': rejected before any, e.g. by validation)
+            latency = response.get('latency') or {}
+            phase = next((phase for phase in ('one_phase', 'prepare', 'leader_discovery') if phase in latency), 'none')
+            self.metrics.inc('transaction_aborts_total', path=path, phase=phase)
+        return response
+
+    def run_2pc(self, data):
+        """Runs both phases for a single transaction (see start_2pc)."""
+        simulation_num = data['simulation_num']
         # Convert account-level transactions to current leader-level transactions
         leader_transactions = {}
         transactions = data['transactions']
-        simulation_num = data['simulation_num']
-        
-        # Find current RAFT leaders for each account cluster
+        base_txid = txid = data['txid']
+        self.mark_active(txid)
+        ts = time.time()
+        protocol = data.get('protocol', COMMIT_PROTOCOL)
+        escrow = data.get('escrow', ESCROW_ENABLED)
+        latency = {}
+
+        # Find current RAFT leaders for each account cluster (all clusters queried at once)
+        phase_start = time.time()
+        leaders = self.find_cluster_leaders([cluster_id[-1] for cluster_id in transactions])
+        latency['leader_discovery'] = self.record_phase_latency('leader_discovery', phase_start)
+
         for cluster_id, delta in transactions.items():
             cluster_letter = cluster_id[-1]  # 'A' or 'B' from 'AccountA' or 'AccountB'
-            
-            # Find the current leader in the cluster
-            leader = self.find_cluster_leader(cluster_letter)
+            leader = leaders.get(cluster_letter)
             if not leader:
-                print(f"No leader found for cluster {cluster_letter}")
-                return False
-                
-            # Send only relevant transaction to each leader
+                self.logger.warning("No leader found for cluster %s", cluster_letter)
+                return {'status': 'aborted', 'message': f'No leader found for cluster {cluster_letter}', 'latency': latency}
+
+            # Send only relevant transaction to each leader. ts orders transactions for the participants' wait-die locking
             leader_transactions[leader] = {
+                'txid': txid,
+                'ts': ts,
                 'transactions': {cluster_id: delta},
-                'simulation_num': simulation_num
+                'simulation_num': simulation_num,
+                'protocol': protocol,
+                'escrow': escrow
             }
 
-        # Phase 1: Prepare
-        prepared = True
-        prepare_responses = {}
-        
-        for leader, tx in leader_transactions.items():
-            node_info = self.get_node_info(leader)
-            
-            #--------------- RPC with timeout ---------------
-            start_time = time.time()
-            response = None
-            while time.time() - start_time < self.timeout_duration:
-                response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_prepare', tx)
-                if response:
-                    break
-                time.sleep(0.1)  # Avoid busy-waiting
-            #------------------------------------------------
-            
-            # response = self.send_rpc(
-            #     node_info['ip'],
-            #     node_info['port'],
-            #     '2pc_prepare',
-            #     tx
-            # )
-            
-            if not response:
-                print(f"No response from leader {leader} during prepare phase")
-                prepared = False
-                return {'status': 'aborted', 'message': 'Cluster did not prepare!'}
-                
-            if response.get('status') != 'prepared':
-                print(f"Leader {leader} not prepared")
-                prepared = False
-                return {'status': 'aborted', 'message': 'Cluster did not prepare!'}
-                
-            prepare_responses[leader] = response
-        
+        # Phase 1: Prepare. A transaction that lost a lock conflict is retried under a new txid; it keeps its
+        # timestamp, so it grows older than its competitors and eventually wins.
+        phase_start = time.time()
+        for attempt in range(TXN_CONFLICT_RETRIES + 1):
+            if not self.begin_round(txid, [txid], self.phase2_messages('2pc_abort', leader_transactions), protocol):
+                return {'status': 'aborted', 'message': 'Coordinator lost its majority'}
+            prepared, responses = self.prepare_in_waves(leader_transactions)
+            if prepared:
+                break
+            lost_conflict = any(response and response.get('reason') == 'lock_conflict' for response in responses.values())
+            if not lost_conflict or attempt == TXN_CONFLICT_RETRIES:
+                self.abort_2pc(txid, self.abort_targets(leader_transactions, responses, protocol), protocol)
+                latency['prepare'] = self.record_phase_latency('prepare', phase_start)
+                self.logger.debug("Transaction %s aborted during prepare. Latency: %s", txid, latency)
+                return {'status': 'aborted', 'message': 'Cluster did not prepare!', 'latency': latency}
+            # The abort has to release our locks before the retry asks for them again
+            self.abort_2pc(txid, self.abort_targets(leader_transactions, responses, protocol), protocol, wait=True)
+            txid = f"{base_txid}.{attempt + 1}"
+            self.mark_active(txid)
+            for tx in leader_transactions.values():
+                tx['txid'] = txid
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        latency['prepare'] = self.record_phase_latency('prepare', phase_start)
+
         if simulation_num == SimulationScenario.COORDINATOR_CRASH_AFTER_SENDING_PREPARE.value:
-            print(f"[{self.name}] Simulating coordinator crash after sending prepare requests")
+            self.logger.info("Simulating coordinator crash after sending prepare requests")
             self.simulate_crash_sleep()
-            print(f'Resending prepare requests to leaders: {leader_transactions.keys()}')
-            for leader, tx in leader_transactions.items():
-                node_info = self.get_node_info(leader)
-                response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_prepare', tx)
-                if not response or response.get('status') != 'prepared':
-                    print(f"Leader {leader} not prepared")
-                    prepared = False
-                    return {'status': 'aborted', 'message': 'Cluster did not prepare!'}
-                else:
-                    prepared = True
-                    print('Resend successful.')
-
-        # Phase 2: Commit
-        if prepared:
-            for leader, tx in leader_transactions.items():
-                node_info = self.get_node_info(leader)
-                
-                #--------------- RPC with timeout ---------------
-                start_time = time.time()
-                response = None
-                while time.time() - start_time < self.timeout_duration:
-                    response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_commit', tx)
-                    if response:
-                        break
-                    time.sleep(0.1)  # Avoid busy-waiting
-                #------------------------------------------------
-                
-                # response = self.send_rpc(
-                #     node_info['ip'],
-                #     node_info['port'],
-                #     '2pc_commit',
-                #     tx
-                # )
-                        
-                
-                if not response:
-                    print(f"No response from leader {leader} during commit phase")
-                    return {'status': 'aborted', 'message': 'Cluster did not commit!'}
-            
-                if response.get('status') != 'committed':
-                    return {'status': 'aborted', 'message': 'Cluster did not commit!'}
+            self.logger.info("Resending prepare requests to leaders: %s", leader_transactions.keys())
+            prepared, responses = self.fan_out(leader_transactions, '2pc_prepare', ('prepared', 'read_only'), retry=False)
+            if not prepared:
+                self.abort_2pc(txid, leader_transactions, protocol)
+                return {'status': 'aborted', 'message': 'Cluster did not prepare!'}
+            self.logger.info("Resend successful.")
+
+        # Participants evaluated their operations: phase 2 and the decision log carry the resulting deltas
+        for leader, tx in leader_transactions.items():
+            if 'delta' in responses[leader]:
+                tx['transactions'] = {account: responses[leader]['delta'] for account in tx['transactions']}
+            tx.pop('inputs', None)
+
+        # Phase 2: Commit. Read-only participants already finished in phase 1. The decision is durable before
+        # any participant hears it; from then on the transaction is committed, whatever happens to phase 2
+        phase_start = time.time()
+        commit_transactions = {leader: tx for leader, tx in leader_transactions.items() if responses[leader]['status'] != 'read_only'}
+        replicated, record = True, None
+        if commit_transactions:
+            commit_ts = self.next_commit_ts()
+            for tx in commit_transactions.values():
+                tx['commit_ts'] = commit_ts
+            replicated, record = self.decide(txid, 'commit', [txid], [], self.phase2_messages('2pc_commit', commit_transactions), protocol,
+                                             commit_ts, base_txid)
+        if not replicated:
+            self.logger.warning("Commit decision for %s was not replicated to a majority of the coordinators", txid)
+            return {'status': 'unknown', 'message': 'Coordinator lost its majority; the coordinator leader decides the outcome', 'latency': latency}
+        committed, responses = self.fan_out(commit_transactions, '2pc_commit', 'committed')
+        latency['commit'] = self.record_phase_latency('commit', phase_start)
+        if committed:
+            self.end_round(record)
+        else:
+            self.logger.warning("Transaction %s did not commit on every cluster yet, finishing it in the background. Latency: %s", txid, latency)
+            self.executor.submit(self.finish_round, record, self.acknowledged_clusters(responses))
 
         if simulation_num == SimulationScenario.COORDINATOR_CRASH_AFTER_SENDING_COMMIT.value:
-            print(f"[{self.name}] Simulating coordinator crash after sending commit requests")
+            self.logger.info("Simulating coordinator crash after sending commit requests")
             self.simulate_crash_sleep()
-            print('Getting all logs to compare commit and prepare last entries.')
-            all_logs = self.get_all_logs()
-            for node_name, logs in all_logs.items():
-                for leader, tx in leader_transactions.items():
-                    if node_name == leader:
-                        print('Checking logs for', node_name)
-                        prepare_log = logs.get('prepare_log', [])[-1]
-                        commit_log = logs.get('commit_log', [])[-1]
-                        last_prepare_transaction_id = prepare_log.get('transaction_id')
-                        last_commit_transaction_id = commit_log.get('transaction_id')
-                        print('Last prepare transaction ID:', last_prepare_transaction_id)
-                        print('Last commit transaction ID:', last_commit_transaction_id)
-                        if last_prepare_transaction_id != last_commit_transaction_id:
-                            print(f"Last prepare and commit transaction IDs do not match for {node_name}")
-                            return {'status': 'aborted', 'message': 'Cluster did not agree to commit while coordinator crashed.'}
-            print('All logs match. Transaction committed while coordinator was down.')
-            return {'status': 'committed'}
-        
-        
-        return {'status': 'committed'}
+            self.logger.info("Recovering from the decision log.")
+            self.recover(self.current_term)
+            if self.decision_log.decision(txid) != 'commit':
+                return {'status': 'aborted', 'message': 'No commit decision was logged before the coordinator crashed.'}
+            self.logger.info("Commit decision found in the decision log. Transaction committed while coordinator was down.")
+            return {'status': 'committed', 'txid': txid}
+
+        self.logger.debug("Transaction %s committed. Latency: %s", txid, latency)
+        response = {'status': 'committed', 'txid': txid, 'latency': latency}
+        if txn_expr.has_expressions(transactions):
+            response['deltas'] = {account: delta for tx in leader_transactions.values() for account, delta in tx['transactions'].items()}
+        return response
+
+    # ------------------- One-Phase Commit -------------------
+
+    def start_1pc(self, data, participants):
+        """
+        Commits a transaction that touches a single cluster. That cluster's leader is the only voter, so the
+        coordinator skips the prepare round and sends one 1pc_commit, which checks the balance and applies the
+        delta atomically.
+        """
+        (account, delta), = participants.items()
+        base_txid = txid = data.get('txid') or uuid.uuid4().hex
+        ts = time.time()
+        latency = {}
+
+        phase_start = time.time()
+        leader = self.find_cluster_leaders([account[-1]]).get(account[-1])
+        latency['leader_discovery'] = self.record_phase_latency('leader_discovery', phase_start)
+        if not leader:
+            self.logger.warning("No leader found for cluster %s", account[-1])
+            return {'status': 'aborted', 'message': f'No leader found for cluster {account[-1]}', 'latency': latency}
+
+        # Retried on timeouts: participants answer a repeated 1pc_commit with the outcome of the first one
+        phase_start = time.time()
+        commit_ts = self.next_commit_ts()
+        for attempt in range(TXN_CONFLICT_RETRIES + 1):
+            tx = {'txid': txid, 'ts': ts, 'commit_ts': commit_ts, 'transactions': {account: delta}, 'protocol': data.get('protocol', COMMIT_PROTOCOL),
+                  'escrow': data.get('escrow', ESCROW_ENABLED)}
+            response = self.send_with_retry(leader, '1pc_commit', tx)
+            if not response or response.get('reason') != 'lock_conflict' or attempt == TXN_CONFLICT_RETRIES:
+                break
+            txid = f"{base_txid}.{attempt + 1}"
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        latency['one_phase'] = self.record_phase_latency('one_phase', phase_start)
+
+        if response and response.get('status') == 'abort':
+            # The participant refused before proposing anything
+            self.release_commit_ts(commit_ts)
+            self.logger.debug("Transaction %s aborted in one phase. Latency: %s", txid, latency)
+            return {'status': 'aborted', 'message': 'Cluster did not commit!', 'latency': latency}
+        if not response or response.get('status') != 'committed':
+            # The commit may still be in the participant leader's log and commit later, at its timestamp
+            self.logger.warning("Outcome of one-phase commit %s is unknown: %s", txid, response)
+            self.executor.submit(self.settle_write, account[-1], commit_ts)
+            return {'status': 'unknown', 'message': 'Commit was not acknowledged; it may still be applied', 'latency': latency}
+        self.release_commit_ts(commit_ts)
+        self.logger.debug("Transaction %s committed in one phase. Latency: %s", txid, latency)
+        result = {'status': 'committed', 'txid': txid, 'latency': latency}
+        if txn_expr.is_expression(delta):
+            result['deltas'] = {account: response.get('delta')}
+        return result
+
+    def settle_write(self, cluster_letter, commit_ts):
+        """
+        Keeps commit_ts unacknowledged, holding snapshot reads below it, until the leader of cluster_letter reports
+        that the change stamped with it is settled (GetWriteStatus): applied, or never to be. Asks every
+        DECISION_RETRY_INTERVAL; a new coordinator leader starts without the timestamps of this one.
+        """
+        while self.running and self.state == 'Leader':
+            leader = self.find_cluster_leader(cluster_letter)
+            response = self.send_with_retry(leader, 'GetWriteStatus', {'commit_ts': commit_ts}) if leader else None
+            if response and response.get('state') == 'settled':
+                self.release_commit_ts(commit_ts)
+                return
+            time.sleep(DECISION_RETRY_INTERVAL)
+
+    # ------------------- Decision Log -------------------
+
+    def log_decision(self, record, force=True):
+        """Appends a record to this replica's decision log, counting forced writes for GetProtocolStats."""
+        if self.decision_log.append(record, force):
+            self.count_stat('forced_writes')
+
+    def apply_entry_to_state_machine(self, entry):
+        """Applies a committed Raft entry; decision entries go to this replica's decision log."""
+        super().apply_entry_to_state_machine(entry)
+        if entry.get('type') == 'decision':
+            record = entry['data']
+            self.log_decision(record, force=record['type'] != 'end')
+            with self.clock_lock:
+                self.commit_clock = max(self.commit_clock, record.get('commit_ts') or 0)
+            undelivered = self.undelivered_rounds.get(record['id'])
+            if undelivered is not None and undelivered['type'] == record['type']:
+                del self.undelivered_rounds[record['id']]
+                if self.state == 'Leader':
+                    self.executor.submit(self.finish_round, undelivered)
+
+    def replicate_decision(self, record):
+        """
+        Replicates a decision log record to the coordinator group, together with the 'end' records waiting for a
+        ride. Returns True once a majority of the group stored it. On False the outcome is unknown: the record may
+        still commit under the next leader, so the caller must not act on the decision. A commit decision that
+        commits later, while this replica still leads, is delivered by finish_round then.
+        """
+        with self.lock:
+            entries = [{'type': 'decision', 'data': end} for end in self.pending_ends]
+            entries.append({'type': 'decision', 'data': record})
+            self.pending_ends = []
+            replicated = self.propose_entries(entries)
+            if not replicated and record.get('commit_ts') is not None and self.state == 'Leader':
+                self.undelivered_rounds[record['id']] = record
+            return replicated
+
+    def phase2_messages(self, rpc_type, leader_payloads):
+        """
+        Phase 2 messages as stored in the decision log: keyed by cluster, since the leaders may have changed by the
+        time they are redelivered, and without simulation flags, so a redelivery does not simulate a crash again.
+        """
+        return {
+            self.leader_directory.cluster_of(leader): {
+                'rpc_type': rpc_type,
+                'data': {key: value for key, value in payload.items() if key != 'simulation_num'}
+            }
+            for leader, payload in leader_payloads.items()
+        }
+
+    def begin_round(self, round_id, txids, abort_messages, protocol):
+        """
+        Presumed nothing: logs that a round started, with the aborts to send should it never be decided.
+        Returns False if the record could not be replicated (the round must not start).
+        """
+        if protocol == 'presumed_abort':
+            return True
+        return self.replicate_decision({'id': round_id, 'type': 'begin', 'txids': txids, 'messages': abort_messages})
+
+    def decide(self, round_id, outcome, committed, aborted, messages, protocol, commit_ts=None, base_txid=None):
+        """
+        Logs the decision of a round before any participant hears about it. Returns (replicated, record). Under
+        presumed abort, aborts are not logged ((True, None) is returned): a transaction without a decision counts
+        as aborted. A round that commits carries the commit timestamp of its transactions, and a retried
+        transaction the txid it arrived with (base_txid).
+        """
+        if outcome == 'abort' and protocol == 'presumed_abort':
+            return True, None
+        record = {'id': round_id, 'type': outcome, 'committed': committed, 'aborted': aborted, 'messages': messages}
+        if commit_ts is not None:
+            record['commit_ts'] = commit_ts
+        if base_txid is not None:
+            record['base_txid'] = base_txid
+        return self.replicate_decision(record), record
+
+    def end_round(self, record):
+        """
+        Marks a logged round as acknowledged by every participant. Not forced: the record is replicated with the
+        next decision, and losing it only repeats phase 2.
+        """
+        if record:
+            with self.lock:
+                self.pending_ends.append({'id': record['id'], 'type': 'end'})
+            self.release_commit_ts(record.get('commit_ts'))
+
+    def abort_2pc(self, txid, leader_transactions, protocol, wait=False):
+        """Decides to abort a transaction and sends 2pc_abort to the given leaders."""
+        replicated, record = self.decide(txid, 'abort', [], [txid], self.phase2_messages('2pc_abort', leader_transactions), protocol)
+        if not replicated:
+            return  # Participants learn the outcome from the coordinator leader (GetDecision)
+        if record is None:
+            self.send_abort(leader_transactions, wait)
+        elif wait:
+            self.finish_round(record)
+        else:
+            self.executor.submit(self.finish_round, record)
+
+    def acknowledged_clusters(self, responses):
+        """Returns the clusters whose leader committed a commit round's phase 2 message."""
+        return {self.leader_directory.cluster_of(leader) for leader, response in responses.items()
+                if response and response.get('status') == 'committed'}
+
+    def finish_round(self, record, acknowledged=()):
+        """
+        Delivers the phase 2 messages of a decided round to the current leader of each cluster that has not
+        acknowledged it yet, retrying every DECISION_RETRY_INTERVAL until all of them did, then ends the round.
+        Participants apply a decision at most once, so delivering it twice is harmless.
+        """
+        if record is None:
+            return
+        pending = {cluster: message for cluster, message in record.get('messages', {}).items() if cluster not in acknowledged}
+        while pending and self.running and self.state == 'Leader':
+            leaders = self.find_cluster_leaders(pending)
+            for cluster, message in list(pending.items()):
+                leader = leaders.get(cluster)
+                response = self.send_with_retry(leader, message['rpc_type'], message['data']) if leader else None
+                # Only the outcome the message asks for acknowledges it; a commit answered 'aborted' is sent again
+                if response and response.get('status') == ('aborted' if message['rpc_type'] == '2pc_abort' else 'committed'):
+                    del pending[cluster]
+            if pending:
+                time.sleep(DECISION_RETRY_INTERVAL)
+        if not pending:
+            self.end_round(record)
+            self.logger.debug("Round %s finished (%s)", record['id'], record['type'])
+
+    def recover(self, term):
+        """
+        Run by a new leader of `term`: finishes the rounds the decision log left open, from the log alone. Decided
+        rounds get their phase 2 messages again, rounds that began without a decision (presumed nothing) are
+        aborted. Undecided presumed-abort transactions are not in the log at all; participants asking about them
+        are told to abort.
+        """
+        while self.running and self.state == 'Leader' and self.current_term == term and not self.decisions_settled():
+            time.sleep(HEARTBEAT_INTERVAL)
+        if self.state != 'Leader' or self.current_term != term:
+            return
+
+        open_rounds = self.decision_log.unfinished()
+        if open_rounds:
+            self.logger.info("Recovering %s open rounds from the decision log", len(open_rounds))
+        with self.clock_lock:
+            self.commit_clock = max(self.commit_clock, self.decision_log.max_commit_ts)
+            # Commits of earlier leaders may still be missing on participants until finish_round delivers them
+            self.unacknowledged_commits.update(record['commit_ts'] for record in open_rounds if record.get('commit_ts'))
+            self.snapshot_term = term
+        for record in open_rounds:
+            if record['type'] == 'begin':
+                record = {'id': record['id'], 'type': 'abort', 'committed': [], 'aborted': record['txids'], 'messages': record['messages']}
+                if not self.replicate_decision(record):
+                    return
+            self.executor.submit(self.finish_round, record)
+
+    def mark_active(self, txid):
+        """Records that a transaction is being decided."""
+        with self.active_lock:
+            self.active_transactions.add(txid)
+
+    def end_active(self, base_txid):
+        """Forgets a transaction being decided, together with the txids of its retries."""
+        with self.active_lock:
+            self.active_transactions.discard(base_txid)
+            for attempt in range(1, TXN_CONFLICT_RETRIES + 1):
+                self.active_transactions.discard(f"{base_txid}.{attempt}")
+
+    def handle_get_decision(self, data):
+        """
+        Tells participants the outcome of prepared transactions: 'commit' or 'abort' once decided, 'pending' while
+        the transaction is still being decided. A transaction that is neither was never decided to commit, so it
+        is aborted (presumed abort; under presumed nothing recovery logs the abort).
+        """
+        if not self.decisions_settled():
+            # Decisions of the previous leader may still be committing
+            return {'status': 'success', 'decisions': {txid: 'pending' for txid in data['txids']}}
+        decisions = {}
+        for txid in data['txids']:
+            decision = self.decision_log.decision(txid)
+            if decision is None:
+                with self.active_lock:
+                    decision = 'pending' if txid in self.active_transactions else 'abort'
+            decisions[txid] = decision
+        commit_timestamps = {txid: self.decision_log.commit_ts(txid) for txid, decision in decisions.items() if decision == 'commit'}
+        return {'status': 'success', 'decisions': decisions, 'commit_ts': commit_timestamps}
+
+    # ------------------- Snapshot Reads -------------------
+
+    def next_commit_ts(self):
+        """
+        Assigns a commit timestamp: microseconds of wall-clock time, kept above every timestamp assigned or logged
+        before (so it also grows across leader changes). It stays unacknowledged, holding snapshot reads below it,
+        until release_commit_ts.
+        """
+        with self.clock_lock:
+            self.commit_clock = max(self.commit_clock + 1, time.time_ns() // 1000)
+            self.unacknowledged_commits.add(self.commit_clock)
+            return self.commit_clock
+
+    def release_commit_ts(self, commit_ts):
+        """Marks the changes committed at commit_ts as applied by every participant (or as never to be applied)."""
+        with self.clock_lock:
+            self.unacknowledged_commits.discard(commit_ts)
+
+    def snapshot_ts(self):
+        """
+        Returns the newest timestamp S such that every change committed at or before S was acknowledged by its
+        participant: the cut just below the oldest unacknowledged commit. Commits assigned later get a timestamp
+        above S, so the cut at S never changes once it is read.
+        """
+        with self.clock_lock:
+            if self.unacknowledged_commits:
+                return min(self.unacknowledged_commits) - 1
+            return self.commit_clock
+
+    def handle_snapshot_read(self, data):
+        """
+        Returns the balances of data['accounts'] (default: all) as of one snapshot timestamp, read from every
+        participant leader at once. Nothing is locked or written, so the read never waits for or conflicts with
+        transactions; the snapshot may trail the newest commits by the ones still in flight.
+        """
+        if self.snapshot_term != self.current_term:
+            return {'status': 'error', 'message': 'Coordinator is still recovering the rounds of the previous leader'}
+        accounts = data.get('accounts') or ['AccountA', 'AccountB']
+        snapshot_ts = self.snapshot_ts()
+        leaders = self.find_cluster_leaders([account[-1] for account in accounts])
+        if not all(leaders.values()):
+            return {'status': 'error', 'message': 'No leader found for every cluster'}
+        responses = self.broadcast({leaders[account[-1]]: {'snapshot_ts': snapshot_ts} for account in accounts}, 'GetSnapshotBalance')
+
+        balances = {}
+        for account in accounts:
+            response = responses.get(leaders[account[-1]])
+            if not response or response.get('status') != 'success':
+                return {'status': 'error', 'message': f"{account}: {(response or {}).get('message', 'no response')}"}
+            balances[account] = response['balance']
+        return {'status': 'success', 'snapshot_ts': snapshot_ts, 'balances': balances}
+
+    # ------------------- Batched 2PC -------------------
+
+    def submit_to_batch(self, data):
+        """Queues a transaction for the next batch and waits for its individual outcome."""
+        data = {**data, 'txid': data.get('txid') or uuid.uuid4().hex}
+        self.mark_active(data['txid'])
+        future = Future()
+        self.batch_queue.put((data, future))
+        try:
+            return future.result()
+        finally:
+            self.end_active(data['txid'])
+
+    def batch_loop(self):
+        """
+        Collects the transactions arriving within BATCH_WINDOW of the first one (at most MAX_BATCH_SIZE)
+        and runs them as one batch per commit protocol and escrow setting, since a batch is prepared and decided
+        with one of each. While a batch is in flight the next one fills up, so batches grow with load.
+        """
+        while self.running:
+            batch = [self.batch_queue.get()]
+            deadline = time.time() + BATCH_WINDOW
+            while len(batch) < MAX_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.batch_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups = {}
+            for data, future in batch:
+                options = (data.get('protocol', COMMIT_PROTOCOL), data.get('escrow', ESCROW_ENABLED))
+                groups.setdefault(options, []).append((data, future))
+            for (protocol, escrow), group in groups.items():
+                try:
+                    batch_id = uuid.uuid4().hex
+                    with self.tracer.trace('run_batch', batch_id, size=len(group)):
+                        self.run_batch(group, batch_id, protocol, escrow)
+                except Exception as e:
+                    self.logger.error("Error running batch: %s", e)
+                for _, future in group:
+                    if not future.done():
+                        future.set_result({'status': 'aborted', 'message': 'Batch failed'})
+
+    def run_batch(self, batch, batch_id, protocol, escrow):
+        """
+        Runs one prepare round and one commit round for a whole batch of transactions, all of which asked for
+        `protocol` and `escrow`. Each participant leader receives the transactions touching its cluster in a single
+        2pc_prepare_batch and votes per transaction. A transaction commits only if every participant it touches
+        voted prepared; the outcome of each transaction is handed back to its own client.
+        """
+        ts = time.time()
+        transactions = [{'txid': data['txid'], 'transactions': data['transactions']} for data, _ in batch]
+        results = {}
+        latency = {}
+
+        phase_start = time.time()
+        leaders = self.find_cluster_leaders([account[-1] for tx in transactions for account in tx['transactions']])
+        latency['leader_discovery'] = self.record_phase_latency('leader_discovery', phase_start)
+
+        # Split the batch per participant leader (each leader only sees its own account)
+        leader_batches = {}
+        for tx in transactions:
+            for account, delta in tx['transactions'].items():
+                leader = leaders.get(account[-1])
+                if not leader:
+                    results[tx['txid']] = {'status': 'aborted', 'message': f'No leader found for cluster {account[-1]}'}
+                    continue
+                leader_batch = leader_batches.setdefault(leader, {'batch_id': batch_id, 'ts': ts, 'protocol': protocol, 'escrow': escrow,
+                                                                     'transactions': []})
+                leader_batch['transactions'].append({'txid': tx['txid'], 'transactions': {account: delta}})
+
+        # Phase 1: Prepare (retried as a whole if the batch lost a lock conflict)
+        phase_start = time.time()
+        abort_all = {leader: {'batch_id': batch_id, 'protocol': protocol, 'commit': [], 'abort': [tx['txid'] for tx in leader_batch['transactions']]}
+                     for leader, leader_batch in leader_batches.items()}
+        if not self.begin_round(batch_id, [tx['txid'] for tx in transactions], self.phase2_messages('2pc_commit_batch', abort_all), protocol):
+            for _, future in batch:
+                future.set_result({'status': 'aborted', 'message': 'Coordinator lost its majority'})
+            return
+        for attempt in range(TXN_CONFLICT_RETRIES + 1):
+            # Each attempt is a new request for the participants, which would otherwise answer it from their dedup cache
+            responses = self.broadcast({leader: {**leader_batch, 'attempt': attempt} for leader, leader_batch in leader_batches.items()},
+                                       '2pc_prepare_batch')
+            lost_conflict = any(response and response.get('reason') == 'lock_conflict' for response in responses.values())
+            if not lost_conflict or attempt == TXN_CONFLICT_RETRIES:
+                break
+            # Release what the batch locked before asking again (as its own request, not as the batch's decision)
+            self.broadcast({leader: {'batch_id': batch_id, 'protocol': protocol, 'commit': [], 'abort': [], 'attempt': attempt}
+                            for leader in leader_batches}, '2pc_commit_batch')
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        latency['prepare'] = self.record_phase_latency('prepare', phase_start)
+
+        prepared = {tx['txid']: tx['txid'] not in results for tx in transactions}
+        votes = {leader: (responses.get(leader) or {}).get('votes', {}) for leader in leader_batches}
+        for leader, leader_batch in leader_batches.items():
+            for tx in leader_batch['transactions']:
+                if votes[leader].get(tx['txid']) not in ('prepared', 'read_only'):
+                    prepared[tx['txid']] = False
+
+        # Phase 2: Commit the transactions every participant prepared, abort the others. Under presumed abort,
+        # read-only participants and participants that refused a transaction hear nothing more about it
+        phase_start = time.time()
+        decisions = {}
+        for leader, leader_batch in leader_batches.items():
+            outcome = [(tx, votes[leader].get(tx['txid'])) for tx in leader_batch['transactions']]
+            if protocol == 'presumed_abort':
+                outcome = [(tx, vote) for tx, vote in outcome if vote not in ('read_only', 'abort')]
+            if protocol == 'presumed_abort' and not outcome:
+                continue
+            decisions[leader] = {
+                'batch_id': batch_id,
+                'protocol': protocol,
+                'commit': [tx for tx, vote in outcome if prepared[tx['txid']]],
+                'abort': [tx['txid'] for tx, vote in outcome if not prepared[tx['txid']]]
+            }
+        committed_txids = [tx['txid'] for tx in transactions if prepared[tx['txid']]]
+        aborted_txids = [tx['txid'] for tx in transactions if not prepared[tx['txid']]]
+        commit_ts = self.next_commit_ts() if committed_txids else None
+        for decision in decisions.values():
+            decision['commit_ts'] = commit_ts
+        replicated, record = self.decide(batch_id, 'commit' if committed_txids else 'abort', committed_txids, aborted_txids,
+                                         self.phase2_messages('2pc_commit_batch', decisions), protocol, commit_ts)
+        if not replicated:
+            self.logger.warning("Decision for batch %s was not replicated to a majority of the coordinators", batch_id)
+            for _, future in batch:
+                future.set_result({'status': 'unknown', 'message': 'Coordinator lost its majority; the coordinator leader decides the outcome'})
+            return
+        responses = self.broadcast(decisions, '2pc_commit_batch')
+        latency['commit'] = self.record_phase_latency('commit', phase_start)
+
+        # The decision is logged, so clusters that missed it get it again in the background
+        acknowledged = self.acknowledged_clusters(responses)
+        if all(self.leader_directory.cluster_of(leader) in acknowledged for leader in decisions):
+            self.end_round(record)
+        else:
+            self.logger.warning("Batch %s was not acknowledged by every cluster, finishing it in the background", batch_id)
+            self.executor.submit(self.finish_round, record, acknowledged)
+
+        for tx in transactions:
+            if tx['txid'] not in results:
+                results[tx['txid']] = {'status': 'committed'} if prepared[tx['txid']] else {'status': 'aborted', 'message': 'Cluster did not prepare!'}
+
+        committed = sum(1 for result in results.values() if result['status'] == 'committed')
+        self.logger.debug("Batch %s: %s of %s transactions committed. Latency: %s", batch_id, committed, len(batch), latency)
+        for (data, future), tx in zip(batch, transactions):
+            future.set_result({**results[tx['txid']], 'batch_id': batch_id, 'batch_size': len(batch), 'latency': latency})
+
+    # ------------------- Parallel Fan-out -------------------
+
+    def broadcast(self, leader_payloads, rpc_type):
+        """Sends each leader its own payload at once and waits for all of them. Returns {leader: response}."""
+        trace = self.tracer.context()
+        futures = {leader: self.executor.submit(self.send_with_retry, leader, rpc_type, payload, trace=trace)
+                   for leader, payload in leader_payloads.items()}
+        return {leader: future.result() for leader, future in futures.items()}
+
+    def send_with_retry(self, leader, rpc_type, tx, retry=True, trace=None):
+        """
+        Sends an RPC to a participant leader, retrying until the timeout budget is spent. If the node
+        is no longer the leader, the leader directory is corrected and the RPC follows the leader hint once.
+        Inside a trace (the caller's span, or `trace` when sent from a worker thread) the RPC is a span whose
+        context goes along with it.
+        """
+        with self.tracer.span(rpc_type, trace, leader=leader):
+            trace = self.tracer.context()
+            if trace:
+                tx = {**tx, 'trace': trace}
+            response = self.send_to_node(leader, rpc_type, tx, retry)
+            if is_not_leader(response):
+                new_leader = self.leader_directory.handle_not_leader(leader, response)
+                if new_leader:
+                    self.logger.info("%s is no longer leader, redirecting %s to %s", leader, rpc_type, new_leader)
+                    response = self.send_to_node(new_leader, rpc_type, tx, retry)
+            elif not response:
+                # An unreachable leader is dropped from the directory so the next transaction looks it up again
+                self.leader_directory.invalidate(self.leader_directory.cluster_of(leader), leader)
+            return response
+
+    def send_to_node(self, node_name, rpc_type, tx, retry=True):
+        """
+        Sends an RPC to one participant node through the retry policy: an adaptive timeout per attempt and, with
+        retry, jittered backoff between attempts until the timeout budget is spent. Returns None at once while the
+        node's circuit breaker is open.
+        """
+        node_info = self.get_node_info(node_name)
+
+        def send(timeout):
+            self.count_stat('rpcs')
+            return self.send_rpc(node_info['ip'], node_info['port'], rpc_type, tx, timeout=timeout)
+        return self.retry_policy.call(node_name, rpc_type, send, self.timeout_duration if retry else None)
+
+    def fan_out(self, leader_transactions, rpc_type, expected_status, retry=True):
+        """
+        Sends rpc_type to every leader at once and collects the votes as they arrive.
+        expected_status is a status or a tuple of accepted statuses.
+        Returns (True, responses) once every leader answered with expected_status, or
+        (False, responses) as soon as one leader fails or answers anything else. Calls that
+        are still in flight at that point are left to finish in the background.
+        """
+        trace = self.tracer.context()
+        futures = {
+            self.executor.submit(self.send_with_retry, leader, rpc_type, dict(tx), retry, trace): leader
+            for leader, tx in leader_transactions.items()
+        }
+        if isinstance(expected_status, str):
+            expected_status = (expected_status,)
+        responses = {}
+        for future in as_completed(futures):
+            leader = futures[future]
+            response = future.result()
+            responses[leader] = response
+            if not response:
+                self.logger.warning("No response from leader %s during %s", leader, rpc_type)
+                return False, responses
+            if response.get('status') not in expected_status:
+                self.logger.debug("Leader %s answered %s to %s", leader, response.get('status'), rpc_type)
+                return False, responses
+        return True, responses
+
+    def prepare_in_waves(self, leader_transactions):
+        """
+        Sends 2pc_prepare to every leader at once, unless some account's operation reads the balance of another
+        account (txn_expr). Then the other accounts are prepared first, and the balances in their votes are passed
+        to the reading accounts' leaders as 'inputs'. Returns (prepared, responses) like fan_out.
+        """
+        operations = {account: operation for tx in leader_transactions.values() for account, operation in tx['transactions'].items()}
+        _, dependent = txn_expr.waves(operations)
+        second = {leader: tx for leader, tx in leader_transactions.items() if set(tx['transactions']) & set(dependent)}
+        first = {leader: tx for leader, tx in leader_transactions.items() if leader not in second}
+
+        prepared, responses = self.fan_out(first, '2pc_prepare', ('prepared', 'read_only'))
+        if not prepared or not second:
+            return prepared, responses
+        inputs = {account: responses[leader].get('balance') for leader, tx in first.items() for account in tx['transactions']}
+        for tx in second.values():
+            tx['inputs'] = inputs
+        prepared, second_responses = self.fan_out(second, '2pc_prepare', ('prepared', 'read_only'))
+        return prepared, {**responses, **second_responses}
+
+    def send_abort(self, leader_transactions, wait=False):
+        """Sends 2pc_abort to every participant leader, by default without waiting for the acknowledgements."""
+        trace = self.tracer.context()
+        futures = [self.executor.submit(self.send_with_retry, leader, '2pc_abort', dict(tx), trace=trace) for leader, tx in leader_transactions.items()]
+        if wait:
+            for future in futures:
+                future.result()
+
+    def abort_targets(self, leader_transactions, responses, protocol):
+        """
+        Returns the leaders an abort has to go to. Under presumed abort, participants that voted abort or read-only
+        hold nothing for the transaction, so only the others (prepared or not heard from) are told.
+        """
+        if protocol != 'presumed_abort':
+            return leader_transactions
+        return {leader: tx for leader, tx in leader_transactions.items()
+                if (responses.get(leader) or {}).get('status') not in ('abort', 'read_only')}
+
+    def record_phase_latency(self, phase, start_time):
+        """Records how long a 2PC phase took (also as a span of the current trace) and returns the duration in seconds."""
+        elapsed = time.time() - start_time
+        self.phase_latencies[phase].append(elapsed)
+        self.metrics.observe('txn_phase_duration_seconds', elapsed, phase=phase)
+        self.tracer.record(phase, start_time)
+        return elapsed
+
+    def metric_gauges(self):
+        """Adds the transactions in progress, waiting for the next batch, and committed but not acknowledged by every participant."""
+        gauges = super().metric_gauges()
+        gauges.append(('transactions_active', {}, len(self.active_transactions)))
+        gauges.append(('batch_queue_length', {}, self.batch_queue.qsize()))
+        gauges.append(('commits_unacknowledged', {}, len(self.unacknowledged_commits)))
+        return gauges
+
+    def get_phase_latencies(self):
+        """Summarizes the recorded per-phase latencies (count, mean and max in seconds)."""
+        summary = {}
+        for phase, samples in self.phase_latencies.items():
+            if samples:
+                summary[phase] = {'count': len(samples), 'mean': sum(samples) / len(samples), 'max': max(samples)}
+        return {'status': 'success', 'latency': summary}
+
+    def find_cluster_leaders(self, cluster_letters):
+        """Finds the leaders of several clusters at once. Returns {cluster_letter: leader or None}."""
+        futures = {letter: self.executor.submit(self.find_cluster_leader, letter) for letter in set(cluster_letters)}
+        return {letter: future.result() for letter, future in futures.items()}
 
     def find_cluster_leader(self, cluster_letter):
         """
-        Find current RAFT leader in specified cluster
+        Find current RAFT leader in specified cluster, from the leader directory when it is cached
         Returns: leader node name or None if no leader found
         """
-        cluster_nodes = CLUSTER_A_NODES if cluster_letter == 'A' else CLUSTER_B_NODES
-        for node_name, node_info in cluster_nodes.items():
-            response = self.send_rpc(
-                node_info['ip'],
-                node_info['port'],
-                'GetLeaderStatus',
-                {}
-            )
-            if response and response.get('is_leader', False):
-                return node_name
-        return None
+        return self.leader_directory.find_leader(cluster_letter)
 
     def get_node_info(self, node_name):
         """Get node connection information"""
@@ -258,27 +947,43 @@ class CoordinatorNode:
             return CLUSTER_B_NODES[node_name]
         return None
     
-    def get_all_logs(self):
-        """Retrieve logs from all nodes in the system"""
+    def fetch_log(self, node_info, log_kind, start):
+        """
+        Reads a participant's log from position `start` to its current end, one GetLogs page at a time.
+        Returns (entries, next cursor); the entries read before a failed page are kept.
+        """
+        entries = []
+        while True:
+            response = self.send_rpc(node_info['ip'], node_info['port'], 'GetLogs',
+                                     {'log': log_kind, 'start': start, 'limit': LOG_PAGE_SIZE})
+            if not response or response.get('status') != 'success':
+                return entries, start
+            entries.extend(response['entries'])
+            start = response['next']
+            if not response['entries'] or start >= response['end']:
+                return entries, start
+
+    def get_all_logs(self, from_start=False):
+        """
+        Retrieve the prepare, commit and Raft logs of all participant nodes. Only the entries added since the
+        previous call are fetched, unless from_start is set. Returns {node_name: {log_kind: (first position, entries)}}.
+        """
         all_logs = {}
         for node_name, node_info in {**CLUSTER_A_NODES, **CLUSTER_B_NODES}.items():
-            response = self.send_rpc(
-                node_info['ip'],
-                node_info['port'],
-                'GetLogs',
-                {}
-            )
-            if response:
-                all_logs[node_name] = response.get('all_logs', [])
+            all_logs[node_name] = {}
+            for log_kind in ('prepare', 'commit', 'raft'):
+                start = 0 if from_start else self.log_cursors.get((node_name, log_kind), 0)
+                entries, self.log_cursors[(node_name, log_kind)] = self.fetch_log(node_info, log_kind, start)
+                all_logs[node_name][log_kind] = (start, entries)
         return all_logs
-    
-    def print_all_logs(self):
-        """Print logs from all nodes in the system"""
-        all_logs = self.get_all_logs()
+
+    def print_all_logs(self, data):
+        """Print the log entries of all nodes added since the previous PrintAllLogs (all of them with 'from_start')."""
+        all_logs = self.get_all_logs(data.get('from_start', False))
         for node_name, logs in all_logs.items():
-            print(f"\nLogs from node {node_name}:")
-            for entry in logs:
-                print(entry)
+            for log_kind, (start, entries) in logs.items():
+                self.logger.info("%s log of node %s from position %s:\n%s", log_kind.capitalize(), node_name, start,
+                                 '\n'.join(map(str, entries)))
         return {'status': 'success'}
     
     def simulate_crash_sleep(self):
@@ -293,17 +998,17 @@ class CoordinatorNode:
             self.server_socket.close()
             self.server_socket = None
         
-        print(f"[{self.name}] Going to sleep for 10 seconds to allow new leader election...")
+        self.logger.info("Going to sleep for 10 seconds to allow new leader election...")
         time.sleep(10)
         
         # Create and bind new socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.ip, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(128)
         
         self.simulating_crash_ongoing = False
-        print("Coordinator rejoining cluster")
+        self.logger.info("Coordinator rejoining cluster")
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
@@ -319,8 +1024,9 @@ if __name__ == '__main__':
     try:
         node.start()
     except KeyboardInterrupt:
-        print(f"[{node.name}] Shutting down...")
+        node.logger.info("Shutting down...")
     finally:
         node.running = False
         if node.server_socket:
             node.server_socket.close()
+        flush_logs()
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+
+class DecisionLog:
+    """
+    Write-ahead log of the coordinator's 2PC decisions, one JSON record per line. A record describes one round
+    (a single transaction or a batch, identified by 'id'):
+
+        {'id': ..., 'type': 'begin' | 'commit' | 'abort' | 'end',
+         'committed': [txid, ...], 'aborted': [txid, ...], 'commit_ts': ..., 'base_txid': ...,
+         'messages': {cluster_letter: {'rpc_type': ..., 'data': ...}}}
+
+    'messages' are the phase 2 messages still owed to the participants, so a restarted coordinator can finish
+    the round from the log alone. 'begin' (presumed nothing only) is written before the prepare round, 'commit'
+    and 'abort' hold the decision (with the commit timestamp of the committed transactions), and 'end' marks that
+    every participant acknowledged it. A transaction retried after a lock conflict commits under the txid of its
+    attempt; its decision carries the txid the client sent as 'base_txid'. Forced records are fsynced before
+    append() returns.
+    """
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.decisions = {}   # {txid: 'commit' | 'abort'}
+        self.commit_timestamps = {} # {txid: commit_ts} of committed transactions
+        self.committed_attempts = {} # {base txid: txid of the attempt that committed}
+        self.max_commit_ts = 0
+        self.open_rounds = {} # {round id: latest record} for rounds without an 'end' record
+        self.lock = threading.Lock()
+        self.load()
+        self.file = open(self.path, 'a')
+
+    def load(self):
+        """Rebuilds the decision index and the open rounds from the log file."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn write at the end of the log: the record was never forced, so it never counted
+                self._index(record)
+
+    def _index(self, record):
+        """Updates the decision index and the open rounds with one record."""
+        for txid in record.get('committed', []):
+            self.decisions[txid] = 'commit'
+            self.commit_timestamps[txid] = record.get('commit_ts')
+            self.committed_attempts[record.get('base_txid', txid)] = txid
+        self.max_commit_ts = max(self.max_commit_ts, record.get('commit_ts') or 0)
+        for txid in record.get('aborted', []):
+            self.decisions[txid] = 'abort'
+        if record['type'] == 'end':
+            self.open_rounds.pop(record['id'], None)
+        else:
+            self.open_rounds[record['id']] = record
+
+    def append(self, record, force=True):
+        """Appends a record; a forced record is on disk when this returns. Returns True if it was forced."""
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            if force and self.fsync:
+                os.fsync(self.file.fileno())
+            self._index(record)
+        return force
+
+    def decision(self, txid):
+        """Returns 'commit' or 'abort' if the log holds a decision for txid, else None."""
+        with self.lock:
+            return self.decisions.get(txid)
+
+    def committed_attempt(self, base_txid):
+        """Returns the txid under which the transaction the client sent as base_txid committed, or None."""
+        with self.lock:
+            return self.committed_attempts.get(base_txid)
+
+    def commit_ts(self, txid):
+        """Returns the commit timestamp of a committed transaction (None for records written without one)."""
+        with self.lock:
+            return self.commit_timestamps.get(txid)
+
+    def unfinished(self):
+        """Returns the latest record of every round that has no 'end' record yet."""
+        with self.lock:
+            return list(self.open_rounds.values())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
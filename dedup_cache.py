@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class DedupCache:
+    """
+    Bounded table of request outcomes keyed by request ID, so that a retried request is answered with the outcome
+    of the first attempt instead of running again. A repeat that arrives while the first attempt is still running
+    waits for its outcome. Entries are dropped `ttl` seconds after the first attempt started, or oldest first once
+    more than `capacity` are held.
+    """
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict() # {key: {'future': Future, 'started': time}}
+        self.lock = threading.Lock()
+
+    def run(self, key, handler, cacheable=lambda response: True):
+        """
+        Returns handler() for the first request with `key` and the same response for repeats. Responses for which
+        cacheable(response) is False (e.g. 'not the leader' errors) are handed to the requests already waiting but
+        not kept, so a later retry runs again.
+        """
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            first = entry is None
+            if first:
+                entry = self.entries[key] = {'future': Future(), 'started': time.time()}
+                if len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+        future = entry['future']
+        if not first:
+            return future.result()
+
+        try:
+            response = handler()
+        except Exception as e:
+            self.forget(key)
+            future.set_exception(e)
+            raise
+        if not cacheable(response):
+            self.forget(key)
+        future.set_result(response)
+        return response
+
+    def forget(self, key):
+        """Drops the entry of key, if any."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def _expire(self):
+        """Drops entries older than ttl (oldest first). The caller holds self.lock."""
+        now = time.time()
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry['started'] < self.ttl:
+                break
+            del self.entries[key]
@@ -0,0 +1,173 @@
+"""
+In-process cluster for tests and benchmarks: the coordinator replicas and both participant clusters of config.py,
+started as threads of one process on free localhost ports, with their files in a working directory of their own.
+
+    with LocalCluster() as cluster:
+        ...  # config.py's node tables point at the cluster, so every client in the process reaches it
+
+`python benchmark_2pc.py load --local` runs the load generator against one, benchmark_raft.py runs clusters of
+plain Raft nodes.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from client import BaseClient
+from config import NODES, COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES, HEARTBEAT_INTERVAL
+from coordinator import CoordinatorNode
+from logger import flush_logs
+from participant import ParticipantNode
+
+
+def free_ports(count):
+    """Returns `count` distinct localhost ports that were free a moment ago (the OS picks them)."""
+    sockets = []
+    try:
+        for _ in range(count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('localhost', 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+class LocalCluster:
+    """
+    Runs nodes of config.py in this process: by default every node, with the class of its role, or else the nodes
+    of `node_types` ({node_name: node class}, e.g. plain Raft Nodes). start() moves all nodes of config.py to free
+    ports by rewriting the ip and port of each entry of the config node tables in place, which every module
+    imported, and runs the nodes from data_dir (a new temporary directory by default, removed again by stop()).
+    Node output goes to nodes.log there. The working directory and stdout are process-wide, so only one cluster
+    runs at a time.
+    """
+    def __init__(self, data_dir=None, node_types=None):
+        self.data_dir = data_dir
+        self.temporary = data_dir is None
+        self.node_types = node_types or {**{name: CoordinatorNode for name in COORDINATOR_NODE},
+                                         **{name: ParticipantNode for name in {**CLUSTER_A_NODES, **CLUSTER_B_NODES}}}
+        self.nodes = {}   # {node_name: running node}
+        self.threads = {} # {node_name: thread running the node's main loop}
+        self.original_addresses = {}
+        self.previous_cwd = None
+        self.previous_stdout = None
+        self.log = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self, timeout=30.0, poll_interval=HEARTBEAT_INTERVAL):
+        """Starts all nodes and waits until each of their clusters has a leader (checked every poll_interval)."""
+        self.original_addresses = {name: dict(node_info) for name, node_info in NODES.items()}
+        for node_info, port in zip(NODES.values(), free_ports(len(NODES))):
+            node_info['ip'] = 'localhost'
+            node_info['port'] = port
+
+        if self.temporary:
+            self.data_dir = tempfile.mkdtemp(prefix='2pc-cluster-')
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.previous_cwd = os.getcwd()
+        os.chdir(self.data_dir)
+        self.log = open('nodes.log', 'a', buffering=1)
+        self.previous_stdout = sys.stdout
+        sys.stdout = self.log
+
+        for name in self.node_types:
+            self.start_node(name)
+        if not self.wait_for_leaders(timeout, poll_interval):
+            self.stop()
+            raise RuntimeError(f"No leader elected in every cluster within {timeout} seconds")
+
+    def start_node(self, name):
+        """Creates a node from the files in data_dir (like a process restart) and starts it. Returns the node."""
+        node = self.node_types[name](name)
+        thread = threading.Thread(target=node.start, daemon=True)
+        thread.start()
+        self.nodes[name], self.threads[name] = node, thread
+        return node
+
+    def kill(self, name):
+        """Stops a node the way a crash would: it stops serving and sending, nothing is flushed."""
+        node = self.nodes.pop(name)
+        node.running = False
+        self.close_server(node)
+        self.threads.pop(name).join(HEARTBEAT_INTERVAL * 4)
+
+    @staticmethod
+    def close_server(node):
+        """
+        Closes a node's listening socket, waking its accept() first so the port is free for a restart at once, and
+        its metrics endpoint.
+        """
+        if node.metrics_server:
+            node.metrics_server.shutdown()
+            node.metrics_server.server_close()
+        if not node.server_socket:
+            return
+        try:
+            node.server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        node.server_socket.close()
+
+    def clusters(self):
+        """Returns the config node table of every cluster with a node in this harness, restricted to those nodes."""
+        tables = (COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES)
+        clusters = [{name: node_info for name, node_info in table.items() if name in self.node_types} for table in tables]
+        return [cluster_nodes for cluster_nodes in clusters if cluster_nodes]
+
+    def wait_for_leaders(self, timeout, poll_interval=HEARTBEAT_INTERVAL):
+        """Returns True once every cluster has a leader, False if that took longer than `timeout` seconds."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(self.leader_of(cluster_nodes) for cluster_nodes in self.clusters()):
+                return True
+            time.sleep(poll_interval)
+        return False
+
+    def leader_of(self, cluster_nodes):
+        """Returns the name of the running node of cluster_nodes that reports itself leader, or None."""
+        for node_name, node_info in cluster_nodes.items():
+            if node_name not in self.nodes:
+                continue
+            status = BaseClient.send_rpc(node_info['ip'], node_info['port'], 'ClusterStatus', {}, timeout=1)
+            if status and status.get('is_leader'):
+                return node_name
+        return None
+
+    def stop(self):
+        """Stops all nodes, then restores the config node tables, working directory and stdout."""
+        for node in self.nodes.values():
+            node.running = False
+            if isinstance(node, ParticipantNode):
+                with node.lock:
+                    node.sync_logs()
+            self.close_server(node)
+        # Main loops notice `running` within a heartbeat; wait for them before leaving data_dir
+        for thread in self.threads.values():
+            thread.join(HEARTBEAT_INTERVAL * 4)
+        self.nodes, self.threads = {}, {}
+        flush_logs()  # Node output still queued belongs in nodes.log
+
+        for name, address in self.original_addresses.items():
+            NODES[name].update(address)
+        if self.previous_stdout is not None:
+            sys.stdout = self.previous_stdout
+            self.previous_stdout = None
+        if self.log:
+            self.log.close()
+            self.log = None
+        if self.previous_cwd is not None:
+            os.chdir(self.previous_cwd)
+            self.previous_cwd = None
+        if self.temporary and self.data_dir:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+            self.data_dir = None
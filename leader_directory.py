@@ -0,0 +1,87 @@
+import threading
+
+# Error message returned by participants that are asked to do leader-only work
+NOT_LEADER_MESSAGE = 'Not the cluster leader'
+
+
+def is_not_leader(response):
+    """Returns True if the response is a participant's 'not the cluster leader' error."""
+    return bool(response) and response.get('status') == 'error' and response.get('message') == NOT_LEADER_MESSAGE
+
+
+class LeaderDirectory:
+    """
+    Caches the current Raft leader (and its term) of every participant cluster, so that leader discovery
+    costs no RPCs once a leader is known. The cache is refreshed from the leader_id/term hints participants
+    return, invalidated on 'not the cluster leader' errors, and updated by leader announcements.
+    """
+    def __init__(self, clusters, send=None):
+        self.clusters = clusters # {cluster_letter: {node_name: {'ip': ..., 'port': ...}}}
+        self.send = send         # send(node_name, rpc_type, data) used by find_leader; None if the owner discovers leaders itself
+        self.leaders = {}        # {cluster_letter: {'leader': node_name, 'term': term}}
+        self.lock = threading.Lock()
+
+    def cluster_of(self, node_name):
+        """Returns the cluster letter a node belongs to, or None."""
+        for cluster, nodes in self.clusters.items():
+            if node_name in nodes:
+                return cluster
+        return None
+
+    def get_leader(self, cluster):
+        """Returns the cached leader of a cluster without contacting any node."""
+        with self.lock:
+            cached = self.leaders.get(cluster)
+            return cached['leader'] if cached else None
+
+    def find_leader(self, cluster):
+        """
+        Returns the leader of a cluster, from the cache if possible. Otherwise polls the cluster's nodes with
+        GetLeaderStatus and stops at the first node that is the leader or knows who the leader is.
+        """
+        leader = self.get_leader(cluster)
+        if leader:
+            return leader
+
+        for node_name in self.clusters.get(cluster, {}):
+            response = self.send(node_name, 'GetLeaderStatus', {})
+            if not response:
+                continue
+            if response.get('is_leader'):
+                self.update(cluster, node_name, response.get('term'))
+                return node_name
+            hint = response.get('leader_id')
+            if hint in self.clusters[cluster]:
+                self.update(cluster, hint, response.get('term'))
+                return hint
+        return None
+
+    def update(self, cluster, leader, term=None):
+        """Records a leader unless the cache already holds a leader from a newer term."""
+        if cluster not in self.clusters or leader not in self.clusters[cluster]:
+            return
+        with self.lock:
+            cached = self.leaders.get(cluster)
+            if cached and term is not None and cached['term'] is not None and term < cached['term']:
+                return
+            self.leaders[cluster] = {'leader': leader, 'term': term}
+
+    def invalidate(self, cluster, leader=None):
+        """Drops the cached leader of a cluster (only if it still is `leader`, when given)."""
+        with self.lock:
+            cached = self.leaders.get(cluster)
+            if cached and (leader is None or cached['leader'] == leader):
+                del self.leaders[cluster]
+
+    def handle_not_leader(self, node_name, response):
+        """
+        Processes a 'not the cluster leader' error from node_name: invalidates the node and records the
+        leader hint carried by the error. Returns the hinted leader, or None if the node did not know one.
+        """
+        cluster = self.cluster_of(node_name)
+        self.invalidate(cluster, node_name)
+        hint = response.get('leader_id')
+        if hint and hint != node_name and hint in self.clusters.get(cluster, {}):
+            self.update(cluster, hint, response.get('term'))
+            return hint
+        return None
@@ -0,0 +1,204 @@
+import threading
+import time
+from logger import get_logger
+
+# Owner recorded on an account locked in escrow mode; the transactions sharing it are its holders
+ESCROW_OWNER = 'escrow'
+
+logger = get_logger('lock_table')
+
+
+class LockTable:
+    """
+    Per-account locks held by a transaction from prepare until commit or abort, together with the balance delta
+    the transaction reserved on the account.
+
+    A lock is either exclusive (one owner) or an escrow lock shared by any number of owners whose deltas commute:
+    each reserves its delta and the participant admits a new one only if the balance covers every reserved debit
+    (credits count once they commit), so the order in which the holders commit cannot overdraw the account.
+
+    Waiting transactions are granted the lock oldest first (by the timestamp the coordinator assigned); an escrow
+    transaction joins a held escrow lock unless an older transaction waits for the account exclusively.
+    Deadlocks between transactions that lock the same accounts in different order are broken the wait-die
+    way: an older transaction waits up to wait_timeout for a younger holder, a younger transaction only
+    waits die_timeout before giving up. Every lock carries a lease; an expired lock is handed to the next
+    transaction that asks for the account, so a prepare that never finished cannot block it forever. A lock with
+    reservations is never reclaimed: the transaction voted prepared, so only its decision (from the coordinator, or
+    asked for with GetDecision once it is in doubt) may release it.
+    """
+    def __init__(self, lease_timeout, wait_timeout, die_timeout):
+        self.lease_timeout = lease_timeout # Seconds a prepared transaction may hold an account
+        self.wait_timeout = wait_timeout   # Longest time an older transaction waits for a lock
+        self.die_timeout = die_timeout     # Longest time a younger transaction waits for a lock
+        # {account: {'owner': txid, 'ts': ts, 'acquired': time, 'expires': time, 'reservations': {txid: delta}}}
+        # An escrow lock has owner ESCROW_OWNER and 'holders': {owner: {'ts', 'acquired', 'expires', 'txids'}}
+        self.locks = {}
+        self.waiting = {} # {account: {owner: {'ts': ts, 'escrow': bool}}} transactions waiting for each account
+        self.condition = threading.Condition()
+
+    def acquire(self, account, owner, ts, escrow=False):
+        """
+        Locks an account for owner, exclusively or (escrow) shared with other escrow transactions. Returns
+        (granted, waited_seconds). Acquiring a lock the owner already holds succeeds immediately and renews the lease.
+        """
+        start_time = time.time()
+        with self.condition:
+            waiters = self.waiting.setdefault(account, {})
+            waiters[owner] = {'ts': ts, 'escrow': escrow}
+            try:
+                while True:
+                    now = time.time()
+                    lock = self._reclaim_expired(account, owner, now)
+                    if lock is not None and self._held_by(lock, owner):
+                        self._renew(lock, owner, now)
+                        return True, now - start_time
+                    if lock is None and self._is_oldest_waiter(waiters, owner):
+                        self.locks[account] = self._new_lock(owner, ts, now, escrow)
+                        return True, now - start_time
+                    if escrow and lock is not None and lock['owner'] == ESCROW_OWNER and not self._older_exclusive_waiter(waiters, owner):
+                        lock['holders'][owner] = {'ts': ts, 'acquired': now, 'expires': now + self.lease_timeout, 'txids': []}
+                        lock['ts'] = self._min_ts(lock['ts'], ts)
+                        return True, now - start_time
+
+                    # Wait-die: a transaction younger than the holder only waits briefly
+                    holder_ts = lock['ts'] if lock else None
+                    older = ts is not None and holder_ts is not None and ts <= holder_ts
+                    deadline = start_time + (self.wait_timeout if older or lock is None else self.die_timeout)
+                    if now >= deadline:
+                        return False, now - start_time
+                    wake_up = min(deadline, self._expires(lock)) if lock else deadline
+                    self.condition.wait(wake_up - now)
+            finally:
+                del waiters[owner]
+                self.condition.notify_all()
+
+    def _new_lock(self, owner, ts, now, escrow):
+        if not escrow:
+            return {'owner': owner, 'ts': ts, 'acquired': now, 'expires': now + self.lease_timeout, 'reservations': {}}
+        return {'owner': ESCROW_OWNER, 'ts': ts, 'acquired': now, 'reservations': {},
+                'holders': {owner: {'ts': ts, 'acquired': now, 'expires': now + self.lease_timeout, 'txids': []}}}
+
+    def _held_by(self, lock, owner):
+        return owner in lock['holders'] if lock['owner'] == ESCROW_OWNER else lock['owner'] == owner
+
+    def _renew(self, lock, owner, now):
+        (lock['holders'][owner] if lock['owner'] == ESCROW_OWNER else lock)['expires'] = now + self.lease_timeout
+
+    def _expires(self, lock):
+        if lock['owner'] == ESCROW_OWNER:
+            return min(holder['expires'] for holder in lock['holders'].values())
+        return lock['expires']
+
+    def _reclaim_expired(self, account, owner, now):
+        """
+        Drops the expired lock (or expired escrow holders) of other owners on account, unless they reserved a delta.
+        Returns the lock left, or None.
+        """
+        lock = self.locks.get(account)
+        if lock is None:
+            return None
+        if lock['owner'] != ESCROW_OWNER:
+            if lock['expires'] <= now and lock['owner'] != owner and not lock['reservations']:
+                logger.warning("Lock on %s held by %s expired, reclaiming it", account, lock['owner'])
+                del self.locks[account]
+                return None
+            return lock
+        for holder_owner, holder in list(lock['holders'].items()):
+            if holder['expires'] <= now and holder_owner != owner and not holder['txids']:
+                logger.warning("Escrow reservation on %s held by %s expired, reclaiming it", account, holder_owner)
+                self._drop_holder(account, lock, holder_owner)
+        return self.locks.get(account)
+
+    def _drop_holder(self, account, lock, owner):
+        """Removes an escrow holder and its reservations, and the lock once no holder is left. Returns the reservations."""
+        holder = lock['holders'].pop(owner)
+        reservations = {txid: lock['reservations'].pop(txid) for txid in holder['txids'] if txid in lock['reservations']}
+        if not lock['holders']:
+            del self.locks[account]
+        else:
+            lock['ts'] = min((h['ts'] for h in lock['holders'].values() if h['ts'] is not None), default=None)
+        return reservations
+
+    @staticmethod
+    def _min_ts(a, b):
+        return b if a is None else a if b is None else min(a, b)
+
+    def _is_oldest_waiter(self, waiters, owner):
+        """Returns True if no transaction older than owner is waiting (transactions without a timestamp come last)."""
+        age = lambda ts: float('inf') if ts is None else ts
+        return all(age(other['ts']) >= age(waiters[owner]['ts']) for other in waiters.values())
+
+    def _older_exclusive_waiter(self, waiters, owner):
+        """Returns True if a transaction older than owner waits for the account exclusively."""
+        age = lambda ts: float('inf') if ts is None else ts
+        return any(not other['escrow'] and age(other['ts']) < age(waiters[owner]['ts']) for other in waiters.values())
+
+    def reserve(self, account, owner, txid, delta):
+        """Records the delta a transaction prepared against an account it holds the lock for."""
+        with self.condition:
+            lock = self.locks.get(account)
+            if lock is None or not self._held_by(lock, owner):
+                return False
+            lock['reservations'][txid] = delta
+            if lock['owner'] == ESCROW_OWNER:
+                lock['holders'][owner]['txids'].append(txid)
+            return True
+
+    def reserved_debits(self, account):
+        """Returns the (negative) sum of the debits reserved on account, which prepared transactions may still apply."""
+        with self.condition:
+            lock = self.locks.get(account)
+            return sum(min(delta, 0) for delta in lock['reservations'].values()) if lock else 0
+
+    def holds(self, account, owner):
+        """Returns True if owner holds the lock on account (an expired lease counts until someone reclaims it)."""
+        with self.condition:
+            lock = self.locks.get(account)
+            return lock is not None and self._held_by(lock, owner)
+
+    def holder(self, account):
+        """Returns the owner currently holding the lock on account (ESCROW_OWNER for an escrow lock), or None."""
+        with self.condition:
+            lock = self.locks.get(account)
+            return lock['owner'] if lock else None
+
+    def lock_info(self, account):
+        """Returns a copy of the lock on account (owner, acquired, reservations, ...), or None."""
+        with self.condition:
+            lock = self.locks.get(account)
+            return {**lock, 'reservations': dict(lock['reservations'])} if lock else None
+
+    def held_locks(self, account):
+        """
+        Returns one {'owner', 'acquired', 'reservations'} per owner holding account: the exclusive owner, or every
+        holder of an escrow lock with the reservations it made.
+        """
+        with self.condition:
+            lock = self.locks.get(account)
+            if lock is None:
+                return []
+            if lock['owner'] != ESCROW_OWNER:
+                return [{'owner': lock['owner'], 'acquired': lock['acquired'], 'reservations': dict(lock['reservations'])}]
+            return [{'owner': owner, 'acquired': holder['acquired'],
+                     'reservations': {txid: lock['reservations'][txid] for txid in holder['txids'] if txid in lock['reservations']}}
+                    for owner, holder in lock['holders'].items()]
+
+    def release(self, account, owner):
+        """Releases the lock (or escrow share) on account if owner holds it. Returns the reservations it held."""
+        with self.condition:
+            lock = self.locks.get(account)
+            if lock is None or not self._held_by(lock, owner):
+                return {}
+            if lock['owner'] == ESCROW_OWNER:
+                reservations = self._drop_holder(account, lock, owner)
+            else:
+                del self.locks[account]
+                reservations = lock['reservations']
+            self.condition.notify_all()
+            return reservations
+
+    def clear(self):
+        """Drops every lock, e.g. when the node stops being the leader."""
+        with self.condition:
+            self.locks = {}
+            self.condition.notify_all()
@@ -0,0 +1,116 @@
+"""
+Leveled, asynchronous, rate-limited logging for the nodes, on top of the standard logging module.
+
+    logger = get_logger(self.name)
+    logger.debug("Applied entry %s", index)   # %-style arguments: nothing is formatted below LOG_LEVEL
+
+Records at or above LOG_LEVEL are put on a queue and written to stdout by a background thread, so a node never
+waits for stdout, least of all while it holds its lock. Each message type (logger and format string) may log
+LOG_RATE_LIMIT messages per second after a burst of LOG_RATE_BURST; the next message of a type that gets through
+says how many were dropped. Arguments that are expensive to compute should be guarded with isEnabledFor().
+Messages are formatted when they are logged (QueueHandler), so arguments may be mutable state such as the Raft log.
+"""
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_RATE_LIMIT, LOG_RATE_BURST
+
+# Parent of every node logger; the part of a logger's name after it is shown in brackets, e.g. [nodeA1]
+ROOT_LOGGER = 'dtx'
+LOG_FORMAT = '%(asctime)s %(levelname)-7s [%(node)s] %(message)s'
+
+_setup_lock = threading.Lock()
+_queue = None
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message type, keyed by logger name and unformatted message. Runs in the thread that logs,
+    before the record is queued, so dropped records cost neither formatting nor a queue slot.
+    """
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate    # Messages per second, 0 for no limit
+        self.burst = burst
+        self.buckets = {}   # {(logger name, msg): [tokens, last refill time, messages dropped since the last one]}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.rate:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+
+class NodeFormatter(logging.Formatter):
+    """LOG_FORMAT with the node name, followed by the number of messages of the type the rate limit dropped."""
+    def format(self, record):
+        record.node = record.name.split('.', 1)[-1]
+        message = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            message += f" ({record.suppressed} similar messages suppressed)"
+        return message
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to sys.stdout as it is when the record is written (harness.LocalCluster redirects it)."""
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def configure_logging(level=LOG_LEVEL, rate_limit=LOG_RATE_LIMIT, burst=LOG_RATE_BURST):
+    """Sets up the queue and the writer thread on first use; later calls only change the level and rate limit."""
+    global _queue, _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    with _setup_lock:
+        root.setLevel(level)
+        if _listener is not None:
+            for log_filter in root.handlers[0].filters:
+                log_filter.rate, log_filter.burst = rate_limit, burst
+            return
+        _queue = queue.Queue()
+        queue_handler = QueueHandler(_queue)
+        queue_handler.addFilter(RateLimitFilter(rate_limit, burst))
+        root.addHandler(queue_handler)
+        root.propagate = False
+        writer = StdoutHandler()
+        writer.setFormatter(NodeFormatter(LOG_FORMAT))
+        _listener = QueueListener(_queue, writer)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    """Returns the logger of a node (or module), shown as [name] in its messages."""
+    if _listener is None:
+        configure_logging()
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+def flush_logs():
+    """Waits until the writer thread has written every record queued so far."""
+    if _queue is not None:
+        _queue.join()
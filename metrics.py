@@ -0,0 +1,132 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import get_logger
+
+logger = get_logger('metrics')
+
+# Upper bounds (seconds) of the buckets of every latency histogram
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Counters and latency histograms of one node, each identified by a name and a set of labels
+    (e.g. rpc_server_duration_seconds{rpc_type="AppendEntries"}). Gauges are not stored: the node reads them from
+    its state when the metrics are exported, and passes them to snapshot() or prometheus_text() as
+    (name, labels, value) tuples. All methods may be called from any thread.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}   # {(name, labels): value}, labels as a sorted tuple of (key, value)
+        self.histograms = {} # {(name, labels): {'buckets': [count per bucket], 'count': n, 'sum': total}}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Adds `amount` to a counter."""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Records one sample (in seconds) in a histogram."""
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def snapshot(self, gauges=()):
+        """
+        Returns every metric as JSON-friendly lists: counters and gauges as {'name', 'labels', 'value'}, histograms
+        as {'name', 'labels', 'count', 'sum', 'buckets': {upper bound: cumulative count}}.
+        """
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': histogram['count'], 'sum': histogram['sum'],
+                           'buckets': dict(zip(map(str, self.buckets), self._cumulative(histogram['buckets'])))}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+        return {'counters': counters, 'gauges': [{'name': name, 'labels': labels, 'value': value} for name, labels, value in gauges],
+                'histograms': histograms}
+
+    @staticmethod
+    def _cumulative(counts):
+        total, cumulative = 0, []
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def prometheus_text(self, gauges=()):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        typed = set()
+
+        def header(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, 'counter')
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for name, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+                header(name, 'gauge')
+                lines.append(f"{name}{format_labels(sorted(labels.items()))} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                header(name, 'histogram')
+                cumulative = self._cumulative(histogram['buckets'])
+                for bound, count in zip(self.buckets, cumulative):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """Formats (key, value) pairs as a Prometheus label set, e.g. {rpc_type="AppendEntries"}."""
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+def serve_prometheus(host, port, render):
+    """
+    Serves GET /metrics on host:port from a daemon thread, answering with render() (Prometheus text format).
+    Returns the server, or None if the port cannot be bound.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are not worth a line of output each
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.warning("Could not serve metrics on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -5,7 +5,16 @@ import json
 import sys
 import random
 import os
-from config import NODES, ELECTION_TIMEOUT, HEARTBEAT_INTERVAL, CLUSTER_A_NODES, CLUSTER_B_NODES
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import NODES, ELECTION_TIMEOUT, HEARTBEAT_INTERVAL, COORDINATOR_NODE, CLUSTER_A_NODES, CLUSTER_B_NODES, ELECTION_RPC_TIMEOUT, CONNECTION_IDLE_TIMEOUT
+from config import METRICS_HTTP_PORT_OFFSET, TRACING_ENABLED, TRACE_BUFFER_SIZE
+from rpc import receive_request, receive_response
+from retry_policy import RetryPolicy
+from metrics import Metrics, serve_prometheus
+from tracing import Tracer
+from logger import get_logger, flush_logs
 
 class Node:
     """
@@ -13,6 +22,7 @@ class Node:
     """
     def __init__(self, name):
         self.name = name # Unique identifier for the node
+        self.logger = get_logger(self.name) # Leveled, asynchronous logging (logger.py)
         self.ip = NODES[self.name]['ip'] # Node's IP address. This ise defined in the config file
         self.port = NODES[self.name]['port'] # Node's port number. This is defined in the config file
         # Raft state
@@ -37,6 +47,14 @@ class Node:
         # Thread safety
         self.lock = threading.Lock() # Lock for thread-safe operations
         self.simulating_crash_ongoing = False  # Flag to prevent multiple crash simulations or exceptions
+        # Replication RPCs sent and forced writes made for proposed entries (heartbeats excluded), see GetProtocolStats
+        self.protocol_stats = Counter()
+        self.stats_lock = threading.Lock()
+        # Counters and latency histograms exported by GetMetrics (and over HTTP, see METRICS_HTTP_PORT_OFFSET)
+        self.metrics = Metrics()
+        self.metrics_server = None
+        # Spans of the traced transactions this node took part in, see GetTrace
+        self.tracer = Tracer(self.name, TRACE_BUFFER_SIZE, TRACING_ENABLED)
 
         # Persistent storage
         self.log_filename = f"{self.name}_lab2Raft.txt"  # File for persistent log storage
@@ -48,6 +66,11 @@ class Node:
 
         self.cluster_name = self._determine_cluster()
         self.cluster_nodes = self._get_cluster_nodes()
+        # Workers used by the leader to replicate to all followers at once
+        self.replication_executor = ThreadPoolExecutor(max_workers=8)
+        self.heartbeats_in_flight = set() # Followers with an AppendEntries still outstanding from the heartbeat loop
+        # Adaptive timeouts, backoff and circuit breakers of the RPCs this node sends to other nodes
+        self.retry_policy = RetryPolicy(self.metrics)
 
     def _determine_cluster(self):
         """Determines which RAFT cluster this node belongs to."""
@@ -55,6 +78,8 @@ class Node:
             return 'A'
         elif self.name.startswith('nodeB'):
             return 'B'
+        elif self.name in COORDINATOR_NODE:
+            return 'C'
         return None
 
     def _get_cluster_nodes(self):
@@ -63,6 +88,8 @@ class Node:
             return CLUSTER_A_NODES
         elif self.cluster_name == 'B':
             return CLUSTER_B_NODES
+        elif self.cluster_name == 'C':
+            return COORDINATOR_NODE
         return {}    
 
     def start(self):
@@ -71,16 +98,19 @@ class Node:
         Handles the node's state machine and election timeout monitoring.
         """
         
-        print(f"[{self.name}] Starting node...") # Announce node startup
+        self.logger.info("Starting node...") # Announce node startup
 
         # Initialize and start server thread for handling incoming connections
         server_thread = threading.Thread(target=self.run_server)
         server_thread.daemon = True  # Thread will terminate when main program exits
         server_thread.start()
+        if METRICS_HTTP_PORT_OFFSET is not None:
+            self.metrics_server = serve_prometheus(self.ip, self.port + METRICS_HTTP_PORT_OFFSET,
+                                                   lambda: self.metrics.prometheus_text(self.metric_gauges()))
         
         # Initialize election timeout
         self.reset_election_timer()
-        print(f"[{self.name}] Initial election timeout: {self.election_timer}")
+        self.logger.debug("Initial election timeout: %s", self.election_timer)
 
         # Main operation loop
         while self.running:
@@ -92,6 +122,10 @@ class Node:
                 # Leader responsibilities: send heartbeats
                 self.send_heartbeats()
                 time.sleep(HEARTBEAT_INTERVAL)  # Wait before next heartbeat
+                # Commit entries the heartbeats finished replicating
+                with self.lock:
+                    if self.state == 'Leader':
+                        self.advance_commit_index()
             else:
                 # Follower/Candidate responsibilities: monitor election timeout
                 if current_timer <= 0:
@@ -112,9 +146,9 @@ class Node:
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Enable address reuse to prevent "Address already in use" errors
         # Bind socket to node's IP and port and start listening
         self.server_socket.bind((self.ip, self.port)) 
-        self.server_socket.listen(5)
+        self.server_socket.listen(128)
         
-        print(f"[{self.name}] Server listening at {self.ip}:{self.port}")
+        self.logger.info("Server listening at %s:%s", self.ip, self.port)
 
         # Main loop to keep the server running
         while self.running:
@@ -127,7 +161,7 @@ class Node:
                 client_thread.start()
             except Exception as e:
                 if self.running and self.simulating_crash_ongoing == False:
-                    print(f"[{self.name}] Server error: {e}")
+                    self.logger.error("Server error: %s", e)
 
     def load_persistent_log(self):
         """
@@ -144,59 +178,94 @@ class Node:
                         'value': line.strip(),      # Remove any whitespace/newlines
                         'index': idx                # Maintain original entry ordering
                     }
+                    # Typed entries are stored as JSON together with their term
+                    if entry['value'].startswith('{'):
+                        try:
+                            record = json.loads(entry['value'])
+                            if isinstance(record, dict) and 'type' in record:
+                                entry = {**record, 'index': idx}
+                        except json.JSONDecodeError:
+                            pass
                     self.log.append(entry)
                 
                 # If log exists, update indices to match loaded state
                 if self.log:
                     self.commit_index = len(self.log) - 1
                     self.last_applied = self.commit_index
-                    print(f"[{self.name}] Loaded {len(self.log)} entries from persistent storage")
+                    self.logger.info("Loaded %d entries from persistent storage", len(self.log))
         except FileNotFoundError:
-            print(f"[{self.name}] No existing log found, starting fresh")
+            self.logger.info("No existing log found, starting fresh")
 
     def handle_client_connection(self, client_socket: socket.socket):
         """
-        Mananges incoming client connections and RPC requests. It takes a client socket as input.
-        Processes different types of RPCs and returns appropriate responses.
+        Serves the RPCs sent over one client connection. A request with 'keep_alive' set leaves the connection open
+        for the client's next request: its response ends with a newline, and the connection is closed once it sat
+        idle for CONNECTION_IDLE_TIMEOUT seconds. Any other request gets its response and the connection is closed.
         """
         try:
-            
-            data = client_socket.recv(4096).decode() # Receive and decode client request
-            if data:
-                request = json.loads(data) # Parse JSON request
-                rpc_type = request['rpc_type']
-                response = {}
-
-                # Manange different RPC types with thread safety
-                with self.lock:
-                    if rpc_type == 'RequestVote':
-                        # Handle voting requests during leader election
-                        response = self.handle_request_vote(request['data'])
-                    elif rpc_type == 'AppendEntries':
-                        # Handle log replication and heartbeat messages
-                        response = self.handle_append_entries(request['data'])
-                    elif rpc_type == 'SubmitValue':
-                        # Handle client value submissions
-                        response = self.handle_client_submit(request['data'])
-                    elif rpc_type == 'TriggerLeaderChange':
-                        # Handle manual leader step-down requests
-                        response = self.trigger_leader_change()
-                    elif rpc_type == 'SimulateCrash':
-                        # Handle crash simulation requests
-                        response = self.simulate_crash()
-                    elif rpc_type == 'PrintLog':
-                        # Handle print log request
-                        response = self.print_node_log()
-                    else:
-                        response = {'error': 'Unknown RPC type'}
+            while True:
+                request = receive_request(client_socket) # Receive and parse the client request
+                if not request:
+                    break
+                started = time.monotonic()
+                response = self.handle_request(request)
+                self.metrics.observe('rpc_server_duration_seconds', time.monotonic() - started, rpc_type=request.get('rpc_type'))
 
                 # Send response back to client
-                client_socket.sendall(json.dumps(response).encode())
+                if not request.get('keep_alive'):
+                    client_socket.sendall(json.dumps(response).encode())
+                    break
+                client_socket.sendall(json.dumps(response).encode() + b'\n')
+                client_socket.settimeout(CONNECTION_IDLE_TIMEOUT)
+        except socket.timeout:
+            pass  # Idle keep-alive connection
         except Exception as e:
-            print(f"[{self.name}] Error handling client connection: {e}")
+            self.logger.warning("Error handling client connection: %s", e)
         finally:
             client_socket.close()  # Ensure socket is closed even if an error occurs
 
+    def handle_request(self, request):
+        """
+        Runs one RPC and returns its response. Processes different types of RPCs and returns appropriate responses.
+        """
+        rpc_type = request['rpc_type']
+        response = {}
+
+        if rpc_type == 'ClusterStatus':
+            # Status reads do not wait for the node lock
+            response = self.cluster_status()
+        elif rpc_type == 'GetMetrics':
+            response = self.get_metrics(request.get('data') or {})
+        elif rpc_type == 'GetTrace':
+            response = self.get_trace(request['data'])
+        else:
+            # Manange different RPC types with thread safety
+            with self.lock:
+                if rpc_type == 'RequestVote':
+                    # Handle voting requests during leader election
+                    response = self.handle_request_vote(request['data'])
+                elif rpc_type == 'AppendEntries':
+                    # Handle log replication and heartbeat messages
+                    response = self.traced_append_entries(request['data'])
+                elif rpc_type == 'SubmitValue':
+                    # Handle client value submissions
+                    response = self.handle_client_submit(request['data'])
+                elif rpc_type == 'SubmitValues':
+                    # Handle a batch of client values, replicated in one round
+                    response = self.handle_client_submit_batch(request['data'])
+                elif rpc_type == 'TriggerLeaderChange':
+                    # Handle manual leader step-down requests
+                    response = self.trigger_leader_change()
+                elif rpc_type == 'SimulateCrash':
+                    # Handle crash simulation requests
+                    response = self.simulate_crash()
+                elif rpc_type == 'PrintLog':
+                    # Handle print log request
+                    response = self.print_node_log()
+                else:
+                    response = {'error': 'Unknown RPC type'}
+        return response
+
     def reset_election_timer(self):
         """
         Resets the election timeout to a random value within the configured range.
@@ -204,15 +273,66 @@ class Node:
         """
         self.election_timer = random.uniform(*ELECTION_TIMEOUT)
         
+    def cluster_status(self):
+        """
+        Returns this node's role, leader hint, term and log progress (ClusterStatus). Answered without self.lock, so
+        it never waits for a replication round.
+        """
+        return {
+            'status': 'success',
+            'node_name': self.name,
+            'role': self.state,
+            'is_leader': self.state == 'Leader',
+            'leader_id': self.leader_id,
+            'term': self.current_term,
+            'commit_index': self.commit_index,
+            'last_applied': self.last_applied
+        }
+
+    def get_metrics(self, data):
+        """
+        Returns this node's metrics (GetMetrics): counters, gauges and histograms as lists, or with
+        data['format'] == 'prometheus' the Prometheus text format in 'text'. Answered without self.lock.
+        """
+        if data.get('format') == 'prometheus':
+            return {'status': 'success', 'format': 'prometheus', 'text': self.metrics.prometheus_text(self.metric_gauges())}
+        return {'status': 'success', 'node_name': self.name, **self.metrics.snapshot(self.metric_gauges())}
+
+    def get_trace(self, data):
+        """Returns the spans this node recorded for the traces in data['trace_ids'] (GetTrace). Answered without self.lock."""
+        return {'status': 'success', 'node_name': self.name, 'spans': self.tracer.get(data.get('trace_ids', []))}
+
+    def metric_gauges(self):
+        """
+        Returns the gauges read from the node's state as (name, labels, value): term, log, commit and apply
+        positions, and on a leader the replication progress and lag of every follower. Subclasses add their own.
+        """
+        last_index = len(self.log) - 1
+        gauges = [
+            ('raft_is_leader', {}, int(self.state == 'Leader')),
+            ('raft_term', {}, self.current_term),
+            ('raft_last_log_index', {}, last_index),
+            ('raft_commit_index', {}, self.commit_index),
+            ('raft_last_applied', {}, self.last_applied),
+        ]
+        if self.state == 'Leader':
+            match_index, next_index = dict(self.match_index), dict(self.next_index)
+            for follower in self.cluster_nodes:
+                if follower == self.name:
+                    continue
+                match = match_index.get(follower, -1)
+                gauges.append(('raft_follower_match_index', {'follower': follower}, match))
+                gauges.append(('raft_follower_next_index', {'follower': follower}, next_index.get(follower, last_index + 1)))
+                gauges.append(('raft_follower_lag_entries', {'follower': follower}, last_index - match))
+        return gauges
+
     def print_node_log(self):
         """
         Prints the node's current log entries and state.
         """
-        print(f"\n[{self.name}] Current Log State:")
-        print(f"[{self.name}] Role: {self.state}")
-        print(f"[{self.name}] Term: {self.current_term}")
-        print(f"[{self.name}] Commit Index: {self.commit_index}")
-        print(f"[{self.name}] Log Entries: {self.log}\n")
+        self.logger.info("Current log state: role %s, term %s, commit index %s, %d entries",
+                         self.state, self.current_term, self.commit_index, len(self.log))
+        self.logger.info("Log entries: %s", self.log)
         return {'status': 'Log printed', 'log': self.log}
 
     def handle_request_vote(self, data: dict):
@@ -265,7 +385,7 @@ class Node:
         if can_vote and log_is_up_to_date:
             self.voted_for = candidate_id
             self.reset_election_timer()
-            print(f"[{self.name}] Voted for {candidate_id} in term {self.current_term}")
+            self.logger.info("Voted for %s in term %s", candidate_id, self.current_term)
             return {'term': self.current_term, 'vote_granted': True}
         # Reject vote if any condition is not met
         return {'term': self.current_term, 'vote_granted': False}
@@ -313,66 +433,90 @@ class Node:
             (current_time - self.last_recovery_attempt) > self.recovery_timeout):
             self.recovering = True
             self.last_recovery_attempt = current_time
-            print(f"[{self.name}] Starting recovery of committed entries. "
-                f"Local commit index: {self.commit_index}, Leader commit: {leader_commit}")
+            self.logger.info("Starting recovery of committed entries. Local commit index: %s, Leader commit: %s",
+                             self.commit_index, leader_commit)
 
         # Rule 3: Check log consistency
         if prev_log_index >= 0 and (
             prev_log_index >= len(self.log) or
             self.log[prev_log_index]['term'] != prev_log_term
         ):
-            return {'term': self.current_term, 'success': False}
+            # log_length lets the leader jump straight back to the end of a short log
+            return {'term': self.current_term, 'success': False, 'log_length': len(self.log)}
 
         # Process new entries if any
         if entries:
-            # Delete any conflicting entries and append new ones
-            self.log = self.log[:prev_log_index + 1]
-            old_len = len(self.log)
-            self.log.extend(entries)
+            # Delete only entries that conflict with the new ones. Entries we already hold are kept,
+            # so a delayed AppendEntries carrying an older prefix cannot cut off newer entries.
+            for offset, new_entry in enumerate(entries):
+                idx = prev_log_index + 1 + offset
+                if idx < len(self.log):
+                    if self.log[idx]['term'] == new_entry['term']:
+                        continue
+                    self.log = self.log[:idx]
+                self.log.append(new_entry)
             
             # Print recovery information if in recovery mode
             if self.recovering:
                 # Only consider entries up to leader's commit index
                 committed_entries = [e for e in entries if e['index'] <= leader_commit]
                 if committed_entries:
-                    print(f"[{self.name}] Recovered {len(committed_entries)} committed entries")
-                    print(f"[{self.name}] Committed entries indices: {[e['index'] for e in committed_entries]}")
+                    self.logger.info("Recovered %d committed entries", len(committed_entries))
+                    if self.logger.isEnabledFor(logging.DEBUG):
+                        self.logger.debug("Committed entries indices: %s", [e['index'] for e in committed_entries])
 
         # Update commit index and apply newly committed entries
         old_commit_index = self.commit_index
         if leader_commit > self.commit_index:
-            self.commit_index = min(leader_commit, len(self.log) - 1)
+            self.commit_index = min(leader_commit, prev_log_index + len(entries))
             if self.recovering:
                 newly_committed = self.commit_index - old_commit_index
                 if newly_committed > 0:
-                    print(f"[{self.name}] Applying {newly_committed} newly committed entries")
+                    self.logger.debug("Applying %d newly committed entries", newly_committed)
             self.apply_committed_entries()
 
         # Check if recovery is complete
         if self.recovering and self.commit_index >= leader_commit:
             self.recovering = False
-            print(f"[{self.name}] Recovery of committed entries complete. "
-                f"Commit index: {self.commit_index}")
+            self.logger.info("Recovery of committed entries complete. Commit index: %s", self.commit_index)
 
         return {'term': self.current_term, 'success': True}
 
+    def traced_append_entries(self, data):
+        """Handles AppendEntries, as a span of the trace of the entries the leader replicates with it, if any."""
+        with self.tracer.span('append_entries', data.get('trace'), entries=len(data['entries'])):
+            return self.handle_append_entries(data)
+
     def apply_committed_entries(self):
         """
         Applies all committed but not yet applied entries to the state machine. Guarantees that entries are applied in order and only once.
         This function is called whenever the commit index advances, ensuring that all committed entries are applied to the state machine in sequence.
         """
-        while self.last_applied < self.commit_index:
-            self.last_applied += 1
-            entry = self.log[self.last_applied]
-            self.apply_entry_to_state_machine(entry)
+        if self.last_applied >= self.commit_index:
+            return
+        with self.tracer.span('apply', entries=self.commit_index - self.last_applied):
+            while self.last_applied < self.commit_index:
+                self.last_applied += 1
+                entry = self.log[self.last_applied]
+                self.apply_entry_to_state_machine(entry)
 
     def apply_entry_to_state_machine(self, entry):
         """
         Applies a single log entry to the state machine (persistent storage).
         """
         with open(self.log_filename, 'a') as f:
-            f.write(f"{entry['value']}\n")
-        print(f"[{self.name}] Applied entry to log: {entry['value']}")
+            f.write(f"{self.serialize_entry(entry)}\n")
+        self.count_stat('forced_writes')
+        self.logger.debug("Applied entry to log: %s", entry.get('value', entry.get('type')))
+
+    def serialize_entry(self, entry):
+        """
+        Returns the line stored in the persistent log for an entry. Plain client values are stored as is,
+        typed entries (see propose_entries) are stored as JSON together with their term.
+        """
+        if 'type' not in entry:
+            return entry['value']
+        return json.dumps({'term': entry['term'], 'type': entry['type'], 'data': entry.get('data')})
 
     def start_election(self):
         """
@@ -380,13 +524,14 @@ class Node:
         Now only requests votes from nodes in the same cluster.
         """
         # Initialize election state
+        self.metrics.inc('raft_elections_started_total')
         self.state = 'Candidate'
         self.current_term += 1
         self.voted_for = self.name
         self.leader_id = None
         votes_received = 1  # Count self vote
         
-        print(f"[{self.name}] Starting election for term {self.current_term}")
+        self.logger.info("Starting election for term %s", self.current_term)
         self.reset_election_timer()
 
         # Prepare vote request arguments
@@ -400,16 +545,16 @@ class Node:
         for node_name in self.cluster_nodes:
             if node_name != self.name:
                 try:
-                    response = self.send_rpc(
-                        self.cluster_nodes[node_name]['ip'],
-                        self.cluster_nodes[node_name]['port'],
+                    response = self.send_to_peer(
+                        node_name,
                         'RequestVote',
                         {
                             'term': self.current_term,
                             'candidate_name': self.name,
                             'last_log_index': last_log_index,
                             'last_log_term': last_log_term
-                        }
+                        },
+                        timeout=ELECTION_RPC_TIMEOUT
                     )
 
                     # Process vote response
@@ -430,7 +575,7 @@ class Node:
                         break
 
                 except Exception as e:
-                    print(f"[{self.name}] Error requesting vote from {node_name}: {e}")
+                    self.logger.warning("Error requesting vote from %s: %s", node_name, e)
 
     def check_cluster_health(self):
         """Checks the health of the cluster by attempting to contact nodes in the same cluster."""
@@ -441,9 +586,8 @@ class Node:
         for node_name in self.cluster_nodes:
             if node_name != self.name:
                 try:
-                    response = self.send_rpc(
-                        self.cluster_nodes[node_name]['ip'],
-                        self.cluster_nodes[node_name]['port'],
+                    response = self.send_to_peer(
+                        node_name,
                         'AppendEntries',
                         {
                             'term': self.current_term,
@@ -452,7 +596,8 @@ class Node:
                             'prev_log_term': self.log[-1]['term'] if self.log else 0,
                             'entries': [],
                             'leader_commit': self.commit_index
-                        }
+                        },
+                        timeout=ELECTION_RPC_TIMEOUT
                     )
                     if response is not None:
                         reachable_nodes += 1
@@ -468,33 +613,41 @@ class Node:
         # Require majority of nodes in the CLUSTER to be reachable (not all NODES)
         cluster_size = len(self.cluster_nodes)
         if reachable_nodes <= cluster_size // 2:
-            print(f"[{self.name}] Cannot become leader: only {reachable_nodes}/{cluster_size} nodes reachable")
+            self.logger.warning("Cannot become leader: only %s/%s nodes reachable", reachable_nodes, cluster_size)
             self.state = 'Follower'
             return
 
-        print(f"[{self.name}] Becoming leader for term {self.current_term}")
+        self.logger.info("Becoming leader for term %s", self.current_term)
+        self.metrics.inc('raft_elections_won_total')
         self.state = 'Leader'
         self.leader_id = self.name
 
         # Initialize leader state only for cluster nodes
         self.next_index = {node: len(self.log) for node in self.cluster_nodes if node != self.name}
         self.match_index = {node: -1 for node in self.cluster_nodes if node != self.name}
+        self.heartbeats_in_flight = set()
 
-        # Send immediate heartbeat
-        self.send_heartbeats()
+        if self.commit_index < len(self.log) - 1:
+            # Entries from earlier terms only commit together with an entry of the current term,
+            # so commit a no-op right away instead of serving state that lags behind the log
+            self.propose_entries([{'type': 'noop', 'data': None}])
+        else:
+            # Send immediate heartbeat
+            self.send_heartbeats()
 
     def send_heartbeats(self):
-        """Sends heartbeats only to nodes in the same cluster."""
+        """
+        Sends heartbeats only to nodes in the same cluster. A heartbeat carries any entries the follower is missing,
+        and all followers are contacted at once so one unreachable follower cannot delay the others.
+        """
         if not self.cluster_nodes:
             return
             
         for node_name in self.cluster_nodes:
-            if node_name != self.name:
-                entries = []
-                next_idx = self.next_index.get(node_name, len(self.log))
-                if next_idx < len(self.log):
-                    entries = self.log[next_idx:]
-                self.send_append_entries(node_name, entries)
+            if node_name != self.name and node_name not in self.heartbeats_in_flight:
+                self.heartbeats_in_flight.add(node_name)
+                future = self.replication_executor.submit(self.replicate_log_to_follower, node_name)
+                future.add_done_callback(lambda _, name=node_name: self.heartbeats_in_flight.discard(name))
 
     def handle_client_submit(self, data):
         """
@@ -511,65 +664,142 @@ class Node:
                 'leader_name': self.leader_id
             }
 
-        # Create new log entry
-        entry = {
-            'term': self.current_term,
-            'value': data['value'],
-            'index': len(self.log)
-        }
-                
-        self.log.append(entry) # Append entry to local log first
-        print(f"[{self.name}] New entry added to log: {entry}")
+        entry = {'value': data['value']}
+        committed = self.propose_entries([entry])
+        self.logger.debug("New entry added to log: %s", entry)
+        return {'success': committed}
 
-        # Attempt to replicate to followers
-        success_count = 1  # Count self as success
-        
-        # Try to replicate to all other nodes
-        for node_name in NODES:
-            if node_name != self.name:
-                if self.replicate_log_to_follower(node_name):
-                    success_count += 1
+    def handle_client_submit_batch(self, data):
+        """
+        Handles SubmitValues: like SubmitValue for a list of values (data['values']), which are appended to the log
+        and replicated together in a single round.
+        """
+        if self.state != 'Leader':
+            return {
+                'redirect': True,
+                'leader_name': self.leader_id
+            }
 
-        # Check if we achieved majority consensus
-        if success_count > len(NODES) // 2:
-            # Majority successful, commit and apply
-            self.commit_index = len(self.log) - 1
-            self.apply_committed_entries()
-            return {'success': True}
-        else:
-            # Failed to achieve majority, rollback entry
-            self.log.pop()  # Remove the entry we just added
-            return {'success': False}
+        entries = [{'value': value} for value in data['values']]
+        committed = self.propose_entries(entries)
+        self.logger.debug("%d new entries added to log", len(entries))
+        return {'success': committed}
 
-    def replicate_log_to_follower(self, follower_name):
+    def propose_entries(self, entries):
         """
-        Only focus on replicating committed entries
+        Appends entries to the leader's log and replicates them to the cluster in a single round.
+        Besides plain client values ({'value': ...}), entries may be typed ({'type': ..., 'data': ...}),
+        which subclasses interpret in apply_entry_to_state_machine. The caller must hold self.lock.
+
+        Returns:
+            bool: True once a majority of the cluster stored the entries and they were applied. On False the
+            entries stay in the log and commit with a later round once a majority is reachable again.
         """
-        next_idx = self.next_index[follower_name]
-        
-        # Only send entries up to commit_index
-        entries = self.log[next_idx:self.commit_index + 1]
-        if not entries:
-            return True  # Nothing to replicate
-            
-        response = self.send_append_entries(follower_name, entries)
-        
-        if response and response.get('success'):
-            self.next_index[follower_name] = self.commit_index + 1
-            self.match_index[follower_name] = self.commit_index
-            return True
-        elif response:
-            # If replication failed, decrease next_index and try with a smaller batch
-            self.next_index[follower_name] = max(0, next_idx - 1)
-            return self.replicate_log_to_follower(follower_name)
+        if self.state != 'Leader':
+            return False
+
+        for entry in entries:
+            entry['term'] = self.current_term
+            entry['index'] = len(self.log)
+            self.log.append(entry)
+        last_index = len(self.log) - 1
+
+        with self.tracer.span('replicate', entries=len(entries)):
+            self.replicate_to_followers()
+        self.advance_commit_index()
+        return self.commit_index >= last_index
+
+    def replicate_to_followers(self):
+        """
+        Sends the log to every follower at once and returns as soon as a majority of the cluster
+        (counting the leader) stored it. Followers that are still behind keep being served in the background.
+        The AppendEntries carry the caller's trace context, so the followers' work joins the trace.
+        """
+        followers = [node_name for node_name in self.cluster_nodes if node_name != self.name]
+        needed = len(self.cluster_nodes) // 2  # Acknowledgements needed besides the leader itself
+        acks = 0
+        trace = self.tracer.context()
+        futures = [self.replication_executor.submit(self.replicate_log_to_follower, node_name, trace) for node_name in followers]
+        for future in as_completed(futures):
+            if future.result():
+                acks += 1
+                if acks >= needed:
+                    break
+        return acks >= needed
+
+    def replicate_log_to_follower(self, follower_name, trace=None):
+        """
+        Sends the follower every entry from its next_index on, walking next_index back until the
+        follower's log matches the leader's. Returns True once the follower stored the whole log.
+        trace is the context of the span the entries are replicated for, if any.
+        """
+        while self.state == 'Leader':
+            next_idx = self.next_index.get(follower_name, len(self.log))
+            last_index = len(self.log) - 1
+            entries = self.log[next_idx:last_index + 1]
+            self.count_stat('replication_rpcs')
+            response = self.send_append_entries(follower_name, entries, next_idx, trace)
+
+            if not response:
+                return False
+            if response.get('success'):
+                # Several rounds may be in flight for the same follower, so indices only move forward here
+                self.match_index[follower_name] = max(self.match_index.get(follower_name, -1), last_index)
+                self.next_index[follower_name] = max(self.next_index.get(follower_name, 0), last_index + 1)
+                return True
+            if response.get('term', 0) > self.current_term:
+                self.step_down(response['term'])
+                return False
+            # Log mismatch: retry from an earlier entry
+            self.next_index[follower_name] = max(0, min(next_idx - 1, response.get('log_length', next_idx)))
         return False
 
-    def send_append_entries(self, follower_name, entries):
+    def log_settled(self):
+        """
+        True on a leader whose log holds no uncommitted entries from earlier terms: everything committed before it
+        took over is applied, and nothing an earlier leader proposed can still commit.
+        """
+        first_uncommitted = self.commit_index + 1
+        return self.state == 'Leader' and (first_uncommitted >= len(self.log) or self.log[first_uncommitted]['term'] == self.current_term)
+
+    def advance_commit_index(self):
+        """
+        Commits the newest entry of the current term that is stored on a majority of the cluster,
+        then applies everything up to it. The caller must hold self.lock.
+        """
+        for index in range(len(self.log) - 1, self.commit_index, -1):
+            if self.log[index]['term'] != self.current_term:
+                break
+            replicas = 1 + sum(1 for match in self.match_index.values() if match >= index)
+            if replicas > len(self.cluster_nodes) // 2:
+                self.commit_index = index
+                self.apply_committed_entries()
+                break
+
+    def count_stat(self, stat, amount=1):
+        """Adds to one of the protocol_stats counters."""
+        with self.stats_lock:
+            self.protocol_stats[stat] += amount
+        self.metrics.inc(f'{stat}_total', amount)
+
+    def step_down(self, term):
+        """Returns to follower state after learning about a higher term."""
+        self.logger.info("Discovered higher term %s, stepping down", term)
+        self.current_term = term
+        self.state = 'Follower'
+        self.voted_for = None
+        self.reset_election_timer()
+
+    def send_append_entries(self, follower_name, entries, next_idx=None, trace=None):
         """
         Sends AppendEntries RPC to a follower with new log entries or heartbeat.
+        next_idx is the log index of the first entry sent (defaults to the follower's next_index),
+        trace a trace context passed on to the follower.
         """
+        if next_idx is None:
+            next_idx = self.next_index[follower_name]
         # Calculate previous log information for consistency check
-        prev_log_index = self.next_index[follower_name] - 1
+        prev_log_index = next_idx - 1
         # Get term of previous log entry (0 if no previous entry)
         prev_log_term = (
             self.log[prev_log_index]['term'] 
@@ -577,27 +807,26 @@ class Node:
             else 0
         )
 
+        data = {
+            'term': self.current_term,          # Leader's current term
+            'leader_name': self.name,           # Leader's identifier
+            'prev_log_index': prev_log_index,   # Index of log entry before new ones
+            'prev_log_term': prev_log_term,     # Term of prev_log_index entry
+            'entries': entries,                 # Log entries to store (empty for heartbeat)
+            'leader_commit': self.commit_index  # Leader's commit index
+        }
+        if trace:
+            data['trace'] = trace
+
     # Send AppendEntries RPC to follower
-        return self.send_rpc(
-            NODES[follower_name]['ip'],
-            NODES[follower_name]['port'],
-            'AppendEntries',
-            {
-                'term': self.current_term,          # Leader's current term
-                'leader_name': self.name,           # Leader's identifier
-                'prev_log_index': prev_log_index,   # Index of log entry before new ones
-                'prev_log_term': prev_log_term,     # Term of prev_log_index entry
-                'entries': entries,                 # Log entries to store (empty for heartbeat)
-                'leader_commit': self.commit_index  # Leader's commit index
-            }
-        )
+        return self.send_to_peer(follower_name, 'AppendEntries', data)
 
     def trigger_leader_change(self):
         """
         Triggers a leader change if the current node is the leader. This is called by the client to initiate a leader change.
         """
         if self.state == 'Leader':
-            print(f"[{self.name}] Triggering leader change")
+            self.logger.info("Triggering leader change")
             self.state = 'Follower'
             self.voted_for = None
             self.leader_id = None
@@ -614,7 +843,7 @@ class Node:
         """
         self.simulating_crash_ongoing = True
         
-        print(f"\n[{self.name}] Simulating crash...")
+        self.logger.info("Simulating crash...")
         
         crash_entries = [
             {'term': self.current_term, 'value': 'crash_entry_1', 'index': len(self.log)},
@@ -622,36 +851,45 @@ class Node:
         ]
         
         self.log.extend(crash_entries)
-        print(f"[{self.name}] Leader appended entries before crash: {crash_entries}")
-        print(f"[{self.name}] Current log: {self.log}")
-        print(f"[{self.name}] Commit index: {self.commit_index}")
+        self.logger.info("Leader appended entries before crash: %s", crash_entries)
         
-        # Print current state before sleep
-        print(f"[{self.name}] Pre-sleep state:")
-        print(f"[{self.name}] Current role: {self.state}")
-        print(f"[{self.name}] Current term: {self.current_term}")
-        print(f"[{self.name}] Log entries: {self.log}")
+        # Print current state before sleep (the whole log only at DEBUG)
+        self.logger.info("Pre-sleep state: role %s, term %s, commit index %s, %d entries",
+                         self.state, self.current_term, self.commit_index, len(self.log))
+        self.logger.debug("Log entries: %s", self.log)
         
         # Close current socket
         if self.server_socket:
             self.server_socket.close()
             self.server_socket = None
         
-        print(f"[{self.name}] Going to sleep for 10 seconds to allow new leader election...")
+        self.logger.info("Going to sleep for 10 seconds to allow new leader election...")
         time.sleep(10)
         
         # Create and bind new socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.ip, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(128)
         
         self.simulating_crash_ongoing = False
-        print(f"[{self.name}] Node rejoining cluster with log: {self.log}")
+        self.logger.info("Node rejoining cluster with %d log entries", len(self.log))
+        self.logger.debug("Log entries: %s", self.log)
         
         return {'status': 'Node crashed'}
         
 
+    def send_to_peer(self, node_name, rpc_type, data, budget=None, timeout=None):
+        """
+        Sends an RPC to another node through the retry policy: the timeout adapts to the node's round-trip times
+        unless one is given, and None is returned at once while its circuit breaker is open. With a budget (seconds),
+        an RPC that got no response is retried with backoff until the budget is spent.
+        """
+        node_info = NODES[node_name]
+        return self.retry_policy.call(node_name, rpc_type,
+                                      lambda attempt_timeout: self.send_rpc(node_info['ip'], node_info['port'], rpc_type, data, timeout=attempt_timeout),
+                                      budget, timeout)
+
     def send_rpc(self, ip, port, rpc_type, data, timeout=2.0):
         # Coming from Lab1 to handle RPC
         try:
@@ -660,16 +898,16 @@ class Node:
                 s.connect((ip, port))
                 message = json.dumps({'rpc_type': rpc_type, 'data': data})
                 s.sendall(message.encode())
-                response = s.recv(4096).decode()
-                return json.loads(response)
+                return receive_response(s)
         except socket.timeout:
-            print(f"[{self.name}] RPC to {ip}:{port} timed out")
+            self.logger.warning("%s to %s:%s timed out", rpc_type, ip, port)
             return None
         except ConnectionRefusedError:
-            print(f"[{self.name}] RPC to {ip}:{port} failed: Connection refused")
+            # Routine while a peer is down, so only logged at DEBUG
+            self.logger.debug("%s to %s:%s failed: Connection refused", rpc_type, ip, port)
             return None
         except Exception as e:
-            print(f"[{self.name}] RPC to {ip}:{port} failed: {e}")
+            self.logger.warning("%s to %s:%s failed: %s", rpc_type, ip, port, e)
             return None
 
 
@@ -691,7 +929,8 @@ if __name__ == '__main__':
         node.start()
     except KeyboardInterrupt:
         # Handle shutdown on Ctrl+C
-        print(f"[{node.name}] Shutting down...")
+        node.logger.info("Shutting down...")
         node.running = False
         if node.server_socket: # Clean up network resources
             node.server_socket.close()
+        flush_logs()
@@ -1,10 +1,22 @@
 # node_2pc.py
 import socket
-import json
+import os
+import logging
 from node import Node
-from config import NODES, CLUSTER_A_NODES, CLUSTER_B_NODES
+from config import NODES, CLUSTER_A_NODES, CLUSTER_B_NODES, COORDINATOR_NODE, ANNOUNCE_NEW_LEADERS, LOCK_LEASE_TIMEOUT, LOCK_WAIT_TIMEOUT, LOCK_DIE_TIMEOUT
+from config import LAZY_COMMIT_FLUSH_SIZE, IN_DOUBT_TIMEOUT, IN_DOUBT_CHECK_INTERVAL, RECORD_LOG_FSYNC_EVERY, LOG_PAGE_SIZE, MAX_LOG_PAGE_SIZE
+from config import ACCOUNT_CHECKPOINT_EVERY, DEDUP_CACHE_SIZE, DEDUP_CACHE_TTL, SNAPSHOT_HISTORY_SIZE
+import threading
 import time
 from config import SimulationScenario
+from leader_directory import NOT_LEADER_MESSAGE
+from lock_table import LockTable
+from record_log import RecordLog
+from txn_index import TransactionIndex
+from state_store import AccountStateStore
+from dedup_cache import DedupCache
+from balance_history import BalanceHistory
+import txn_expr
 class TwoPhaseCommitNode(Node):
     def __init__(self, name, role):
         super().__init__(name)
@@ -15,15 +27,26 @@ class TwoPhaseCommitNode(Node):
         self.timeout_duration = 2
         self.prepare_log = []
         self.commit_log = []
-        self.account_file = f"{self.name}_account.txt"
-        self.prepare_log_file = f"{self.name}_prepare_log.json"
-        self.commit_log_file = f"{self.name}_commit_log.json"
+        self.pending_commit_records = 0  # Newest commit log entries not written to the commit log file yet
+        self.lock_table = LockTable(LOCK_LEASE_TIMEOUT, LOCK_WAIT_TIMEOUT, LOCK_DIE_TIMEOUT) # Account locks held by prepared transactions
+        self.dedup_cache = DedupCache(DEDUP_CACHE_SIZE, DEDUP_CACHE_TTL) # Responses of 2PC requests, for retried requests
+        self.account_file = f"{self.name}_account.txt"  # Balance file of earlier versions, migrated to a checkpoint
+        self.state_store = AccountStateStore(f"{self.name}_account_checkpoint.json", ACCOUNT_CHECKPOINT_EVERY)
+        self.balance_history = BalanceHistory(SNAPSHOT_HISTORY_SIZE) # Recent balance versions, for snapshot reads
+        self.prepare_log_file = f"{self.name}_prepare_log.jsonl"
+        self.commit_log_file = f"{self.name}_commit_log.jsonl"
         self.cluster_name = self._determine_cluster()
         self.cluster_nodes = self._get_cluster_nodes()
 
         if role == "Participant":
             self.load_account_balance()
         self.load_prepare_log()
+        self.load_commit_log()
+        self.recover_commit_records()
+        # State of every transaction this participant has seen, so a redelivered commit applies only once and a
+        # late prepare of an aborted transaction is refused
+        self.txn_index = TransactionIndex(f"{self.name}_txn_index.jsonl")
+        self.txn_index.catch_up(self.prepare_log, self.commit_log)
         
     # ------------------- Cluster Utilities -------------------
 
@@ -46,104 +69,231 @@ class TwoPhaseCommitNode(Node):
     # ------------------- Log Management -------------------
 
     def load_prepare_log(self):
-        """Loads the prepare log from file or initializes it."""
-        self.prepare_log = self._load_or_initialize_json(self.prepare_log_file, [])
+        """Loads the prepare log from file (migrating the old JSON array file if there is one)."""
+        self.prepare_record_log = RecordLog(self.prepare_log_file, RECORD_LOG_FSYNC_EVERY, legacy_path=f"{self.name}_prepare_log.json")
+        self.prepare_log = list(self.prepare_record_log.records())
         if self.prepare_log:
             self.transaction_id = self.prepare_log[-1]['transaction_id'] + 1
 
     def save_prepare_log(self):
         """Saves the latest prepare log entry."""
-        self._append_to_json_file(self.prepare_log_file, self.prepare_log[-1])
+        self._append_to_log_file(self.prepare_record_log, self.prepare_log[-1])
 
     def load_commit_log(self):
-        """Loads the commit log from file or initializes it."""
-        self.commit_log = self._load_or_initialize_json(self.commit_log_file, [])
+        """Loads the commit log from file (migrating the old JSON array file if there is one)."""
+        self.commit_record_log = RecordLog(self.commit_log_file, RECORD_LOG_FSYNC_EVERY, legacy_path=f"{self.name}_commit_log.json")
+        self.commit_log = list(self.commit_record_log.records())
 
-    def save_commit_log(self):
-        """Saves the latest commit log entry."""
-        self._append_to_json_file(self.commit_log_file, self.commit_log[-1])
+    def save_commit_log(self, count=1):
+        """Saves the latest `count` commit log entries."""
+        self._append_to_log_file(self.commit_record_log, *self.commit_log[-count:])
 
-    def _load_or_initialize_json(self, file_path, default):
-        """Loads JSON data or initializes it if the file is missing/corrupted."""
-        try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            print(f"{file_path} not found or corrupted. Initializing.")
-            with open(file_path, 'w') as f:
-                json.dump(default, f)
-            return default
-
-    def _append_to_json_file(self, file_path, data):
-        """Appends a single entry to a JSON file."""
-        try:
-            with open(file_path, 'r') as f:
-                logs = json.load(f)
-                if not isinstance(logs, list):
-                    logs = []
-        except (FileNotFoundError, json.JSONDecodeError):
-            logs = []
+    def sync_logs(self):
+        """Writes deferred commit records, fsyncs both record logs and checkpoints the balance, e.g. before shutting down."""
+        self.flush_commit_log()
+        self.prepare_record_log.sync()
+        self.commit_record_log.sync()
+        if self.role == 'Participant':
+            self.save_account_balance(force=True)
+
+    def flush_commit_log(self):
+        """Writes the commit log entries whose persistence was deferred (presumed abort)."""
+        if self.pending_commit_records:
+            self.save_commit_log(self.pending_commit_records)
+            self.pending_commit_records = 0
+
+    def recover_commit_records(self):
+        """
+        Appends the commit records that are in the Raft log but not in the commit log file. Under presumed abort
+        commit records are written to the file lazily, so a crash can lose the newest ones from it.
+        """
+        logged = {record.get('txid') for record in self.commit_log}
+        missing = [entry['data'] for entry in self.log
+                   if entry.get('type') == 'commit_record' and entry['data'].get('txid') not in logged]
+        if missing:
+            self.logger.info("Recovering %s commit records from the Raft log", len(missing))
+            self.commit_log.extend(missing)
+            self.save_commit_log(len(missing))
+
+    def _append_to_log_file(self, record_log, *entries):
+        """Appends entries to a prepare or commit record log; only the new lines are written."""
+        record_log.append(*entries)
+        self.count_stat('forced_writes')
+
+    # ------------------- Leadership -------------------
 
-        logs.append(data)
-        with open(file_path, 'w') as f:
-            json.dump(logs, f, indent=4)
+    def not_leader_response(self):
+        """Error returned for leader-only requests, with a hint of who the leader is."""
+        return {'status': 'error', 'message': NOT_LEADER_MESSAGE, 'leader_id': self.leader_id, 'term': self.current_term}
+
+    def become_leader(self):
+        """Transitions to leader and, if enabled, tells the coordinator so it can update its leader directory."""
+        super().become_leader()
+        if self.state == 'Leader':
+            self.restore_prepared_lock()
+        if self.state == 'Leader' and ANNOUNCE_NEW_LEADERS:
+            threading.Thread(target=self.announce_leadership, args=(self.current_term,), daemon=True).start()
+        if self.state == 'Leader':
+            threading.Thread(target=self.monitor_in_doubt, args=(self.current_term,), daemon=True).start()
+
+    def announce_leadership(self, term):
+        """Pushes a LeaderAnnouncement for this node's cluster to the coordinator."""
+        for node_name in COORDINATOR_NODE:
+            self.send_to_peer(node_name, 'LeaderAnnouncement', {'cluster': self.cluster_name, 'leader_id': self.name, 'term': term})
 
     # ------------------- Account Management -------------------
 
     def load_account_balance(self):
-        """Loads account balance or initializes it to 0 if the file is missing."""
+        """
+        Recovers the account balance: loads the latest checkpoint and replays the balance entries of the Raft log
+        applied after it. Without a checkpoint, a balance file of an earlier version is taken as the balance after
+        all applied entries; without either, the whole log is replayed from a balance of 0.
+        """
+        checkpoint = self.state_store.load()
+        if checkpoint is None:
+            checkpoint = self.load_legacy_account_balance()
+        balance, applied_index = checkpoint if checkpoint else (0, -1)
+        for entry in self.log[applied_index + 1:self.last_applied + 1]:
+            if entry.get('type') == 'balance_delta':
+                balance += entry['data']['delta']
+            elif entry.get('type') == 'set_balance':
+                balance = entry['data']['balance']
+        self.account_balance = balance
+        # Versions from before the restart are gone: snapshots older than the newest commit in the log cannot be read
+        horizon = max((entry['data'].get('commit_ts') or 0 for entry in self.log[:self.last_applied + 1]
+                       if entry.get('type') in ('balance_delta', 'set_balance')), default=0)
+        self.balance_history.reset(balance, horizon)
+        self.logger.info("Recovered balance %s from checkpoint at %s and %s log entries", balance, applied_index, self.last_applied - applied_index)
+        self.save_account_balance(force=True)
+
+    def load_legacy_account_balance(self):
+        """Reads the balance file of earlier versions (renamed to *.migrated afterwards). Returns (balance, applied index) or None."""
         try:
             with open(self.account_file, 'r') as f:
-                self.account_balance = float(f.read().strip())
+                balance = float(f.read().strip())
         except (FileNotFoundError, ValueError):
-            print(f"{self.account_file} not found or corrupted. Initializing to 0.")
-            self.account_balance = 0
-            self.save_account_balance()
+            return None
+        os.replace(self.account_file, self.account_file + '.migrated')
+        return balance, self.last_applied
 
-    def save_account_balance(self):
-        """Saves the current account balance."""
-        with open(self.account_file, 'w') as f:
-            f.write(str(self.account_balance))
+    def save_account_balance(self, force=False):
+        """Checkpoints the balance once ACCOUNT_CHECKPOINT_EVERY entries were applied since the last checkpoint (or when forced)."""
+        if force or self.state_store.checkpoint_due(self.last_applied):
+            self.state_store.checkpoint(self.account_balance, self.last_applied)
+            self.count_stat('forced_writes')
 
     def get_account_balance(self):
-        """Returns the current account balance."""
+        """Returns the current account balance. Only the leader answers, so readers never see a stale replica."""
+        if self.state != 'Leader':
+            return self.not_leader_response()
         return {'status': 'success', 'node_name': self.name, 'balance': self.account_balance}
 
-    def set_account_balance(self, value):
+    def cluster_status(self):
+        """Adds the account balance to the node status, so one ClusterStatus to the leader both finds it and reads the balance."""
+        status = super().cluster_status()
+        status['balance'] = self.account_balance
+        return status
+
+    def metric_gauges(self):
+        """Adds the account balance and, on the leader, the owners holding the account lock and their reserved debits."""
+        gauges = super().metric_gauges()
+        if self.role == 'Participant':
+            account_key = f'Account{self.cluster_name}'
+            gauges.append(('account_balance', {'account': account_key}, self.account_balance))
+            gauges.append(('account_lock_holders', {'account': account_key}, len(self.lock_table.held_locks(account_key))))
+            gauges.append(('account_reserved_debits', {'account': account_key}, self.lock_table.reserved_debits(account_key)))
+        return gauges
+
+    def acquire_account(self, account_key, owner, ts, escrow):
+        """Locks the account for owner (LockTable.acquire) and records how long that took. Returns (granted, waited)."""
+        granted, waited = self.lock_table.acquire(account_key, owner, ts, escrow)
+        self.metrics.observe('lock_wait_seconds', waited, result='granted' if granted else 'conflict')
+        self.tracer.record('lock_wait', time.time() - waited, account=account_key, granted=granted, escrow=escrow)
+        return granted, waited
+
+    def get_snapshot_balance(self, data):
+        """
+        Returns the balance as of data['snapshot_ts'] without taking any lock. Only a leader that has applied every
+        entry of earlier terms answers, so every change the coordinator saw acknowledged is in its history.
+        """
+        if self.state != 'Leader':
+            return self.not_leader_response()
+        if not self.log_settled():
+            return {'status': 'error', 'message': 'Leader is still applying entries of earlier terms'}
+        balance = self.balance_history.balance_at(data['snapshot_ts'])
+        if balance is None:
+            return {'status': 'error', 'message': 'Snapshot too old'}
+        return {'status': 'success', 'node_name': self.name, 'balance': balance}
+
+    def get_write_status(self, data):
+        """
+        Tells the coordinator whether a change it stamped with data['commit_ts'] may still commit: 'pending' while an
+        uncommitted entry of this leader's log carries it (or entries of earlier terms are not settled yet), else
+        'settled' (the change was applied, or it never will be).
+        """
+        if self.state != 'Leader':
+            return self.not_leader_response()
+        commit_ts = data['commit_ts']
+        pending = not self.log_settled() or any((entry.get('data') or {}).get('commit_ts') == commit_ts
+                                                for entry in self.log[self.commit_index + 1:])
+        return {'status': 'success', 'state': 'pending' if pending else 'settled'}
+
+    def record_balance_change(self, entry_type, data):
+        """
+        Adds an applied balance_delta or set_balance entry to the history, a set as the absolute balance it wrote.
+        A change applied after a snapshot at or past its commit timestamp was read (its coordinator gave up on it)
+        shows from the next snapshot on, so reads stay repeatable.
+        """
+        if self.balance_history.read_since(data.get('commit_ts')):
+            self.logger.warning("Change committed at %s was applied after a snapshot past it was read", data.get('commit_ts'))
+        if entry_type == 'set_balance':
+            self.balance_history.record_set(data.get('commit_ts'), data['balance'])
+        else:
+            self.balance_history.record_delta(data.get('commit_ts'), data['delta'])
+
+    def set_account_balance(self, value, commit_ts=None):
         """Sets the account balance and replicates to followers."""
         if self.state != 'Leader':
-            return {'status': 'error', 'message': 'Not the leader'}
+            return self.not_leader_response()
             
-        self.account_balance = value
-        self.save_account_balance()
-        
-        # Replicate to followers
-        self.replicate_to_cluster('account_balance', self.account_balance)
+        # The new balance is applied on every replica once the entry commits
+        if not self.propose_entries([{'type': 'set_balance', 'data': {'balance': value, 'commit_ts': commit_ts}}]):
+            return {'status': 'error', 'message': 'Balance change was not replicated to a majority'}
         
-        print(f"[{self.name}] Account balance set to: {value}")
+        self.logger.info("Account balance set to: %s", value)
         return {'status': 'success'}
 
     # ------------------- Transaction Management -------------------
 
-    def prepare_transaction(self, delta):
-        """Checks if the transaction can be prepared (sufficient balance)."""
-        if self.account_balance + delta < 0:
-            print('Insufficient funds. Aborting transaction.')
+    def prepare_transaction(self, delta, reserved=0):
+        """
+        Checks if the transaction can be prepared (sufficient balance). reserved is the (negative) sum of
+        debits already prepared ahead of it that have not been applied yet: the transactions of the same batch,
+        or, in escrow mode, every transaction sharing the account. Each is checked against the worst case in
+        which all those debits commit and none of the pending credits does.
+        """
+        if self.account_balance + reserved + delta < 0:
+            self.logger.debug("Insufficient funds. Aborting transaction.")
             return False
         return True
 
     def commit_transaction(self, delta):
-        """Commits the transaction by updating the account balance."""
+        """Commits the transaction by updating the account balance (persisted by the next checkpoint)."""
         self.account_balance += delta
-        self.save_account_balance()
 
     def prepare_log_entry(self, data):
         """Creates a log entry for a transaction."""
         entry = {
             'transaction_id': self.transaction_id,
+            'txid': data.get('txid'),
+            'batch_id': data.get('batch_id'),
             'simulation_num': data.get('simulation_num', 0),  # Use 'get' to prevent KeyError
+            'protocol': data.get('protocol'),
             'transactions': data['transactions']
         }
+        if data.get('escrow'):
+            # Escrow transactions may be in doubt together
+            entry['escrow'] = True
         return entry
     
     def check_transaction_status(self):
@@ -165,96 +315,466 @@ class TwoPhaseCommitNode(Node):
             self.server_socket.close()
             self.server_socket = None
         
-        print(f"[{self.name}] Going to sleep for 10 seconds to allow new leader election...")
+        self.logger.info("Going to sleep for 10 seconds to allow new leader election...")
         time.sleep(10)
         
         # Create and bind new socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.ip, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(128)
         
         self.simulating_crash_ongoing = False
-        print(f"[{self.name}] Node rejoining cluster with logs: {self.prepare_log}, {self.commit_log}")
-        
-    def get_logs_for_coordinator(self):
-        """Get logs for the coordinator for recovery."""
-        response = {'all_logs': {'prepare_log': self.prepare_log, 'commit_log': self.commit_log, 'raft_log': self.log}}
-        return response
+        self.logger.info("Node rejoining cluster with %d prepare and %d commit records", len(self.prepare_log), len(self.commit_log))
+        self.logger.debug("Prepare log: %s, commit log: %s", self.prepare_log, self.commit_log)
         
+    def get_logs_for_coordinator(self, data):
+        """
+        Returns one page of a log: data['log'] is 'prepare', 'commit' or 'raft', data['start'] the position of the
+        first entry and data['limit'] the page size (LOG_PAGE_SIZE by default, at most MAX_LOG_PAGE_SIZE). 'next' is
+        the cursor to continue from and 'end' the length of the log when the page was read.
+        """
+        logs = {'prepare': self.prepare_log, 'commit': self.commit_log, 'raft': self.log}
+        log_kind = data.get('log')
+        if log_kind not in logs:
+            return {'status': 'error', 'message': f"Unknown log {log_kind!r}, expected one of {sorted(logs)}"}
+        start = max(0, int(data.get('start', 0)))
+        limit = min(max(1, int(data.get('limit', LOG_PAGE_SIZE))), MAX_LOG_PAGE_SIZE)
+        entries = logs[log_kind][start:start + limit]
+        return {'status': 'success', 'log': log_kind, 'start': start, 'entries': entries,
+                'next': start + len(entries), 'end': len(logs[log_kind])}
+
 
     # ------------------- 2PC Handlers -------------------
 
     def handle_2pc_prepare(self, data):
-        """Handles the prepare phase of 2PC."""
+        """
+        Handles the prepare phase of 2PC. The transaction first locks this cluster's account in the lock table
+        (waiting without holding self.lock, so other transactions keep running), then evaluates its operation (see
+        txn_expr) against the locked balance, checks the balance, logs the prepare record with the resulting delta
+        and reserves it. The lock is held until commit or abort. The vote carries the delta and the balance it was
+        computed from.
+        """
         if self.state != 'Leader':
-            print(f"[{self.name}] Not the cluster leader, rejecting 2PC prepare")
-            return {'status': 'error', 'message': 'Not the cluster leader'}
+            self.logger.debug("Not the cluster leader, rejecting 2PC prepare")
+            return self.not_leader_response()
+
+        # A prepare that arrives after the coordinator already aborted the transaction must not leave it prepared
+        txid = data.get('txid')
+        if self.txn_index.state(txid) == 'aborted':
+            self.logger.debug("Transaction %s was already aborted, refusing prepare", txid)
+            return {'status': 'abort'}
+        if self.txn_index.state(txid) == 'committed':
+            # Resent by a new coordinator leader after the previous one committed it: nothing left to do here
+            return {'status': 'read_only'}
 
         # Get transaction for this cluster
-        cluster_delta = data['transactions'].get(f'Account{self.cluster_name}', 0)
+        account_key = f'Account{self.cluster_name}'
+        operation = data['transactions'].get(account_key, 0)
         simulation_num = data.get('simulation_num', 0)
         
-        print(f'[{self.name}] Processing prepare for cluster {self.cluster_name} with delta: {cluster_delta}')
+        self.logger.debug("Processing prepare for cluster %s with operation: %s", self.cluster_name, operation)
+
+        # Presumed abort: a participant the transaction does not change has nothing to log or commit
+        if operation == 0 and data.get('protocol') == 'presumed_abort':
+            self.logger.debug("Transaction %s does not change %s, voting read-only", txid, account_key)
+            return {'status': 'read_only'}
+
+        # Plain deltas commute, so in escrow mode they share the account; an operation reading the balance locks it alone
+        escrow = bool(data.get('escrow')) and not txn_expr.is_expression(operation)
+        granted, waited = self.acquire_account(account_key, txid, data.get('ts'), escrow)
+        if not granted:
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("%s is locked by %s. Aborting transaction %s.", account_key, self.lock_table.holder(account_key), txid)
+            return {'status': 'abort', 'reason': 'lock_conflict'}
+
+        with self.lock:
+            if self.state != 'Leader':
+                self.lock_table.release(account_key, txid)
+                return self.not_leader_response()
+            if self.txn_index.state(txid) == 'aborted':
+                # The abort arrived while we were waiting for the lock
+                self.lock_table.release(account_key, txid)
+                return {'status': 'abort'}
+            balance = self.account_balance
+            cluster_delta, reason = txn_expr.evaluate(operation, account_key, balance, data.get('inputs'))
+            if cluster_delta is None:
+                self.logger.info("Operation %s failed on balance %s (%s). Aborting transaction %s.", operation, balance, reason, txid)
+                self.lock_table.release(account_key, txid)
+                return {'status': 'abort', 'reason': reason}
+            if not self.prepare_transaction(cluster_delta, self.lock_table.reserved_debits(account_key)):
+                self.lock_table.release(account_key, txid)
+                return {'status': 'abort', 'reason': 'insufficient_funds'}
 
-        if self.prepare_transaction(cluster_delta):
             # Increment transaction ID only during prepare phase and only once.
             self.transaction_id += 1
-            log_entry = self.prepare_log_entry({'transactions': data['transactions'], 'simulation_num': simulation_num})
-            self.prepare_log.append(log_entry)
-            # Replicate to RAFT followers
-            self.replicate_to_cluster('prepare_log', log_entry)
-            # Save the the prepare consensus in the persisten prepare log file
-            self.save_prepare_log()
-            print("Prepare phase successfully logged for all participants.")
-            
-            if simulation_num == SimulationScenario.CRASH_BEFORE_PREPARE.value:
-                self.simulate_crash_sleep()
-                print("Simulated crash scenario. Aborting transaction.")
+            # The prepare record holds the evaluated delta, so commit and recovery never evaluate again
+            log_entry = self.prepare_log_entry({'txid': txid, 'transactions': {**data['transactions'], account_key: cluster_delta},
+                                                'simulation_num': simulation_num, 'protocol': data.get('protocol'), 'escrow': escrow})
+            # The prepare record is written to the prepare log of every replica once the entry commits
+            if not self.propose_entries([{'type': 'prepare_record', 'data': log_entry}]):
+                self.logger.warning("Prepare record was not replicated to a majority. Aborting transaction.")
+                self.lock_table.release(account_key, txid)
                 return {'status': 'abort'}
+            self.lock_table.reserve(account_key, txid, txid, cluster_delta)
+        self.logger.debug("Prepare phase successfully logged for all participants.")
             
-            return {'status': 'prepared'}
-        return {'status': 'abort'}
+        if simulation_num == SimulationScenario.CRASH_BEFORE_PREPARE.value:
+            self.simulate_crash_sleep()
+            self.logger.info("Simulated crash scenario. Aborting transaction.")
+            self.lock_table.release(account_key, txid)
+            return {'status': 'abort'}
+            
+        return {'status': 'prepared', 'delta': cluster_delta, 'balance': balance}
 
     def handle_2pc_commit(self, data):
-        """Handle commit phase of 2PC"""
+        """Handle commit phase of 2PC. Applies the prepared delta and releases the account lock."""
         simulation_num = data.get('simulation_num', 0)
         if simulation_num == SimulationScenario.CRASH_BEFORE_COMMIT.value:
             self.simulate_crash_sleep()
-            print("Simulated crash scenario 2. Aborting transaction.")
-            return {'status': 'aborted'}
+            # A prepared participant may not abort on its own: the coordinator redelivers the commit
+            self.logger.info("Simulated crash scenario 2. Not committing transaction yet.")
+            return {'status': 'error', 'message': 'Simulated crash before commit'}
         
         if self.state != 'Leader':
-            print(f"[{self.name}] Not the cluster leader, rejecting 2PC commit")
-            return {'status': 'error', 'message': 'Not the cluster leader'}
+            self.logger.debug("Not the cluster leader, rejecting 2PC commit")
+            return self.not_leader_response()
 
         try:
             # Get transaction for this cluster
+            txid = data.get('txid')
             account_key = f'Account{self.cluster_name}'
             cluster_delta = data['transactions'].get(account_key, 0)
             simulation_num = data.get('simulation_num', 0)
-            log_entry = self.prepare_log_entry({'transactions': data['transactions'], 'simulation_num': simulation_num})
-            self.commit_log.append(log_entry)
-            
-            print(f'[{self.name}] Processing commit for cluster {self.cluster_name}')
-            print(f'[{self.name}] Transaction data: {data}')
-            print(f'[{self.name}] Current balance: {self.account_balance}')
+
+            with self.lock:
+                if self.txn_index.state(txid) == 'committed':
+                    # Redelivered decision (coordinator recovery or our own GetDecision)
+                    return {'status': 'committed'}
+                # The reservation of a prepared transaction outlives its lease, so the commit always applies
+
+                log_entry = self.prepare_log_entry({'txid': txid, 'transactions': data['transactions'], 'simulation_num': simulation_num,
+                                                    'protocol': data.get('protocol')})
             
-            # Update balance
-            self.commit_transaction(cluster_delta)
-            print(f'[{self.name}] New balance: {self.account_balance}')
+                self.logger.debug("Processing commit for cluster %s", self.cluster_name)
+                self.logger.debug("Transaction data: %s", data)
+                self.logger.debug("Current balance: %s", self.account_balance)
             
-            # Replicate to RAFT followers
-            self.replicate_to_cluster('account_balance', self.account_balance)
-            self.replicate_to_cluster('commit_log', log_entry)
-            # Save the the prepare consensus in the persisten prepare log file
-            self.save_commit_log()
-            print("Commit phase successfully logged for all participants.")
+                # Commit record and balance delta go out as one batch, so the commit costs a single quorum round
+                committed = self.propose_entries([
+                    {'type': 'commit_record', 'data': log_entry},
+                    {'type': 'balance_delta', 'data': {'txid': txid, 'delta': cluster_delta, 'commit_ts': data.get('commit_ts')}}
+                ])
+                if not committed:
+                    self.logger.warning("Commit was not replicated to a majority")
+                    return {'status': 'error', 'message': 'Commit was not replicated to a majority'}
+                self.lock_table.release(account_key, txid)
+                self.logger.debug("New balance: %s", self.account_balance)
+            self.logger.debug("Commit phase successfully logged for all participants.")
             return {'status': 'committed'}
         except Exception as e:
-            print(f"[{self.name}] Error in commit handling: {e}")
+            self.logger.error("Error in commit handling: %s", e)
             return {'status': 'error', 'message': str(e)}
     
+    def handle_2pc_abort(self, data):
+        """Handles an abort sent by the coordinator once any participant refused to prepare."""
+        if self.state != 'Leader':
+            self.logger.debug("Not the cluster leader, rejecting 2PC abort")
+            return self.not_leader_response()
+
+        # Nothing was applied during prepare: drop the reservation and stop a late prepare for this txid
+        txid = data.get('txid')
+        with self.lock:
+            self.txn_index.record_abort(txid)
+            self.lock_table.release(f'Account{self.cluster_name}', txid)
+        self.logger.debug("Transaction %s aborted by the coordinator", txid)
+        return {'status': 'aborted'}
+
+    def handle_1pc_commit(self, data):
+        """
+        Handles a transaction that only touches this cluster's account. With a single participant there is no
+        vote to collect, so evaluating the operation, the balance check and the commit happen in one step: the
+        commit record and the balance delta are replicated in one Raft round, without a prepare record.
+        """
+        if self.state != 'Leader':
+            self.logger.debug("Not the cluster leader, rejecting one-phase commit")
+            return self.not_leader_response()
+
+        txid = data.get('txid')
+        account_key = f'Account{self.cluster_name}'
+        operation = data['transactions'].get(account_key, 0)
+        self.logger.debug("Processing one-phase commit for cluster %s with operation: %s", self.cluster_name, operation)
+
+        # Still locks the account (shared in escrow mode), so the check cannot miss a reservation of a 2PC transaction
+        escrow = bool(data.get('escrow')) and not txn_expr.is_expression(operation)
+        granted, waited = self.acquire_account(account_key, txid, data.get('ts'), escrow)
+        if not granted:
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("%s is locked by %s. Aborting transaction %s.", account_key, self.lock_table.holder(account_key), txid)
+            return {'status': 'abort', 'reason': 'lock_conflict'}
+
+        try:
+            with self.lock:
+                if self.state != 'Leader':
+                    return self.not_leader_response()
+                if self.txn_index.state(txid) == 'committed':
+                    # Retried after a lost response, possibly to a new leader
+                    return {'status': 'committed'}
+                cluster_delta, reason = txn_expr.evaluate(operation, account_key, self.account_balance)
+                if cluster_delta is None:
+                    return {'status': 'abort', 'reason': reason}
+                if not self.prepare_transaction(cluster_delta, self.lock_table.reserved_debits(account_key)):
+                    return {'status': 'abort', 'reason': 'insufficient_funds'}
+
+                self.transaction_id += 1
+                log_entry = self.prepare_log_entry({'txid': txid, 'transactions': {**data['transactions'], account_key: cluster_delta},
+                                                    'protocol': data.get('protocol')})
+                committed = self.propose_entries([
+                    {'type': 'commit_record', 'data': log_entry},
+                    {'type': 'balance_delta', 'data': {'txid': txid, 'delta': cluster_delta, 'commit_ts': data.get('commit_ts')}}
+                ])
+                if not committed:
+                    self.logger.warning("One-phase commit was not replicated to a majority")
+                    return {'status': 'error', 'message': 'Commit was not replicated to a majority'}
+            self.logger.debug("Transaction %s committed in one phase. New balance: %s", txid, self.account_balance)
+            return {'status': 'committed', 'delta': cluster_delta}
+        finally:
+            self.lock_table.release(account_key, txid)
+
+    def handle_2pc_prepare_batch(self, data):
+        """
+        Handles the prepare phase of a batch of transactions. The whole batch locks the account once (as owner
+        batch_id) and votes per transaction: transactions are checked in order against the balance minus the
+        debits prepared ahead of them, so an overdraft only aborts its own transaction. All prepare records
+        are replicated in a single Raft round.
+        """
+        if self.state != 'Leader':
+            self.logger.debug("Not the cluster leader, rejecting 2PC batch prepare")
+            return self.not_leader_response()
+
+        batch_id = data['batch_id']
+        protocol = data.get('protocol')
+        account_key = f'Account{self.cluster_name}'
+        transactions = data['transactions']
+        self.logger.debug("Processing batch prepare %s with %s transactions", batch_id, len(transactions))
+
+        # Presumed abort: transactions that do not change the account vote read-only and are left out of the batch
+        votes = {}
+        if protocol == 'presumed_abort':
+            votes = {tx['txid']: 'read_only' for tx in transactions if tx['transactions'].get(account_key, 0) == 0}
+            transactions = [tx for tx in transactions if tx['txid'] not in votes]
+            if not transactions:
+                return {'status': 'voted', 'votes': votes}
+
+        escrow = bool(data.get('escrow'))
+        granted, waited = self.acquire_account(account_key, batch_id, data.get('ts'), escrow)
+        if not granted:
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("%s is locked by %s. Aborting batch %s.", account_key, self.lock_table.holder(account_key), batch_id)
+            return {'status': 'voted', 'reason': 'lock_conflict', 'votes': {**votes, **{tx['txid']: 'abort' for tx in transactions}}}
+
+        with self.lock:
+            if self.state != 'Leader':
+                self.lock_table.release(account_key, batch_id)
+                return self.not_leader_response()
+
+            reserved = self.lock_table.reserved_debits(account_key)
+            prepared = []
+            entries = []
+            for tx in transactions:
+                cluster_delta = tx['transactions'].get(account_key, 0)
+                if self.txn_index.state(tx['txid']) == 'committed':
+                    votes[tx['txid']] = 'read_only'
+                    continue
+                if self.txn_index.state(tx['txid']) == 'aborted' or not self.prepare_transaction(cluster_delta, reserved):
+                    votes[tx['txid']] = 'abort'
+                    continue
+                reserved += min(cluster_delta, 0)
+                self.transaction_id += 1
+                entries.append({'type': 'prepare_record', 'data': self.prepare_log_entry({**tx, 'batch_id': batch_id, 'protocol': protocol, 'escrow': escrow})})
+                prepared.append((tx['txid'], cluster_delta))
+
+            if entries and not self.propose_entries(entries):
+                self.logger.warning("Batch prepare records were not replicated to a majority. Aborting batch.")
+                prepared = []
+            for txid, cluster_delta in prepared:
+                self.lock_table.reserve(account_key, batch_id, txid, cluster_delta)
+                votes[txid] = 'prepared'
+            for tx in transactions:
+                votes.setdefault(tx['txid'], 'abort')
+            if not prepared:
+                self.lock_table.release(account_key, batch_id)
+
+        self.logger.debug("Batch %s: %s of %s transactions prepared", batch_id, len(prepared), len(transactions))
+        return {'status': 'voted', 'votes': votes}
+
+    def handle_2pc_commit_batch(self, data):
+        """
+        Handles the decision for a batch: the commit records and balance deltas of all committed transactions are
+        replicated in a single Raft round, aborted transactions are dropped, and the batch's account lock is released.
+        """
+        if self.state != 'Leader':
+            self.logger.debug("Not the cluster leader, rejecting 2PC batch commit")
+            return self.not_leader_response()
+
+        batch_id = data['batch_id']
+        account_key = f'Account{self.cluster_name}'
+        with self.lock:
+            # A redelivered decision only commits what has not been committed yet
+            commit = [tx for tx in data['commit'] if self.txn_index.state(tx['txid']) != 'committed']
+
+            for txid in data['abort']:
+                self.txn_index.record_abort(txid)
+            entries = []
+            for tx in commit:
+                entries.append({'type': 'commit_record', 'data': self.prepare_log_entry({**tx, 'batch_id': batch_id, 'protocol': data.get('protocol')})})
+                entries.append({'type': 'balance_delta', 'data': {'txid': tx['txid'], 'delta': tx['transactions'].get(account_key, 0),
+                                                                  'commit_ts': data.get('commit_ts')}})
+            if entries and not self.propose_entries(entries):
+                self.logger.warning("Batch commit was not replicated to a majority")
+                return {'status': 'error', 'message': 'Commit was not replicated to a majority'}
+            self.lock_table.release(account_key, batch_id)
+
+        self.logger.debug("Batch %s: %s committed, %s aborted. New balance: %s", batch_id, len(data['commit']), len(data['abort']), self.account_balance)
+        return {'status': 'committed'}
+
+    def restore_prepared_lock(self):
+        """
+        Re-locks the account for transactions that are still in doubt when this node takes over as leader.
+        Exclusively prepared transactions hold the account alone, so only the latest prepare record (or the records
+        of the latest batch) can be in doubt. Escrow transactions share it and their reservations never expire, so
+        every escrow record prepared since the last exclusive one may be; each of their owners gets its share of an
+        escrow lock back.
+        """
+        self.lock_table.clear()
+        if not self.prepare_log:
+            return
+        last_prepare = self.prepare_log[-1]
+        owner = last_prepare.get('batch_id') or last_prepare.get('txid')
+        if owner is None:
+            return
+        in_doubt = []
+        for record in reversed(self.prepare_log):
+            if last_prepare.get('escrow'):
+                if not record.get('escrow'):
+                    break
+            elif (record.get('batch_id') or record.get('txid')) != owner:
+                break
+            in_doubt.append(record)
+        # One-phase commits may have been logged after the batch, so ask the index rather than the commit log's tail
+        in_doubt = [record for record in in_doubt if self.txn_index.state(record.get('txid')) == 'prepared']
+        if not in_doubt:
+            return
+        account_key = f'Account{self.cluster_name}'
+        owners = {}
+        for record in reversed(in_doubt):
+            owners.setdefault(record.get('batch_id') or record.get('txid'), []).append(record)
+        for owner, records in owners.items():
+            self.lock_table.acquire(account_key, owner, None, bool(last_prepare.get('escrow')))
+            for record in records:
+                self.lock_table.reserve(account_key, owner, record['txid'], record['transactions'].get(account_key, 0))
+        self.logger.warning("%s transactions of %s are in doubt, keeping %s locked for them", len(in_doubt), ', '.join(map(str, owners)), account_key)
+
+    def run_once(self, rpc_type, data, handler):
+        """
+        Runs a 2PC handler once per rpc_type, transaction (txid, or batch_id for batches) and attempt: repeats of a
+        request, e.g. a coordinator retry after a lost response, get the first response. A batch retried after a lock
+        conflict sends each attempt (and the release of its locks) with its own 'attempt', so those run again, and
+        the decision, without 'attempt', is never answered with a release's response. Errors are not kept, so a request
+        that failed, or reached a node that was not the leader, runs again when retried. The request is a span of
+        the coordinator's trace when it carries a trace context.
+        """
+        request_id = data.get('txid') or data.get('batch_id')
+        with self.tracer.span(rpc_type, data.get('trace'), txid=request_id):
+            if request_id is None:
+                return self.count_outcome(rpc_type, handler(data))
+            return self.dedup_cache.run((rpc_type, request_id, data.get('attempt')), lambda: self.count_outcome(rpc_type, handler(data)),
+                                        cacheable=lambda response: isinstance(response, dict) and response.get('status') != 'error')
+
+    def count_outcome(self, rpc_type, response):
+        """Counts the outcome of a 2PC request in participant_requests_total (an abort by its reason). Returns the response."""
+        outcome = (response.get('reason') or response.get('status')) if isinstance(response, dict) else 'none'
+        self.metrics.inc('participant_requests_total', rpc_type=rpc_type, outcome=outcome)
+        return response
+
+    def handle_get_transaction_status(self, data):
+        """
+        Returns what this cluster knows about transaction data['txid'] from the transaction index: its state
+        ('prepared', 'committed', 'aborted', or 'unknown' if the cluster never heard of it) and its prepare and
+        commit records. Answered by the leader only, since aborts are not replicated.
+        """
+        if self.state != 'Leader':
+            return self.not_leader_response()
+        txid = data.get('txid')
+        entry = self.txn_index.get(txid)
+        if not entry:
+            return {'status': 'success', 'txid': txid, 'state': 'unknown'}
+        return {
+            'status': 'success',
+            'txid': txid,
+            'state': entry['state'],
+            'prepare_record': self.prepare_log[entry['prepare']] if entry['prepare'] is not None else None,
+            'commit_record': self.commit_log[entry['commit']] if entry['commit'] is not None else None
+        }
+
+    # ------------------- In-Doubt Transactions -------------------
+
+    def monitor_in_doubt(self, term):
+        """
+        Runs while this node leads in `term`. Transactions found prepared at takeover, and transactions prepared for
+        longer than IN_DOUBT_TIMEOUT, are in doubt: their coordinator may be gone, so the leader asks for the outcome
+        itself instead of keeping the account locked.
+        """
+        account_key = f'Account{self.cluster_name}'
+        takeover = True
+        while self.running and self.state == 'Leader' and self.current_term == term:
+            # An escrow lock is held by several owners, each of which is resolved on its own
+            for lock in self.lock_table.held_locks(account_key):
+                if lock['reservations'] and (takeover or time.time() - lock['acquired'] >= IN_DOUBT_TIMEOUT):
+                    self.resolve_in_doubt(lock)
+            takeover = False
+            time.sleep(IN_DOUBT_CHECK_INTERVAL)
+
+    def resolve_in_doubt(self, lock):
+        """
+        Asks the coordinator (GetDecision) for the outcome of the transactions holding `lock` and applies it through
+        the regular commit/abort handlers. Does nothing while any of them is still pending or the coordinator is
+        unreachable; the monitor asks again later.
+        """
+        owner = lock['owner']
+        txids = list(lock['reservations'])
+        response = None
+        for node_name in COORDINATOR_NODE:
+            response = self.send_to_peer(node_name, 'GetDecision', {'txids': txids})
+            if response and 'decisions' in response:
+                break  # Only the coordinator leader answers
+        decisions = (response or {}).get('decisions', {})
+        commit_timestamps = (response or {}).get('commit_ts', {})
+        if any(decisions.get(txid) not in ('commit', 'abort') for txid in txids):
+            return
+
+        entries = {txid: self.txn_index.get(txid) for txid in txids}
+        if any(not entry or entry['prepare'] is None for entry in entries.values()):
+            return  # A prepare record is not applied yet
+        records = {txid: self.prepare_log[entry['prepare']] for txid, entry in entries.items()}
+        self.logger.info("Coordinator decided in-doubt transactions of %s: %s", owner, decisions)
+
+        if txids == [owner] and records[owner].get('batch_id') is None:
+            if decisions[owner] == 'commit':
+                record = records[owner]
+                self.handle_2pc_commit({'txid': owner, 'transactions': record['transactions'], 'protocol': record.get('protocol'),
+                                        'commit_ts': commit_timestamps.get(owner)})
+            else:
+                self.handle_2pc_abort({'txid': owner})
+            return
+        self.handle_2pc_commit_batch({
+            'batch_id': owner,
+            'protocol': next(iter(records.values())).get('protocol'),
+            'commit_ts': next((commit_timestamps.get(txid) for txid in txids if decisions[txid] == 'commit'), None),
+            'commit': [{'txid': txid, 'transactions': records[txid]['transactions']} for txid in txids if decisions[txid] == 'commit'],
+            'abort': [txid for txid in txids if decisions[txid] == 'abort']
+        })
+
     # ------------------- 2PC Request -------------------
 
     def handle_2pc_request(self, data):
@@ -279,70 +799,56 @@ class TwoPhaseCommitNode(Node):
         coordinator_node_name = 'node1'
         self.transaction_status = 'started'
 
-        print(f"Starting 2PC transaction with {num_participants} participants.")
-        print(f"Simulation number: {data.get('simulation_num')}")
+        self.logger.debug("Starting 2PC transaction with %s participants.", num_participants)
+        self.logger.debug("Simulation number: %s", data.get('simulation_num'))
 
         # Phase 1: Prepare
         for node_name in NODES:
             if node_name != coordinator_node_name:
-                node_info = NODES[node_name]
-                print(f"Sending prepare request to participant: {node_name}")
+                self.logger.debug("Sending prepare request to participant: %s", node_name)
 
-                start_time = time.time()
-                response = None
-                while time.time() - start_time < self.timeout_duration:
-                    response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_prepare', data)
-                    if response:
-                        break
-                    time.sleep(0.1)  # Avoid busy-waiting
+                response = self.send_to_peer(node_name, '2pc_prepare', data, self.timeout_duration)
 
                 if not response:
-                    print(f"Participant {node_name} did not respond to prepare request in time. Aborting transaction.")
+                    self.logger.warning("Participant %s did not respond to prepare request in time. Aborting transaction.", node_name)
                     self.transaction_status = 'aborted'
                     return {'status': 'prepare aborted'}
 
                 if response.get('status') == 'prepared':
-                    print(f"Participant {node_name} is prepared.")
+                    self.logger.debug("Participant %s is prepared.", node_name)
                     num_prepared += 1
                 else:
-                    print(f"Participant {node_name} is not prepared. Aborting transaction.")
+                    self.logger.warning("Participant %s is not prepared. Aborting transaction.", node_name)
                     self.transaction_status = 'aborted'
                     return {'status': 'prepare aborted'}
 
         if num_prepared < num_participants:
-            print("Not all participants are prepared. Aborting transaction.")
+            self.logger.warning("Not all participants are prepared. Aborting transaction.")
             self.transaction_status = 'aborted'
             return {'status': 'prepare aborted'}
 
         # Phase 2: Log Prepare
         for node_name in NODES:
             if node_name != coordinator_node_name:
-                node_info = NODES[node_name]
-                print(f"Sending log prepare consensus to participant: {node_name}")
+                self.logger.debug("Sending log prepare consensus to participant: %s", node_name)
 
-                start_time = time.time()
-                response = None
-                while time.time() - start_time < self.timeout_duration:
-                    response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_log_prepare', data)
-                    if response:
-                        break
-                    time.sleep(0.1)  # Avoid busy-waiting
+                response = self.send_to_peer(node_name, '2pc_log_prepare', data, self.timeout_duration)
 
                 if not response:
-                    print(f"Participant {node_name} did not respond to log prepare request in time. Aborting transaction.")
+                    self.logger.warning("Participant %s did not respond to log prepare request in time. Aborting transaction.", node_name)
                     self.transaction_status = 'aborted'
                     return {'status': 'logging prepare aborted'}
 
                 if response.get('status') == 'logged_prepare':
-                    print(f"Participant {node_name} logged the prepare request.")
+                    self.logger.debug("Participant %s logged the prepare request.", node_name)
                     num_logged_prepare += 1
                 else:
-                    print(f"Participant {node_name} did not log the prepare request. Aborting transaction.")
+                    self.logger.warning("Participant %s did not log the prepare request. Aborting transaction.", node_name)
                     self.transaction_status = 'aborted'
                     return {'status': 'logging prepare aborted'}
 
         if num_logged_prepare < num_participants:
-            print("Not all participants logged the prepare request. Aborting transaction.")
+            self.logger.warning("Not all participants logged the prepare request. Aborting transaction.")
             self.transaction_status = 'aborted'
             return {'status': 'logging prepare aborted'}
 
@@ -350,70 +856,56 @@ class TwoPhaseCommitNode(Node):
         log_entry = self.prepare_log_entry(data)
         self.prepare_log.append(log_entry)
         self.save_prepare_log()
-        print("Prepare phase successfully logged for all participants.")
+        self.logger.debug("Prepare phase successfully logged for all participants.")
 
 
         # Phase 3: Commit
         for node_name in NODES:
             if node_name != coordinator_node_name:
-                node_info = NODES[node_name]
-                print(f"Sending commit request to participant: {node_name}")
+                self.logger.debug("Sending commit request to participant: %s", node_name)
 
-                start_time = time.time()
-                response = None
-                while time.time() - start_time < self.timeout_duration:
-                    response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_commit', data)
-                    if response:
-                        break
-                    time.sleep(0.1)  # Avoid busy-waiting
+                response = self.send_to_peer(node_name, '2pc_commit', data, self.timeout_duration)
 
                 if not response:
-                    print(f"Participant {node_name} did not respond to commit request in time. Aborting transaction.")
+                    self.logger.warning("Participant %s did not respond to commit request in time. Aborting transaction.", node_name)
                     self.transaction_status = 'commit aborted'
                     return {'status': 'aborted'}
 
                 if response.get('status') == 'committed':
-                    print(f"Participant {node_name} has committed.")
+                    self.logger.debug("Participant %s has committed.", node_name)
                     num_committed += 1
                 else:
-                    print(f"Participant {node_name} has not committed. Aborting transaction.")
+                    self.logger.warning("Participant %s has not committed. Aborting transaction.", node_name)
                     self.transaction_status = 'commit aborted'
                     return {'status': 'aborted'}
 
         if num_committed < num_participants:
-            print("Not all participants have committed. Aborting transaction.")
+            self.logger.warning("Not all participants have committed. Aborting transaction.")
             self.transaction_status = 'commit aborted'
             return {'status': 'aborted'}
 
         # Phase 4: Log Commit
         for node_name in NODES:
             if node_name != coordinator_node_name:
-                node_info = NODES[node_name]
-                print(f"Sending log commit consensus to participant: {node_name}")
+                self.logger.debug("Sending log commit consensus to participant: %s", node_name)
 
-                start_time = time.time()
-                response = None
-                while time.time() - start_time < self.timeout_duration:
-                    response = self.send_rpc(node_info['ip'], node_info['port'], '2pc_log_commit', data)
-                    if response:
-                        break
-                    time.sleep(0.1)  # Avoid busy-waiting
+                response = self.send_to_peer(node_name, '2pc_log_commit', data, self.timeout_duration)
 
                 if not response:
-                    print(f"Participant {node_name} did not respond to log commit request in time. Aborting transaction.")
+                    self.logger.warning("Participant %s did not respond to log commit request in time. Aborting transaction.", node_name)
                     self.transaction_status = 'logging commit aborted'
                     return {'status': 'logging commit aborted'}
 
                 if response.get('status') == 'logged_commit':
-                    print(f"Participant {node_name} logged the commit request.")
+                    self.logger.debug("Participant %s logged the commit request.", node_name)
                     num_logged_commit += 1
                 else:
-                    print(f"Participant {node_name} did not log the commit request. Aborting transaction.")
+                    self.logger.warning("Participant %s did not log the commit request. Aborting transaction.", node_name)
                     self.transaction_status = 'logging commit aborted'
                     return {'status': 'logging commit aborted'}
 
         if num_logged_commit < num_participants:
-            print("Not all participants logged the commit request. Aborting transaction.")
+            self.logger.warning("Not all participants logged the commit request. Aborting transaction.")
             self.transaction_status = 'logging commit aborted'
             return {'status': 'logging commit aborted'}
 
@@ -421,10 +913,10 @@ class TwoPhaseCommitNode(Node):
         log_entry = self.prepare_log_entry(data)
         self.commit_log.append(log_entry)
         self.save_commit_log()
-        print("Commit phase successfully logged for all participants.")
+        self.logger.debug("Commit phase successfully logged for all participants.")
 
         self.transaction_status = 'committed'
-        print("Transaction committed successfully.")
+        self.logger.info("Transaction committed successfully.")
         return {'status': 'committed'}
     
     def handle_2pc_log_prepare(self, data):
@@ -443,131 +935,120 @@ class TwoPhaseCommitNode(Node):
 
     # ------------------- Connection Handler -------------------
 
-    def handle_client_connection(self, client_socket: socket.socket):
+    def handle_request(self, request):
         """
-        Mananges incoming client connections and RPC requests. It takes a client socket as input.
-        Processes different types of RPCs and returns appropriate responses.
+        Runs one RPC and returns its response. Processes the 2PC, balance and log RPCs on top of the Raft ones.
         """
-        try:
-            
-            data = client_socket.recv(4096).decode() # Receive and decode client request
-            if data:
-                request = json.loads(data) # Parse JSON request
-                rpc_type = request['rpc_type']
-                response = {}
-
-                # Manange different RPC types with thread safety
-                with self.lock:
-                    # Handle RAFT-specific RPCs
-                    if rpc_type == 'RaftReplicate':
-                        response = self.handle_raft_replication(request['data'])
-                    # Include all previous RPC handlers
-                    elif rpc_type == 'RequestVote':
-                        response = self.handle_request_vote(request['data'])
-                    elif rpc_type == 'AppendEntries':
-                        # Handle log replication and heartbeat messages
-                        response = self.handle_append_entries(request['data'])
-                    elif rpc_type == 'SubmitValue':
-                        # Handle client value submissions
-                        response = self.handle_client_submit(request['data'])
-                    elif rpc_type == 'TriggerLeaderChange':
-                        # Handle manual leader step-down requests
-                        response = self.trigger_leader_change()
-                    elif rpc_type == 'SimulateCrash':
-                        # Handle crash simulation requests
-                        response = self.simulate_crash()
-                    elif rpc_type == 'PrintLog':
-                        # Handle print log request
-                        response = self.print_node_log()
-                    elif rpc_type == '2pc_request':
-                        # Delegate to 2PC-specific handler
-                        response = self.handle_2pc_request(request['data'])  
-                    elif rpc_type == '2pc_prepare':
-                        # Delegate to 2PC-specific handler
-                        response = self.handle_2pc_prepare(request['data'])
-                    elif rpc_type == '2pc_commit':
-                        # Delegate to 2PC-specific handler
-                        response = self.handle_2pc_commit(request['data'])  
-                    elif rpc_type == '2pc_log_prepare':
-                        # Delegate to 2PC-specific handler
-                        response = self.handle_2pc_log_prepare(request['data'])
-                    elif rpc_type == '2pc_log_commit':
-                        # Delegate to 2PC-specific handler
-                        response = self.handle_2pc_log_commit(request['data'])
-                    elif rpc_type == 'GetBalance':
-                        # Handle client balance requests
-                        response = self.get_account_balance()
-                    elif rpc_type == 'GetLeaderStatus':
-                        response = {'is_leader': self.state == 'Leader'}
-                    elif rpc_type == 'CheckTransactionStatus':
-                        # Handle transaction status check requests
-                        response = self.check_transaction_status()
-                    elif rpc_type == 'SetBalance':
-                        # Handle setting the account balance
-                        response = self.set_account_balance(request['data']['balance'])
-                    elif rpc_type == 'GetLogs':
-                        # Handle log retrieval requests
-                        response = self.get_logs_for_coordinator()
-                    else:
-                        response = {'error': 'Unknown RPC type'}
-
-                # Send response back to client
-                client_socket.sendall(json.dumps(response).encode())
-                
-        except Exception as e:
-            print(f"[{self.name}] Error handling client connection: {e}")
-        finally:
-            client_socket.close()  # Ensure socket is closed even if an error occurs
-
-    def handle_raft_replication(self, data):
-        """Handles replication requests from RAFT leader."""
-        try:
-            data_type = data['type']
-            if data_type == 'account_balance':
-                self.account_balance = data['data']
-                self.save_account_balance()
-                print(f"[{self.name}] Updated balance to {self.account_balance}")
-            elif data_type == 'prepare_log':
-                self.prepare_log.append(data['data'])
-                self._append_to_json_file(self.prepare_log_file, data['data'])
-            elif data_type == 'commit_log':
-                self.commit_log.append(data['data'])
-                self._append_to_json_file(self.commit_log_file, data['data'])
-            return {'status': 'success'}
-        except Exception as e:
-            print(f"[{self.name}] Error in replication: {e}")
-            return {'status': 'error', 'message': str(e)}
-    
-    def replicate_to_cluster(self, data_type, data):
+        rpc_type = request['rpc_type']
+        response = {}
 
-        if not self.cluster_nodes or self.state != 'Leader':
-            print(f"[{self.name}] Not replicating: not leader or no cluster nodes")
-            return
-        
-        print(f"[{self.name}] Replicating {data_type} to cluster members")
-        
-        for node_name, node_info in self.cluster_nodes.items():
-            if node_name != self.name:
-                try:
-                    #--------------- RPC with timeout ---------------
-                    start_time = time.time()
-                    response = None
-                    while time.time() - start_time < self.timeout_duration:
-                        response = self.send_rpc(node_info['ip'], node_info['port'], 'RaftReplicate', {'type': data_type, 'data': data})
-                        if response:
-                            break
-                        time.sleep(0.1)  # Avoid busy-waiting
-                    #------------------------------------------------                    
-                    if not response:
-                        print(f"No response from leader {node_name} during {data_type} phase")
-                        break
-                
-                    if response and response.get('status') == 'success':
-                        print(f"[{self.name}] Successfully replicated to {node_name}")
-                except Exception as e:
-                    print(f"[{self.name}] Error replicating to {node_name}: {e}")
+        # 2PC phases take self.lock themselves, so a prepare waiting for an account lock does not block the node.
+        # A retried 2PC request gets the response of its first attempt.
+        if rpc_type == '2pc_prepare':
+            response = self.run_once(rpc_type, request['data'], self.handle_2pc_prepare)
+        elif rpc_type == '2pc_commit':
+            response = self.run_once(rpc_type, request['data'], self.handle_2pc_commit)
+        elif rpc_type == '2pc_abort':
+            response = self.run_once(rpc_type, request['data'], self.handle_2pc_abort)
+        elif rpc_type == '1pc_commit':
+            response = self.run_once(rpc_type, request['data'], self.handle_1pc_commit)
+        elif rpc_type == '2pc_prepare_batch':
+            response = self.run_once(rpc_type, request['data'], self.handle_2pc_prepare_batch)
+        elif rpc_type == '2pc_commit_batch':
+            response = self.run_once(rpc_type, request['data'], self.handle_2pc_commit_batch)
+        elif rpc_type == 'GetTransactionStatus':
+            response = self.handle_get_transaction_status(request['data'])
+        elif rpc_type == 'GetSnapshotBalance':
+            response = self.get_snapshot_balance(request['data'])
+        elif rpc_type == 'GetWriteStatus':
+            response = self.get_write_status(request['data'])
+        elif rpc_type == 'ClusterStatus':
+            response = self.cluster_status()
+        elif rpc_type == 'GetMetrics':
+            response = self.get_metrics(request.get('data') or {})
+        elif rpc_type == 'GetTrace':
+            response = self.get_trace(request['data'])
+        else:
+            # Manange different RPC types with thread safety
+            with self.lock:
+                # Include all previous RPC handlers
+                if rpc_type == 'RequestVote':
+                    response = self.handle_request_vote(request['data'])
+                elif rpc_type == 'AppendEntries':
+                    # Handle log replication and heartbeat messages
+                    response = self.traced_append_entries(request['data'])
+                elif rpc_type == 'SubmitValue':
+                    # Handle client value submissions
+                    response = self.handle_client_submit(request['data'])
+                elif rpc_type == 'SubmitValues':
+                    # Handle a batch of client values, replicated in one round
+                    response = self.handle_client_submit_batch(request['data'])
+                elif rpc_type == 'TriggerLeaderChange':
+                    # Handle manual leader step-down requests
+                    response = self.trigger_leader_change()
+                elif rpc_type == 'SimulateCrash':
+                    # Handle crash simulation requests
+                    response = self.simulate_crash()
+                elif rpc_type == 'PrintLog':
+                    # Handle print log request
+                    response = self.print_node_log()
+                elif rpc_type == '2pc_request':
+                    # Delegate to 2PC-specific handler
+                    response = self.handle_2pc_request(request['data'])  
+                elif rpc_type == '2pc_log_prepare':
+                    # Delegate to 2PC-specific handler
+                    response = self.handle_2pc_log_prepare(request['data'])
+                elif rpc_type == '2pc_log_commit':
+                    # Delegate to 2PC-specific handler
+                    response = self.handle_2pc_log_commit(request['data'])
+                elif rpc_type == 'GetBalance':
+                    # Handle client balance requests
+                    response = self.get_account_balance()
+                elif rpc_type == 'GetProtocolStats':
+                    response = dict(self.protocol_stats)
+                elif rpc_type == 'GetLeaderStatus':
+                    response = {'is_leader': self.state == 'Leader', 'leader_id': self.leader_id, 'term': self.current_term}
+                elif rpc_type == 'CheckTransactionStatus':
+                    # Handle transaction status check requests
+                    response = self.check_transaction_status()
+                elif rpc_type == 'SetBalance':
+                    # Handle setting the account balance
+                    response = self.set_account_balance(request['data']['balance'], request['data'].get('commit_ts'))
+                elif rpc_type == 'GetLogs':
+                    # Handle paginated log retrieval requests
+                    response = self.get_logs_for_coordinator(request['data'])
+                else:
+                    response = {'error': 'Unknown RPC type'}
+        return response
 
     def apply_entry_to_state_machine(self, entry):
+        """
+        Applies a committed log entry on this replica. 2PC state changes travel through the Raft log as typed entries:
+        - prepare_record: appended to the prepare log
+        - commit_record: appended to the commit log (written to file lazily under presumed abort)
+        - balance_delta: added to the account balance
+        - set_balance: replaces the account balance
+        """
         super().apply_entry_to_state_machine(entry)
+        entry_type = entry.get('type')
+        data = entry.get('data')
+        if entry_type == 'prepare_record':
+            self.prepare_log.append(data)
+            self.save_prepare_log()
+            self.txn_index.record_prepare(data.get('txid'), len(self.prepare_log) - 1)
+            self.transaction_id = max(self.transaction_id, data['transaction_id'])
+        elif entry_type == 'commit_record':
+            self.commit_log.append(data)
+            self.txn_index.record_commit(data.get('txid'), len(self.commit_log) - 1)
+            self.pending_commit_records += 1
+            # Under presumed abort the Raft log line is the forced write; the commit log file catches up in groups
+            if data.get('protocol') != 'presumed_abort' or self.pending_commit_records >= LAZY_COMMIT_FLUSH_SIZE:
+                self.flush_commit_log()
+        elif entry_type == 'balance_delta' and self.role == 'Participant':
+            self.commit_transaction(data['delta'])
+            self.record_balance_change(entry_type, data)
+        elif entry_type == 'set_balance' and self.role == 'Participant':
+            self.account_balance = data['balance']
+            self.record_balance_change(entry_type, data)
         if self.role == 'Participant':
-            self.commit_transaction(entry.get('delta', 0))
+            self.save_account_balance()
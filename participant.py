@@ -1,21 +1,22 @@
 from node_2pc import TwoPhaseCommitNode
 import sys
 from config import NODES, CLUSTER_A_NODES, CLUSTER_B_NODES
+from logger import flush_logs
 
 class ParticipantNode(TwoPhaseCommitNode):
     def __init__(self, name):
         # Initialize as a participant with its name
         role = "Participant"
         super().__init__(name, role)
-        print(f"[{self.name}] Initialized as a participant node in cluster {self.cluster_name}")
+        self.logger.info("Initialized as a participant node in cluster %s", self.cluster_name)
 
     def handle_2pc_prepare(self, data):
         """
         Override to ensure only RAFT leader handles 2PC operations
         """
         if self.state != 'Leader':
-            print(f"[{self.name}] Received 2PC prepare but not cluster leader. Current state: {self.state}")
-            return {'status': 'error', 'message': 'Not the cluster leader'}
+            self.logger.debug("Received 2PC prepare but not cluster leader. Current state: %s", self.state)
+            return self.not_leader_response()
         return super().handle_2pc_prepare(data)
 
     def handle_2pc_commit(self, data):
@@ -23,16 +24,35 @@ class ParticipantNode(TwoPhaseCommitNode):
         Override to ensure only RAFT leader handles 2PC operations
         """
         if self.state != 'Leader':
-            print(f"[{self.name}] Received 2PC commit but not cluster leader. Current state: {self.state}")
-            return {'status': 'error', 'message': 'Not the cluster leader'}
+            self.logger.debug("Received 2PC commit but not cluster leader. Current state: %s", self.state)
+            return self.not_leader_response()
         return super().handle_2pc_commit(data)
 
+    def handle_2pc_abort(self, data):
+        """
+        Override to ensure only RAFT leader handles 2PC operations
+        """
+        if self.state != 'Leader':
+            self.logger.debug("Received 2PC abort but not cluster leader. Current state: %s", self.state)
+            return self.not_leader_response()
+        return super().handle_2pc_abort(data)
+
+    def handle_1pc_commit(self, data):
+        """
+        Override to ensure only RAFT leader handles 2PC operations
+        """
+        if self.state != 'Leader':
+            self.logger.debug("Received one-phase commit but not cluster leader. Current state: %s", self.state)
+            return self.not_leader_response()
+        return super().handle_1pc_commit(data)
+
     def replicate_state_change(self, change_type, data):
         """
         Replicates state changes to other nodes in the RAFT cluster
         """
         if self.state == 'Leader':
-            self.replicate_to_cluster(change_type, data)
+            return self.propose_entries([{'type': change_type, 'data': data}])
+        return False
 
 if __name__ == '__main__':
     """
@@ -53,8 +73,11 @@ if __name__ == '__main__':
     try:
         node.start()
     except KeyboardInterrupt:
-        print(f"[{node.name}] Shutting down...")
+        node.logger.info("Shutting down...")
     finally:
         node.running = False
+        with node.lock:
+            node.sync_logs()
         if node.server_socket:  # Clean up network resources
             node.server_socket.close()
+        flush_logs()
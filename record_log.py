@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+from logger import get_logger
+
+logger = get_logger('record_log')
+
+
+class RecordLog:
+    """
+    Append-only log of JSON records, one per line (JSON Lines). An append writes only the new lines, so its cost does
+    not grow with the history. Appends always reach the OS; fsync_every controls durability against machine crashes:
+    0 never fsyncs, 1 fsyncs every append, N fsyncs once N records accumulated since the last fsync (group commit).
+    sync() forces the rest, e.g. on shutdown.
+    """
+    def __init__(self, path, fsync_every=0, legacy_path=None):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.unsynced = 0 # Records appended since the last fsync
+        self.lock = threading.Lock()
+        if legacy_path:
+            self.migrate(legacy_path)
+        self.repair_tail()
+        self.file = open(self.path, 'a')
+
+    def repair_tail(self):
+        """Cuts off a torn last line (a crash in the middle of an append), so new records start on a line of their own."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                f.seek(max(0, position - 4096))
+                chunk = f.read(position - max(0, position - 4096))
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    position = position - len(chunk) + newline + 1
+                    break
+                position = max(0, position - 4096)
+            if position != end:
+                f.truncate(position)
+
+    def migrate(self, legacy_path):
+        """
+        Converts a log written as one JSON array (the old *_log.json format) to JSON Lines, once: the new file is
+        written next to it and renamed into place, and the old file is kept as <legacy_path>.migrated.
+        """
+        if os.path.exists(self.path) or not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, 'r') as f:
+                records = json.load(f)
+        except json.JSONDecodeError:
+            records = []
+        if not isinstance(records, list):
+            records = []
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        os.replace(legacy_path, legacy_path + '.migrated')
+        logger.info("Migrated %d records from %s to %s", len(records), legacy_path, self.path)
+
+    def records(self):
+        """Yields the records of the log file one at a time, without reading the whole file into memory."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn write at the end of the log, cut off on the next open
+
+    def append(self, *records):
+        """Appends records; they are fsynced according to fsync_every."""
+        if not records:
+            return
+        with self.lock:
+            self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+            self.file.flush()
+            self.unsynced += len(records)
+            if self.fsync_every and self.unsynced >= self.fsync_every:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def sync(self):
+        """fsyncs the records appended since the last fsync."""
+        with self.lock:
+            if self.unsynced:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,201 @@
+import random
+import threading
+import time
+from config import RPC_TIMEOUT_BOUNDS, RPC_INITIAL_TIMEOUT, RPC_BACKOFF_BASE, RPC_BACKOFF_CAP
+from config import CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN, RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_RATE, RETRY_BUDGET_MAX
+
+
+class RttEstimator:
+    """
+    Round-trip time estimate of one RPC type to one peer, the way TCP computes its retransmission timeout
+    (RFC 6298): smoothed RTT and RTT deviation as EWMAs, timeout = srtt + 4 * rttvar within the bounds. A timeout
+    doubles the current timeout until the next sample.
+    """
+    def __init__(self, initial, min_timeout, max_timeout):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.timeout = min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+    def timed_out(self):
+        self.timeout = min(self.max_timeout, self.timeout * 2)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a peer after `threshold` failures in a row. While open, calls fail at once; after `cooldown`
+    seconds one call is let through as a probe, and its outcome closes or reopens the breaker.
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed' # 'closed', 'open' or 'half_open'
+        self.failures = 0
+        self.opened_at = 0
+
+    def allow(self):
+        if self.state == 'open' and time.time() - self.opened_at >= self.cooldown:
+            self.state = 'half_open'
+            return True  # The probe
+        return self.state == 'closed'
+
+    def success(self):
+        self.state = 'closed'
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.threshold:
+            self.state = 'open'
+            self.opened_at = time.time()
+
+
+class RetryBudget:
+    """
+    Caps retries to a peer at `ratio` of its calls, plus `min_rate` retries per second so that rarely called peers
+    can still be retried; at most `max_tokens` retries are saved up.
+    """
+    def __init__(self, ratio, min_rate, max_tokens):
+        self.ratio = ratio
+        self.min_rate = min_rate
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.refilled = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.refilled) * self.min_rate)
+        self.refilled = now
+
+    def deposit(self):
+        """Called once per call."""
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Takes one retry from the budget. Returns False if the budget is spent."""
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Timeouts, retries and failure detection for the RPCs of one node or client, per peer: adaptive timeouts from
+    an RttEstimator per (peer, RPC type), jittered exponential backoff between attempts, a CircuitBreaker and a
+    RetryBudget. An RPC counts as failed when send_rpc returns None (timeout, connection refused, ...); any
+    response, 'not the leader' errors included, counts as a success. Calls, retries, rejected calls and latencies
+    are counted in `metrics` (metrics.Metrics) if one is given.
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.estimators = {} # {(peer, rpc_type): RttEstimator}
+        self.breakers = {}   # {peer: CircuitBreaker}
+        self.budgets = {}    # {peer: RetryBudget}
+
+    def _estimator(self, peer, rpc_type):
+        if (peer, rpc_type) not in self.estimators:
+            self.estimators[(peer, rpc_type)] = RttEstimator(RPC_INITIAL_TIMEOUT, *RPC_TIMEOUT_BOUNDS)
+        return self.estimators[(peer, rpc_type)]
+
+    def _breaker(self, peer):
+        if peer not in self.breakers:
+            self.breakers[peer] = CircuitBreaker(CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN)
+        return self.breakers[peer]
+
+    def _budget(self, peer):
+        if peer not in self.budgets:
+            self.budgets[peer] = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_RATE, RETRY_BUDGET_MAX)
+        return self.budgets[peer]
+
+    def timeout(self, peer, rpc_type):
+        """Current timeout of rpc_type calls to peer."""
+        with self.lock:
+            return self._estimator(peer, rpc_type).timeout
+
+    def is_open(self, peer):
+        """True while calls to peer fail fast."""
+        with self.lock:
+            breaker = self._breaker(peer)
+            return breaker.state == 'open' and time.time() - breaker.opened_at < breaker.cooldown
+
+    @staticmethod
+    def backoff(attempt):
+        """Sleep before retry number `attempt` (0-based): uniformly random up to the capped exponential bound."""
+        return random.uniform(0, min(RPC_BACKOFF_CAP, RPC_BACKOFF_BASE * 2 ** attempt))
+
+    def admit(self, peer):
+        """Starts a call to peer: returns False while its breaker is open, else counts the call for its retry budget."""
+        with self.lock:
+            if not self._breaker(peer).allow():
+                if self.metrics:
+                    self.metrics.inc('rpc_client_rejected_total', peer=peer)
+                return False
+            self._budget(peer).deposit()
+            return True
+
+    def outcome(self, peer, rpc_type, response, elapsed, attempt_timeout, attempt, retry=False):
+        """
+        Records the outcome of attempt number `attempt` (0-based) of a call that took `elapsed` seconds. Returns True
+        if a call without a response may be retried: `retry` is set, the breaker of peer is still closed and its
+        retry budget has a retry left.
+        """
+        if self.metrics:
+            self.metrics.inc('rpc_client_calls_total', peer=peer, rpc_type=rpc_type, result='ok' if response is not None else 'failed')
+            if response is not None:
+                self.metrics.observe('rpc_client_duration_seconds', elapsed, rpc_type=rpc_type)
+        with self.lock:
+            breaker = self._breaker(peer)
+            if response is not None:
+                breaker.success()
+                if attempt == 0:  # Karn: a retried call's RTT is ambiguous
+                    self._estimator(peer, rpc_type).sample(elapsed)
+                return False
+            breaker.failure()
+            if elapsed >= attempt_timeout * 0.9:
+                self._estimator(peer, rpc_type).timed_out()
+            retrying = retry and breaker.state != 'open' and self._budget(peer).withdraw()
+        if retrying and self.metrics:
+            self.metrics.inc('rpc_client_retries_total', peer=peer, rpc_type=rpc_type)
+        return retrying
+
+    def call(self, peer, rpc_type, send, budget=None, timeout=None):
+        """
+        Calls send(timeout), which returns a response or None, and returns its response. With a `budget` (seconds),
+        a call that got no response is retried after a backoff until the budget is spent, the retry budget of the
+        peer runs out or its circuit breaker opens. `timeout` overrides the adaptive timeout of every attempt.
+        Returns None at once while the breaker of peer is open.
+        """
+        deadline = time.time() + budget if budget is not None else None
+        if not self.admit(peer):
+            return None
+
+        attempt = 0
+        while True:
+            attempt_timeout = timeout or self.timeout(peer, rpc_type)
+            if deadline is not None:
+                attempt_timeout = min(attempt_timeout, max(deadline - time.time(), 0.01))
+            started = time.time()
+            response = send(attempt_timeout)
+            elapsed = time.time() - started
+
+            if not self.outcome(peer, rpc_type, response, elapsed, attempt_timeout, attempt, retry=deadline is not None):
+                return response
+
+            pause = self.backoff(attempt)
+            if time.time() + pause >= deadline:
+                return None
+            time.sleep(pause)
+            attempt += 1
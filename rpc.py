@@ -0,0 +1,34 @@
+import json
+
+# Size of the chunks read from a socket
+RECV_CHUNK_SIZE = 65536
+
+
+def receive_request(sock):
+    """
+    Reads one JSON request from a socket. The client keeps the connection open for the response, so the
+    request is read until it parses as a complete JSON document. On a keep-alive connection the client sends its next
+    request only after the response, so the socket never holds more than one. Returns None if the peer sent nothing.
+    """
+    buffer = b''
+    while True:
+        chunk = sock.recv(RECV_CHUNK_SIZE)
+        if not chunk:
+            return json.loads(buffer) if buffer else None
+        buffer += chunk
+        if buffer.rstrip().endswith(b'}'):
+            try:
+                return json.loads(buffer)
+            except json.JSONDecodeError:
+                continue  # Only part of the request arrived so far
+
+
+def receive_response(sock):
+    """Reads a JSON response from a socket. The server closes the connection after responding."""
+    chunks = []
+    while True:
+        chunk = sock.recv(RECV_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b''.join(chunks))
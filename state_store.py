@@ -0,0 +1,49 @@
+import json
+import os
+
+
+class AccountStateStore:
+    """
+    Durable account balance of a participant replica. The balance lives in memory; the Raft log is its write-ahead
+    log. Every `checkpoint_every` applied entries the balance is written as a checkpoint together with the index of
+    the last Raft log entry it includes:
+
+        {'balance': ..., 'applied_index': ...}
+
+    A checkpoint is written to a temporary file, fsynced and renamed over the previous one, so a crash leaves
+    either the old or the new checkpoint, never a partial one. On restart the replica loads the checkpoint and
+    replays the balance entries logged after applied_index.
+    """
+    def __init__(self, path, checkpoint_every):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_index = -1 # applied_index of the latest checkpoint
+
+    def load(self):
+        """Returns (balance, applied_index) of the latest checkpoint, or None if there is none."""
+        try:
+            with open(self.path, 'r') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        self.checkpoint_index = checkpoint['applied_index']
+        return checkpoint['balance'], checkpoint['applied_index']
+
+    def checkpoint_due(self, applied_index):
+        """True once checkpoint_every entries were applied since the latest checkpoint."""
+        return applied_index - self.checkpoint_index >= self.checkpoint_every
+
+    def checkpoint(self, balance, applied_index):
+        """Atomically replaces the checkpoint with `balance` as of Raft log entry `applied_index`."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'balance': balance, 'applied_index': applied_index}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.checkpoint_index = applied_index
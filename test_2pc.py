@@ -0,0 +1,209 @@
+"""
+Regression tests of the 2PC paths, against the whole system running in this process (harness.LocalCluster).
+
+    python -m unittest test_2pc
+"""
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from async_client import AsyncClient2PC
+from balance_history import BalanceHistory
+from client import BaseClient
+from config import NODES, CLUSTER_A_NODES, COORDINATOR_NODE, LOCK_LEASE_TIMEOUT
+from harness import LocalCluster
+import txn_expr
+
+
+def send(node_name, rpc_type, data, timeout=5):
+    node_info = NODES[node_name]
+    return BaseClient.send_rpc(node_info['ip'], node_info['port'], rpc_type, data, timeout=timeout)
+
+
+def set_balance(account, balance):
+    async def run():
+        async with AsyncClient2PC(timeout=10) as client:
+            return await client.set_account_balance(account, balance)
+    return asyncio.run(run())
+
+
+class TwoPhaseCommitTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cluster = LocalCluster()
+        cls.cluster.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cluster.stop()
+
+    def leader_a(self):
+        return self.cluster.leader_of(CLUSTER_A_NODES)
+
+    def test_batch_commit_after_conflict_retry(self):
+        """A batch that lost a lock conflict, was released and prepared again still applies its commit."""
+        set_balance('AccountA', 100)
+        leader = self.leader_a()
+        ts = time.time()
+        # An older transaction holds the account, so the batch's first attempt loses the conflict
+        self.assertEqual(send(leader, '2pc_prepare', {'txid': 'blocker', 'ts': ts - 60, 'transactions': {'AccountA': 1}})['status'], 'prepared')
+        batch = {'batch_id': 'retried-batch', 'ts': ts, 'transactions': [{'txid': 'retried-tx', 'transactions': {'AccountA': 50}}]}
+        response = send(leader, '2pc_prepare_batch', {**batch, 'attempt': 0})
+        self.assertEqual(response.get('reason'), 'lock_conflict')
+
+        send(leader, '2pc_abort', {'txid': 'blocker'})
+        send(leader, '2pc_commit_batch', {'batch_id': 'retried-batch', 'commit': [], 'abort': [], 'attempt': 0})
+        response = send(leader, '2pc_prepare_batch', {**batch, 'attempt': 1})
+        self.assertEqual(response['votes'], {'retried-tx': 'prepared'})
+
+        response = send(leader, '2pc_commit_batch', {'batch_id': 'retried-batch', 'commit': batch['transactions'], 'abort': []})
+        self.assertEqual(response['status'], 'committed')
+        self.assertEqual(self.cluster.nodes[leader].account_balance, 150)
+
+    def test_prepared_reservation_outlives_lease(self):
+        """Once its lease expires, a prepared transaction still holds its reservation and its commit still applies."""
+        set_balance('AccountA', 100)
+        leader = self.leader_a()
+        lock_table = self.cluster.nodes[leader].lock_table
+        ts = time.time()
+        lock_table.lease_timeout = 0
+        try:
+            self.assertEqual(send(leader, '2pc_prepare', {'txid': 'expired-tx', 'ts': ts, 'transactions': {'AccountA': -80}})['status'], 'prepared')
+        finally:
+            lock_table.lease_timeout = LOCK_LEASE_TIMEOUT
+        response = send(leader, '2pc_prepare', {'txid': 'younger-tx', 'ts': ts + 1, 'transactions': {'AccountA': -80}})
+        self.assertEqual(response.get('reason'), 'lock_conflict')
+
+        response = send(leader, '2pc_commit', {'txid': 'expired-tx', 'transactions': {'AccountA': -80}})
+        self.assertEqual(response['status'], 'committed')
+        self.assertEqual(self.cluster.nodes[leader].account_balance, 20)
+
+    def test_resent_after_retried_commit(self):
+        """A transaction resent after its conflict retry committed is answered from the decision log, not run again."""
+        coordinator = self.cluster.nodes[self.cluster.leader_of({name: NODES[name] for name in COORDINATOR_NODE})]
+        replicated, record = coordinator.decide('resent-tx.2', 'commit', ['resent-tx.2'], [], {}, 'presumed_abort', base_txid='resent-tx')
+        self.assertTrue(replicated)
+        coordinator.end_round(record)
+        # A cluster without a leader would abort it, were it run again
+        response = send(coordinator.name, '2pc_request', {'txid': 'resent-tx', 'transactions': {'AccountA': -10, 'AccountC': 10},
+                                                          'simulation_num': 0, 'batching': False})
+        self.assertEqual(response['status'], 'committed')
+
+    def test_batch_keeps_request_options(self):
+        """Transactions batched in one window are prepared with the protocol and escrow setting each one asked for."""
+        set_balance('AccountA', 1000)
+        set_balance('AccountB', 1000)
+        coordinator = self.cluster.leader_of({name: NODES[name] for name in COORDINATOR_NODE})
+        options = {f'options-tx{i}': {'protocol': ('presumed_nothing', 'presumed_abort')[i % 2], 'escrow': i % 4 < 2} for i in range(8)}
+        with ThreadPoolExecutor(len(options)) as executor:
+            responses = list(executor.map(lambda txid: send(coordinator, '2pc_request', {
+                'txid': txid, 'transactions': {'AccountA': -1, 'AccountB': 1}, 'simulation_num': 0, **options[txid]}), options))
+        self.assertEqual([response['status'] for response in responses], ['committed'] * len(options))
+
+        records = {record['txid']: record for record in self.cluster.nodes[self.leader_a()].prepare_log if record.get('txid') in options}
+        for txid, requested in options.items():
+            self.assertEqual(records[txid]['protocol'], requested['protocol'])
+            self.assertEqual(bool(records[txid].get('escrow')), requested['escrow'])
+
+    def test_commit_ts_released_after_late_decision(self):
+        """A commit decision that reaches a majority only after decide() gave up still releases its commit timestamp."""
+        coordinators = {name: NODES[name] for name in COORDINATOR_NODE}
+        leader = self.cluster.leader_of(coordinators)
+        coordinator = self.cluster.nodes[leader]
+        followers = [name for name in coordinators if name != leader]
+        for name in followers:
+            self.cluster.kill(name)
+        try:
+            commit_ts = coordinator.next_commit_ts()
+            replicated, record = coordinator.decide('late-tx', 'commit', ['late-tx'], [], {}, 'presumed_abort', commit_ts)
+            self.assertFalse(replicated)
+            self.assertIn(commit_ts, coordinator.unacknowledged_commits)
+        finally:
+            for name in followers:
+                self.cluster.start_node(name)
+        deadline = time.time() + 10
+        while commit_ts in coordinator.unacknowledged_commits and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(coordinator.decision_log.decision('late-tx'), 'commit')
+        self.assertNotIn(commit_ts, coordinator.unacknowledged_commits)
+
+    def test_one_phase_commit_without_majority_is_unknown(self):
+        """A one-phase commit that missed its majority is reported unknown and holds snapshots back until it applies."""
+        set_balance('AccountA', 100)
+        leader = self.leader_a()
+        coordinator = self.cluster.nodes[self.cluster.leader_of({name: NODES[name] for name in COORDINATOR_NODE})]
+        followers = [name for name in CLUSTER_A_NODES if name != leader]
+        for name in followers:
+            self.cluster.kill(name)
+        try:
+            held = set(coordinator.unacknowledged_commits)
+            response = send(coordinator.name, '2pc_request', {'transactions': {'AccountA': -30}, 'simulation_num': 0}, timeout=30)
+            self.assertEqual(response['status'], 'unknown')
+            self.assertTrue(coordinator.unacknowledged_commits - held)
+        finally:
+            for name in followers:
+                self.cluster.start_node(name)
+        deadline = time.time() + 15
+        while coordinator.unacknowledged_commits - held and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(coordinator.unacknowledged_commits - held)
+        self.assertEqual(self.cluster.nodes[leader].account_balance, 70)
+
+    def test_set_balance_without_majority_holds_commit_ts(self):
+        """A SetBalance that missed its majority holds snapshots back until it applies."""
+        leader = self.leader_a()
+        coordinator = self.cluster.nodes[self.cluster.leader_of({name: NODES[name] for name in COORDINATOR_NODE})]
+        followers = [name for name in CLUSTER_A_NODES if name != leader]
+        for name in followers:
+            self.cluster.kill(name)
+        try:
+            held = set(coordinator.unacknowledged_commits)
+            response = send(coordinator.name, 'SetBalance', {'account': 'AccountA', 'balance': 55}, timeout=30)
+            self.assertEqual(response['status'], 'error')
+            self.assertTrue(coordinator.unacknowledged_commits - held)
+        finally:
+            for name in followers:
+                self.cluster.start_node(name)
+        deadline = time.time() + 15
+        while coordinator.unacknowledged_commits - held and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(coordinator.unacknowledged_commits - held)
+        self.assertEqual(self.cluster.nodes[leader].account_balance, 55)
+
+    def test_no_leader_aborts(self):
+        """A transaction on a cluster without a leader is aborted with a response, not dropped."""
+        response = send(self.cluster.leader_of({name: NODES[name] for name in COORDINATOR_NODE}), '2pc_request',
+                        {'transactions': {'AccountA': -10, 'AccountC': 10}, 'simulation_num': 0, 'batching': False}, timeout=30)
+        self.assertEqual(response['status'], 'aborted')
+        self.assertIn('No leader found for cluster C', response['message'])
+
+
+
+class BalanceHistoryTest(unittest.TestCase):
+    def test_set_is_an_absolute_version(self):
+        """Snapshots replay a set as the balance it wrote, also when deltas stamped around it apply out of order."""
+        history = BalanceHistory(16)
+        history.reset(10, 0)
+        history.record_delta(30, 5)   # Applied before the set, which overwrote it on the account
+        history.record_set(20, 100)
+        history.record_delta(15, 7)   # Applied after the set, on top of it
+        self.assertEqual(history.balance_at(10), 10)
+        self.assertEqual(history.balance_at(15), 17)
+        self.assertEqual(history.balance_at(25), 107)
+        self.assertEqual(history.balance_at(30), 107)
+
+
+
+class ValidateTest(unittest.TestCase):
+    def test_numbers_but_not_bools(self):
+        """Deltas, set values and guards may be ints or floats; bools are rejected."""
+        for transactions in ({'AccountA': -1.5, 'AccountB': 1.5}, {'AccountA': {'delta': 2.5}}, {'AccountA': {'set': 10}},
+                             {'AccountA': {'delta': 1, 'expect': 10.0, 'min_balance': 0}}):
+            self.assertIsNone(txn_expr.validate(transactions))
+        for transactions in ({'AccountA': True}, {'AccountA': {'set': False}}, {'AccountA': {'delta': 1, 'min_balance': True}},
+                             {'AccountA': {'delta': 1, 'expect': '10'}}):
+            self.assertIn('must', txn_expr.validate(transactions))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Stitches the timeline of one transaction from the spans every node recorded for it (GetTrace): the coordinator's
+start_2pc span with its phases and RPCs, under each RPC the participant leader's handling of it (lock waits,
+replication, apply), and under the replication the AppendEntries its followers handled. A batched transaction
+shares its prepare and commit rounds with the rest of its batch; those are traced as the batch and shown under
+the transaction.
+
+    python trace_2pc.py <txid> [--json]
+
+Offsets are relative to the start of the transaction and come from each node's clock, so across machines they
+are only as accurate as the clocks are synchronised.
+"""
+import argparse
+import asyncio
+import json
+from async_client import AsyncClient2PC
+
+# Width of the bar drawn for each span, in characters
+BAR_WIDTH = 40
+
+
+async def collect_trace(client, txid):
+    """Returns every span recorded for the transaction txid, and for the batch it ran in, on any node."""
+    spans = [span for node_spans in (await client.get_trace([txid])).values() for span in node_spans]
+    batch_ids = {span['attributes'].get('batch_id') for span in spans} - {None}
+    if batch_ids:
+        spans += [span for node_spans in (await client.get_trace(batch_ids)).values() for span in node_spans]
+    return list({span['span_id']: span for span in spans}.values())
+
+
+def format_timeline(txid, spans):
+    """Formats spans as an indented tree, children in order of their start, with offsets and durations in ms."""
+    if not spans:
+        return f"No spans recorded for {txid} (tracing disabled, or evicted from the nodes' buffers)"
+    by_id = {span['span_id']: span for span in spans}
+    # A batch's root span hangs under the start_2pc span of the transaction that ran in it
+    batch_parents = {span['attributes']['batch_id']: span['span_id'] for span in spans if span['attributes'].get('batch_id')}
+    children = {}
+    for span in spans:
+        parent_id = span['parent_id'] if span['parent_id'] in by_id else batch_parents.get(span['trace_id'])
+        children.setdefault(parent_id, []).append(span)
+
+    origin = min(span['start'] for span in spans)
+    total = max(span['start'] + span['duration'] for span in spans) - origin or 1e-9
+    lines = [f"Transaction {txid}: {len(spans)} spans on {len({span['node'] for span in spans})} nodes, {total * 1000:.2f} ms",
+             f"{'start ms':>10} {'took ms':>9}  {'node':<18} {'':<{BAR_WIDTH}}  span"]
+
+    def add(span, depth):
+        offset = span['start'] - origin
+        first = int(offset / total * BAR_WIDTH)
+        width = max(1, round(span['duration'] / total * BAR_WIDTH))
+        bar = (' ' * first + '=' * width)[:BAR_WIDTH]
+        attributes = ' '.join(f"{key}={value}" for key, value in span['attributes'].items() if value is not None)
+        lines.append(f"{offset * 1000:10.2f} {span['duration'] * 1000:9.2f}  {span['node']:<18} {bar:<{BAR_WIDTH}}  "
+                     f"{'  ' * depth}{span['name']} {attributes}".rstrip())
+        for child in sorted(children.get(span['span_id'], []), key=lambda child: child['start']):
+            add(child, depth + 1)
+
+    for root in sorted(children.get(None, []), key=lambda span: span['start']):
+        add(root, 0)
+    return '\n'.join(lines)
+
+
+async def main(args):
+    async with AsyncClient2PC() as client:
+        spans = await collect_trace(client, args.txid)
+    if args.json:
+        print(json.dumps(sorted(spans, key=lambda span: span['start']), indent=2))
+    else:
+        print(format_timeline(args.txid, spans))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Timeline of one transaction across the coordinator and the participants")
+    parser.add_argument('txid', help='txid returned by the coordinator for the transaction')
+    parser.add_argument('--json', action='store_true', help='print the raw spans instead')
+    asyncio.run(main(parser.parse_args()))
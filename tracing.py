@@ -0,0 +1,92 @@
+"""
+Tracing of transactions across the coordinator and the participants. A trace is a tree of spans (timed operations
+on one node) sharing a trace ID; the coordinator starts one per transaction, with the txid as trace ID, and one per
+batch, with the batch_id. The context of the current span, {'trace_id', 'span_id'}, travels with RPCs as the
+'trace' field of their data, so the spans of the receiving node join the trace.
+
+Each node keeps its finished spans in a ring buffer (GetTrace); trace_2pc.py collects them from all nodes.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Records the spans of one node. Spans are only recorded inside a trace: span() and record() do nothing unless
+    a parent context is given or the calling thread is inside a span already, so untraced work (heartbeats,
+    elections) costs nothing. Work handed to another thread has to be given the context explicitly.
+    """
+    def __init__(self, node_name, capacity, enabled=True):
+        self.node_name = node_name
+        self.enabled = enabled
+        self.spans = deque(maxlen=capacity)  # Finished spans, oldest dropped first
+        self.lock = threading.Lock()
+        self.local = threading.local()       # Stack of the spans the current thread is inside of
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def context(self):
+        """Returns the context of the current thread's innermost span ({'trace_id', 'span_id'}), or None."""
+        stack = self._stack()
+        if not stack:
+            return None
+        return {'trace_id': stack[-1]['trace_id'], 'span_id': stack[-1]['span_id']}
+
+    @contextmanager
+    def trace(self, name, trace_id, **attributes):
+        """Starts a new trace with a root span. Yields the span (a dict; its 'attributes' may be extended), or None."""
+        if not self.enabled:
+            yield None
+            return
+        with self._span(name, trace_id, None, attributes) as span:
+            yield span
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """
+        Runs the body as a span, child of `parent` (a context received with an RPC) or else of the current span.
+        Yields the span, or None if there is no trace to join.
+        """
+        parent = parent or self.context()
+        if not self.enabled or not parent:
+            yield None
+            return
+        with self._span(name, parent['trace_id'], parent['span_id'], attributes) as span:
+            yield span
+
+    @contextmanager
+    def _span(self, name, trace_id, parent_id, attributes):
+        span = {'trace_id': trace_id, 'span_id': uuid.uuid4().hex[:16], 'parent_id': parent_id, 'name': name,
+                'node': self.node_name, 'start': time.time(), 'attributes': attributes}
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span['duration'] = time.time() - span['start']
+            with self.lock:
+                self.spans.append(span)
+
+    def record(self, name, start_time, **attributes):
+        """Records a span of the current trace that started at start_time (time.time()) and ends now."""
+        parent = self.context()
+        if not self.enabled or not parent:
+            return
+        span = {'trace_id': parent['trace_id'], 'span_id': uuid.uuid4().hex[:16], 'parent_id': parent['span_id'],
+                'name': name, 'node': self.node_name, 'start': start_time, 'duration': time.time() - start_time,
+                'attributes': attributes}
+        with self.lock:
+            self.spans.append(span)
+
+    def get(self, trace_ids):
+        """Returns the recorded spans of the given traces."""
+        trace_ids = set(trace_ids)
+        with self.lock:
+            return [span for span in self.spans if span['trace_id'] in trace_ids]
@@ -0,0 +1,119 @@
+"""
+Server-side transaction operations. Besides a plain numeric delta, the operation of an account in a transaction
+may be a dict evaluated by the participant at prepare time, while it holds the account's lock:
+
+    {'delta': <expr>}                 add <expr> to the balance
+    {'set': <expr>}                   set the balance to <expr>
+    optional guards:
+    'expect': <number>                abort unless the balance is exactly this (compare-and-set)
+    'min_balance': <number>           abort unless the new balance is at least this
+
+An <expr> is a number or {'balance_of': <account>, 'times': <number>, 'plus': <int>}, which evaluates to
+int(balance * times) + plus ('times' defaults to 1, 'plus' to 0). The bonus of 20% of Account A's balance for
+both accounts is:
+
+    {'AccountA': {'delta': {'balance_of': 'AccountA', 'times': 0.2}},
+     'AccountB': {'delta': {'balance_of': 'AccountA', 'times': 0.2}}}
+
+An expression may refer to another account of the same transaction. That account is prepared first (in the first
+wave) and reports its balance, which the coordinator passes on as 'inputs' when preparing the accounts depending
+on it (the second wave). Since the first account stays locked until the transaction ends, the value read is the
+value the transaction commits against.
+"""
+
+OPERATION_KEYS = {'delta', 'set', 'expect', 'min_balance'}
+EXPRESSION_KEYS = {'balance_of', 'times', 'plus'}
+
+
+def is_number(value):
+    """True for an int or float; bools are ints to Python but not amounts."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_expression(operation):
+    """True for an operation that has to be evaluated by the participant (anything but a plain delta)."""
+    return isinstance(operation, dict)
+
+
+def has_expressions(transactions):
+    return any(is_expression(operation) for operation in transactions.values())
+
+
+def references(operation):
+    """Returns the accounts whose balance an operation reads."""
+    if not is_expression(operation):
+        return set()
+    value = operation.get('delta', operation.get('set'))
+    return {value['balance_of']} if isinstance(value, dict) else set()
+
+
+def validate(transactions):
+    """Returns an error message for malformed operations or unsupported references, or None."""
+    for account, operation in transactions.items():
+        if not is_expression(operation):
+            if not is_number(operation):
+                return f"Operation of {account} must be a number delta or an expression"
+            continue
+        if set(operation) - OPERATION_KEYS or ('delta' in operation) == ('set' in operation):
+            return f"Operation of {account} needs exactly one of 'delta' or 'set', and only 'expect' and 'min_balance' as guards"
+        for guard in ('expect', 'min_balance'):
+            if guard in operation and not is_number(operation[guard]):
+                return f"'{guard}' of {account} must be a number"
+        value = operation.get('delta', operation.get('set'))
+        if isinstance(value, dict):
+            if set(value) - EXPRESSION_KEYS or 'balance_of' not in value:
+                return f"Expression of {account} must be {{'balance_of': account, 'times': number, 'plus': integer}}"
+            if not is_number(value.get('times', 1)) or not isinstance(value.get('plus', 0), int):
+                return f"Expression of {account} has a non-numeric 'times' or 'plus'"
+        elif not is_number(value):
+            return f"Operation of {account} must have a number or an expression as value"
+
+    # Two waves at most: an account read by another account must not itself read a third one
+    for account in transactions:
+        for referenced in references(transactions[account]) - {account}:
+            if references(transactions.get(referenced, 0)) - {referenced}:
+                return f"{account} reads {referenced}, which reads another account itself"
+    return None
+
+
+def normalize(transactions):
+    """
+    Returns the transactions with every account read by an expression taking part: a read account without an
+    operation, or with a zero delta, gets {'delta': 0}, so it is prepared (and locked) rather than left out.
+    """
+    normalized = dict(transactions)
+    for operation in transactions.values():
+        for account in references(operation):
+            if normalized.get(account, 0) == 0:
+                normalized[account] = {'delta': 0}
+    return normalized
+
+
+def waves(transactions):
+    """Splits the accounts of a transaction into those prepared first and those reading another account's balance."""
+    dependent = [account for account, operation in transactions.items() if references(operation) - {account}]
+    return [account for account in transactions if account not in dependent], dependent
+
+
+def evaluate(operation, account, balance, inputs=None):
+    """
+    Evaluates the operation of `account` against its current `balance`, with the balances of the other accounts it
+    reads in `inputs`. Returns (delta, None), or (None, reason) if a guard fails.
+    """
+    if not is_expression(operation):
+        return operation, None
+    if 'expect' in operation and balance != operation['expect']:
+        return None, 'unexpected_balance'
+
+    value = operation.get('delta', operation.get('set'))
+    if isinstance(value, dict):
+        read_account = value['balance_of']
+        read_balance = balance if read_account == account else (inputs or {}).get(read_account)
+        if read_balance is None:
+            return None, 'missing_input'
+        value = int(read_balance * value.get('times', 1)) + value.get('plus', 0)
+    delta = value if 'delta' in operation else value - balance
+
+    if 'min_balance' in operation and balance + delta < operation['min_balance']:
+        return None, 'below_min_balance'
+    return delta, None
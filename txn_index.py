@@ -0,0 +1,75 @@
+import threading
+from record_log import RecordLog
+
+
+class TransactionIndex:
+    """
+    Maps each transaction ID to its state on this participant and to the position of its records in the prepare and
+    commit logs (their line numbers, which are also their indices in prepare_log/commit_log):
+
+        {txid: {'state': 'prepared' | 'committed' | 'aborted', 'prepare': position | None, 'commit': position | None}}
+
+    Every change is appended to an index file (JSON Lines, not fsynced). On start the file is read back and only the
+    log records past the positions it already covers are indexed, so a lost tail of the index file is rebuilt from
+    the logs. Aborts are not in the logs: an abort lost in a crash leaves the transaction 'prepared' (in doubt).
+    """
+    def __init__(self, path):
+        self.entries = {}
+        self.next_positions = {'prepare': 0, 'commit': 0} # First log positions not covered by the index file
+        self.lock = threading.Lock()
+        self.file = RecordLog(path)
+        for change in self.file.records():
+            self._apply(change)
+
+    def _apply(self, change):
+        """Applies one change record {'txid', 'state', and 'prepare' or 'commit': position} to the index."""
+        entry = self.entries.setdefault(change['txid'], {'state': None, 'prepare': None, 'commit': None})
+        if entry['state'] == 'committed' and change['state'] != 'committed':
+            return  # Commits are final
+        entry['state'] = change['state']
+        for log in ('prepare', 'commit'):
+            if change.get(log) is not None:
+                entry[log] = change[log]
+                self.next_positions[log] = max(self.next_positions[log], change[log] + 1)
+
+    def _record(self, change):
+        with self.lock:
+            self._apply(change)
+            self.file.append(change)
+
+    def catch_up(self, prepare_log, commit_log):
+        """Indexes the prepare and commit log records the index file does not cover yet."""
+        for position in range(self.next_positions['prepare'], len(prepare_log)):
+            self.record_prepare(prepare_log[position].get('txid'), position)
+        for position in range(self.next_positions['commit'], len(commit_log)):
+            self.record_commit(commit_log[position].get('txid'), position)
+
+    def record_prepare(self, txid, position):
+        """Records that the prepare record of txid is at `position` of the prepare log."""
+        if txid is not None:
+            self._record({'txid': txid, 'state': 'prepared', 'prepare': position})
+
+    def record_commit(self, txid, position):
+        """Records that the commit record of txid is at `position` of the commit log."""
+        if txid is not None:
+            self._record({'txid': txid, 'state': 'committed', 'commit': position})
+
+    def record_abort(self, txid):
+        """Records that txid was aborted (ignored for committed transactions)."""
+        if txid is not None:
+            self._record({'txid': txid, 'state': 'aborted'})
+
+    def get(self, txid):
+        """Returns a copy of the index entry of txid, or None if this participant never heard of it."""
+        with self.lock:
+            entry = self.entries.get(txid)
+            return dict(entry) if entry else None
+
+    def state(self, txid):
+        """Returns 'prepared', 'committed', 'aborted' or None."""
+        with self.lock:
+            entry = self.entries.get(txid)
+            return entry['state'] if entry else None
+
+    def close(self):
+        self.file.close()